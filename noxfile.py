@@ -6,3 +6,9 @@ def lint(session):
     print(session.python)
     session.run("poetry", "install", "--no-root", external=True)
     session.run("poetry", "run", "ruff", "check", ".", external=True)
+
+# Run the tests across multiple python versions (to run: nox -s tests)
+@nox_poetry.session(python=["3.10", "3.11", "3.12", "3.13"])
+def tests(session):
+    session.run("poetry", "install", external=True)
+    session.run("poetry", "run", "pytest", external=True)
@@ -1,4 +1,4 @@
-from src import tle, util, tracking, settings, paths, transponders, test
+from src import tle, util, tracking, settings, paths, transponders, test, emulators
 import argparse, logging
 
 def set_debug():
@@ -38,11 +38,11 @@ def no_args_message(_args):
     
 
 # update subcommand functions
-def update_all(_args):
+def update_all(args):
     logging.log(logging.INFO, "Updating TLEs..")
     tle.download_TLEs()
     logging.log(logging.INFO, "Updating transponders")
-    transponders.download_transponders()
+    transponders.download_transponders(args.known_only)
     logging.log(logging.INFO, "Done!")
     exit()
 
@@ -51,11 +51,17 @@ def update_TLEs(_args):
     logging.log(logging.INFO, "Done!")
     exit()
 
-def update_transponders(_args):
-    transponders.download_transponders()
+def update_transponders(args):
+    transponders.download_transponders(args.known_only)
     logging.log(logging.INFO, "Done!")
     exit()
 
+# transponders subcommand functions
+def search_transponders(args):
+    NORAD_ID = util.satellite_norad_from_input(args.satellite) if args.satellite else None
+    transponders.search_transponders(NORAD_ID, args.downlink_band, args.uplink_band, args.mode, args.type, True if args.alive else None, args.linear)
+    exit()
+
 # sources subcommand functions
 def add_source(_args):
     logging.log(logging.INFO, "Enter the URL to the source your would like to add.")
@@ -87,9 +93,19 @@ def track(args):
     elif args.rotor_inverted:
         rotor_mode_overwrite = 2
 
-    tracking.track(util.satellite_norad_from_input(args.satellite), args.rotor, args.radio, args.rotor_usb, args.rx_usb, args.tx_usb, args.trx_usb, not args.unlock, rotor_mode_overwrite)
+    tracking.track(util.satellite_norad_from_input(args.satellite, args.best_match), args.rotor, args.radio, args.rotor_usb, args.rx_usb, args.tx_usb, args.trx_usb, not args.unlock, rotor_mode_overwrite, args.intercept,
+                   args.transponder, args.choose_transponder)
 
 # testing subcommands
+def _single_rotor(args) -> str | None:
+    """Get the rotor config name for commands that only work with a single rotor"""
+    if args.rotor is None:
+        return None
+    if len(args.rotor) > 1:
+        logging.log(logging.ERROR, "This command only supports a single rotor.")
+        exit()
+    return args.rotor[0]
+
 def test_rotor(args):
     rotor_mode_overwrite = None
     if args.rotor_normal:
@@ -97,7 +113,7 @@ def test_rotor(args):
     elif args.rotor_inverted:
         rotor_mode_overwrite = 2
 
-    test.rotor_test(args.rotor, args.rotor_usb, rotor_mode_overwrite)
+    test.rotor_test(_single_rotor(args), args.rotor_usb, rotor_mode_overwrite)
 
 def test_rotor_full(args):
     rotor_mode_overwrite = None
@@ -106,7 +122,7 @@ def test_rotor_full(args):
     elif args.rotor_inverted:
         rotor_mode_overwrite = 2
 
-    test.rotor_test_full(args.rotor, args.rotor_usb, rotor_mode_overwrite)
+    test.rotor_test_full(_single_rotor(args), args.rotor_usb, rotor_mode_overwrite)
 
 def test_rotor_home(args):
     rotor_mode_overwrite = None
@@ -115,7 +131,28 @@ def test_rotor_home(args):
     elif args.rotor_inverted:
         rotor_mode_overwrite = 2
 
-    test.rotor_home(args.rotor, args.rotor_usb, rotor_mode_overwrite)
+    test.rotor_home(_single_rotor(args), args.rotor_usb, rotor_mode_overwrite)
+
+def test_rotor_characterize(args):
+    rotor_mode_overwrite = None
+    if args.rotor_normal:
+        rotor_mode_overwrite = 1
+    elif args.rotor_inverted:
+        rotor_mode_overwrite = 2
+
+    test.rotor_characterize(_single_rotor(args), args.rotor_usb, rotor_mode_overwrite)
+
+def test_emulate_rotor(args):
+    test.emulate_rotor(args.protocol)
+
+def test_emulate_rig(args):
+    test.emulate_rig(args.protocol)
+
+def test_emulate_hamlib(args):
+    test.emulate_hamlib(args.kind, args.latency/1000, args.port)
+
+def test_benchmark_hamlib(args):
+    test.benchmark_hamlib(args.iterations)
 
 def test_radio(args):
     test.test_radio(args.radio, args.downlink, args.uplink, args.rx_usb, args.tx_usb, args.trx_usb)
@@ -166,10 +203,36 @@ def set_up_argparse():
     parser_update_tle.set_defaults(func=update_TLEs)
 
     parser_update_transponders = update_sub.add_parser("transponders", help="Update transponders file")
+    parser_update_transponders.add_argument("--known-only", action="store_true",
+                                            help="Skip satellites that aren't in the local TLE catalogue")
     parser_update_transponders.set_defaults(func=update_transponders)
 
+    parser_update.add_argument("--known-only", action="store_true",
+                               help="Only store transponders of satellites in the local TLE catalogue")
     parser_update.set_defaults(func=update_all)
 
+    # transponders subcommands
+    band_letters = [letter for _, _, letter in util.FREQUENCY_BAND_LETTERS] + ["O"]
+    parser_transponders = sub_parsers.add_parser("transponders", help="Search downloaded transponder data")
+    transponders_sub = parser_transponders.add_subparsers(required=True)
+
+    parser_transponders_search = transponders_sub.add_parser("search", help="Find transponders of all satellites by band, mode and type")
+    parser_transponders_search.add_argument("--satellite", type=str,
+                                            help="Only show transponders of this satellite (NORAD ID, COSPAR ID or name)")
+    parser_transponders_search.add_argument("--downlink-band", choices=band_letters,
+                                            help="Downlink band letter, see the transponder selection help menu")
+    parser_transponders_search.add_argument("--uplink-band", choices=band_letters,
+                                            help="Uplink band letter")
+    parser_transponders_search.add_argument("--mode", type=str,
+                                            help="Mode of the transponder, like USB or FM")
+    parser_transponders_search.add_argument("--type", choices=transponders.TRANSPONDER_TYPES.keys(),
+                                            help="Type of the transponder")
+    parser_transponders_search.add_argument("--alive", action="store_true",
+                                            help="Only show transponders that are marked as alive")
+    parser_transponders_search.add_argument("--linear", action="store_true",
+                                            help="Only show linear transponders (transponders relaying a range of frequencies)")
+    parser_transponders_search.set_defaults(func=search_transponders)
+
     # sources subcommands
     parser_sources = sub_parsers.add_parser("sources", help="Manage TLE sources")
     sources_sub = parser_sources.add_subparsers(required=True)
@@ -185,8 +248,8 @@ def set_up_argparse():
 
     # common parser for arguments shared between tracking and testing subcommands (argparse is very weird)
     parser_control_common = argparse.ArgumentParser(add_help=False)
-    parser_control_common.add_argument("--rotor", type=str, choices=tracking.list_rotors(), dest="rotor",
-                              help="The name of a rotor config file (without file extension)")
+    parser_control_common.add_argument("--rotor", type=str, choices=tracking.list_rotors(), dest="rotor", action="append",
+                              help="The name of a rotor config file (without file extension). Can be given multiple times to track with several rotors")
     parser_control_common.add_argument("--radio", type=str, choices=tracking.list_radios(),
                               help="The name of a radio config file (without file extension)")
     parser_control_common.add_argument("-o", "--rotor_usb", type=str,
@@ -208,6 +271,17 @@ def set_up_argparse():
                                                   "TLE must be avaliable in local database.")
     parser_track.add_argument("-u", "--unlock", action="store_true",
                               help="Don't lock uplink and downlink together for satellites with a frequency range.")
+    parser_track.add_argument("--intercept", action="store_true",
+                              help="If the rotor can't reach the start of the pass in time, start tracking mid-slew towards the first reachable point of the pass.")
+    parser_track.add_argument("--transponder", type=str, action="append",
+                              help="Transponder to track without prompting: its UUID, its index in the selection menu or a mode pattern like 'USB' or 'FM*' " \
+                                   "(picks the first alive match, or the first match with a warning if none are alive). " \
+                                   "Can be given multiple times to track several transponders. The selection is remembered for the satellite.")
+    parser_track.add_argument("--choose-transponder", action="store_true",
+                              help="Prompt for the transponders even if a selection is remembered for the satellite.")
+    parser_track.add_argument("--best-match", action="store_true",
+                              help="If the satellite name matches several satellites, pick the best match instead of prompting: " \
+                                   "an exact name, then a name starting with the input, then the shortest name, then the lowest NORAD ID.")
     parser_track.set_defaults(func=track)
 
     # testing subcommands
@@ -224,6 +298,38 @@ def set_up_argparse():
     parser_test_rotor_full = test_rotor_sub.add_parser("full", help="Test a rotor by moving it to various points", parents=[parser_control_common])
     parser_test_rotor_full.set_defaults(func=test_rotor_full)
 
+    parser_test_rotor_characterize = test_rotor_sub.add_parser("characterize", help="Measure rotor dynamics (slew rate, latency, backlash...) and store them as the rotors profile", parents=[parser_control_common])
+    parser_test_rotor_characterize.set_defaults(func=test_rotor_characterize)
+
+    parser_test_emulate = test_sub.add_parser("emulate", help="Emulate hardware for testing without it")
+    test_emulate_sub = parser_test_emulate.add_subparsers(required=True)
+
+    parser_test_emulate_rotor = test_emulate_sub.add_parser("rotor", help="Emulate a rotor controller on a pseudo-terminal")
+    parser_test_emulate_rotor.add_argument("protocol", choices=emulators.EMULATED_ROTOR_PROTOCOLS,
+                                           help="The protocol of the emulated rotor controller")
+    parser_test_emulate_rotor.set_defaults(func=test_emulate_rotor)
+
+    parser_test_emulate_rig = test_emulate_sub.add_parser("rig", help="Emulate a radio with a native CAT protocol on a pseudo-terminal")
+    parser_test_emulate_rig.add_argument("protocol", choices=emulators.EMULATED_RIG_PROTOCOLS,
+                                         help="The CAT protocol of the emulated radio")
+    parser_test_emulate_rig.set_defaults(func=test_emulate_rig)
+
+    for kind in emulators.HAMLIB_STAND_IN_KINDS:
+        parser_test_emulate_hamlib = test_emulate_sub.add_parser(kind, help=f"Serve a {kind} stand-in with injected latency")
+        parser_test_emulate_hamlib.add_argument("--latency", type=float, default=0,
+                                                help="Round trip latency to inject in milliseconds")
+        parser_test_emulate_hamlib.add_argument("--port", type=int, default=0,
+                                                help="Port to listen on. A free port is chosen if not set")
+        parser_test_emulate_hamlib.set_defaults(func=test_emulate_hamlib, kind=kind)
+
+    parser_test_benchmark = test_sub.add_parser("benchmark", help="Measure the latency of backends")
+    test_benchmark_sub = parser_test_benchmark.add_subparsers(required=True)
+
+    parser_test_benchmark_hamlib = test_benchmark_sub.add_parser("hamlib", help="Compare rigctld/rotctld with hamlibs python bindings using dummy devices")
+    parser_test_benchmark_hamlib.add_argument("--iterations", type=int, default=200,
+                                              help="Number of exchanges to time for each backend")
+    parser_test_benchmark_hamlib.set_defaults(func=test_benchmark_hamlib)
+
     parser_test_radio = test_sub.add_parser("radio", help="Test a radio", parents=[parser_control_common])
     parser_test_radio.add_argument("--downlink", type=int,
                               help="Downlink frequency in herz to set the radios to")
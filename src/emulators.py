@@ -0,0 +1,341 @@
+from typing import List
+import os, time, logging, select, socket, threading
+
+EMULATED_ROTOR_PROTOCOLS = ["gs232a", "gs232b", "easycomm2", "easycomm3", "rot2prog"]
+EMULATOR_POLL_INTERVAL = 0.05 # Seconds between motion updates of emulated devices
+HAMLIB_STAND_IN_KINDS = ["rotctld", "rigctld"]
+EMULATED_RIG_PROTOCOLS = ["civ", "yaesu", "ft847"]
+EMULATED_CIV_ADDRESS = 0xA2 # CI-V address the emulated Icom radio answers to (IC-9700)
+
+def open_pty() -> tuple[int, str]:
+    """
+    Open a pseudo-terminal in raw mode. Returns the master file descriptor and the path of the slave device, which can be used like a serial port.
+    Only available on POSIX systems.
+    """
+    import tty
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    return (master, os.ttyname(slave))
+
+class Simulated_Rotor():
+    def __init__(self, az_speed: float = 6.0, el_speed: float = 3.0) -> None:
+        """
+        A simple rotor model that moves towards its target at a constant speed.
+        """
+        self.az_speed = az_speed
+        self.el_speed = el_speed
+        self.azimuth = 0.0
+        self.elevation = 0.0
+        self.target_azimuth = 0.0
+        self.target_elevation = 0.0
+        self.last_update = time.monotonic()
+
+    def update(self):
+        """Move the rotor according to the time since the last update."""
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+
+        az_step = self.az_speed * elapsed
+        el_step = self.el_speed * elapsed
+        self.azimuth += max(-az_step, min(az_step, self.target_azimuth - self.azimuth))
+        self.elevation += max(-el_step, min(el_step, self.target_elevation - self.elevation))
+
+    def set_target(self, azimuth: float, elevation: float):
+        self.update()
+        self.target_azimuth = azimuth
+        self.target_elevation = elevation
+
+class Rotor_Emulator():
+    def __init__(self, protocol: str, rotor: Simulated_Rotor | None = None) -> None:
+        """
+        Emulates a rotor controller speaking one of EMULATED_ROTOR_PROTOCOLS on a byte stream.
+        """
+        if protocol not in EMULATED_ROTOR_PROTOCOLS:
+            raise ValueError(f"Unknown rotor protocol '{protocol}'")
+
+        self.protocol = protocol
+        self.rotor = rotor if rotor else Simulated_Rotor()
+        self.buffer = bytearray()
+
+    def _text_lines(self, terminator: bytes) -> List[str]:
+        """Split all complete lines from the input buffer."""
+        lines = []
+        while terminator in self.buffer:
+            index = self.buffer.index(terminator)
+            lines.append(self.buffer[:index].decode("ascii", errors="replace").strip())
+            del self.buffer[:index+1]
+        return lines
+
+    def _handle_gs232(self) -> bytes:
+        response = b""
+        for line in self._text_lines(b"\r"):
+            if line.startswith("W"):
+                azimuth, elevation = line[1:].split()
+                self.rotor.set_target(float(azimuth), float(elevation))
+            elif line == "C2":
+                azimuth, elevation = round(self.rotor.azimuth), round(self.rotor.elevation)
+                if self.protocol == "gs232a":
+                    response += f"+0{azimuth:03d}+0{elevation:03d}\r".encode("ascii")
+                else:
+                    response += f"AZ={azimuth:03d}  EL={elevation:03d}\r".encode("ascii")
+        return response
+
+    def _handle_easycomm(self) -> bytes:
+        response = b""
+        for line in self._text_lines(b"\n"):
+            tokens = line.split()
+            if tokens == ["AZ", "EL"]:
+                response += f"AZ{self.rotor.azimuth:.1f} EL{self.rotor.elevation:.1f}\n".encode("ascii")
+            elif tokens == ["AZ"]:
+                response += f"AZ{self.rotor.azimuth:.1f}\n".encode("ascii")
+            elif tokens == ["EL"]:
+                response += f"EL{self.rotor.elevation:.1f}\n".encode("ascii")
+            else:
+                azimuth, elevation = self.rotor.target_azimuth, self.rotor.target_elevation
+                for token in tokens:
+                    if token.startswith("AZ") and len(token) > 2:
+                        azimuth = float(token[2:])
+                    elif token.startswith("EL") and len(token) > 2:
+                        elevation = float(token[2:])
+                self.rotor.set_target(azimuth, elevation)
+        return response
+
+    def _handle_rot2prog(self) -> bytes:
+        response = b""
+        while len(self.buffer) >= 13:
+            frame = bytes(self.buffer[:13])
+            del self.buffer[:13]
+            if frame[0:1] != b"W":
+                continue
+
+            command = frame[11]
+            if command == 0x2F:
+                azimuth = int(frame[1:5].decode("ascii"))/frame[5] - 360
+                elevation = int(frame[6:10].decode("ascii"))/frame[10] - 360
+                self.rotor.set_target(azimuth, elevation)
+            elif command == 0x0F:
+                self.rotor.set_target(self.rotor.azimuth, self.rotor.elevation)
+
+            if command in (0x1F, 0x0F):
+                azimuth = round((self.rotor.azimuth + 360) * 10)
+                elevation = round((self.rotor.elevation + 360) * 10)
+                response += b"W" + bytes([azimuth//1000, azimuth//100 % 10, azimuth//10 % 10, azimuth % 10, 10])
+                response += bytes([elevation//1000, elevation//100 % 10, elevation//10 % 10, elevation % 10, 10, 0x20])
+        return response
+
+    def handle(self, data: bytes) -> bytes:
+        """Feed received bytes into the emulator and return the bytes to respond with."""
+        self.rotor.update()
+        self.buffer += data
+
+        if self.protocol in ("gs232a", "gs232b"):
+            return self._handle_gs232()
+        elif self.protocol in ("easycomm2", "easycomm3"):
+            return self._handle_easycomm()
+        return self._handle_rot2prog()
+
+    def run(self, fd: int):
+        """Serve the emulated controller on a file descriptor (usually a pty master) until interrupted."""
+        while True:
+            readable, _, _ = select.select([fd], [], [], EMULATOR_POLL_INTERVAL)
+            self.rotor.update()
+            if not readable:
+                continue
+
+            try:
+                data = os.read(fd, 1024)
+            except OSError: # No client connected to the pty at the moment
+                time.sleep(EMULATOR_POLL_INTERVAL)
+                continue
+
+            response = self.handle(data)
+            if response:
+                logging.log(logging.DEBUG, f"Emulator: {data!r} -> {response!r}")
+                os.write(fd, response)
+
+class Rig_Emulator():
+    def __init__(self, protocol: str, echo: bool = True) -> None:
+        """
+        Emulates a radio speaking one of EMULATED_RIG_PROTOCOLS on a byte stream. Only the frequency commands are implemented.
+        The emulated Icom radio echoes every frame it receives if echo is set, like radios with CI-V echo enabled do.
+        """
+        if protocol not in EMULATED_RIG_PROTOCOLS:
+            raise ValueError(f"Unknown rig protocol '{protocol}'")
+
+        self.protocol = protocol
+        self.echo = echo
+        self.cat_on = protocol != "ft847" # The FT-847 ignores commands until CAT is switched on
+        self.frequencies = {"Main": 145000000, "Sub": 435000000, "SatRX": 145900000, "SatTX": 435300000} # Main/Sub are the selected and unselected VFO
+        self.buffer = bytearray()
+
+    def _civ_frame(self, body: bytes) -> bytes:
+        return b"\xFE\xFE\xE0" + bytes([EMULATED_CIV_ADDRESS]) + body + b"\xFD"
+
+    def _handle_civ(self) -> bytes:
+        response = b""
+        while b"\xFD" in self.buffer:
+            index = self.buffer.index(b"\xFD")
+            frame = bytes(self.buffer[:index+1])
+            del self.buffer[:index+1]
+            if self.echo:
+                response += frame
+            if not frame.startswith(b"\xFE\xFE") or len(frame) < 6 or frame[2] != EMULATED_CIV_ADDRESS:
+                continue
+
+            body = frame[4:-1]
+            if body[:1] in (b"\x05", b"\x03") or body[:2] == b"\x25\x01":
+                command, data = (body[:1], body[1:]) if body[0] != 0x25 else (body[:2], body[2:])
+                vfo = "Sub" if command == b"\x25\x01" else "Main"
+                if data:
+                    self.frequencies[vfo] = sum(((byte >> 4)*10 + (byte & 0x0F)) * 100**i for i, byte in enumerate(data))
+                    response += self._civ_frame(b"\xFB")
+                else:
+                    digits = f"{self.frequencies[vfo]:010d}"[::-1]
+                    response += self._civ_frame(command + bytes(int(digits[i+1])<<4 | int(digits[i]) for i in range(0, 10, 2)))
+            elif body[:1] == b"\x0F":
+                response += self._civ_frame(b"\xFB")
+            else:
+                response += self._civ_frame(b"\xFA")
+        return response
+
+    def _handle_yaesu(self) -> bytes:
+        vfos = {0x01: "Main", 0x11: "SatRX", 0x21: "SatTX"} if self.protocol == "ft847" else {0x01: "Main"} # VFO of each set opcode, reading is set+2
+        response = b""
+        while len(self.buffer) >= 5:
+            frame = bytes(self.buffer[:5])
+            del self.buffer[:5]
+            opcode = frame[4]
+
+            if self.protocol == "ft847" and opcode in (0x00, 0x80):
+                self.cat_on = opcode == 0x00
+            elif not self.cat_on:
+                continue
+            elif opcode in vfos:
+                self.frequencies[vfos[opcode]] = int("".join(f"{byte:02x}" for byte in frame[:4])) * 10
+            elif opcode-2 in vfos:
+                frequency = f"{self.frequencies[vfos[opcode-2]]//10:08d}"
+                response += bytes(int(frequency[i])<<4 | int(frequency[i+1]) for i in range(0, 8, 2)) + b"\x01" # Followed by the mode (USB)
+        return response
+
+    def handle(self, data: bytes) -> bytes:
+        """Feed received bytes into the emulator and return the bytes to respond with."""
+        self.buffer += data
+        if self.protocol == "civ":
+            return self._handle_civ()
+        return self._handle_yaesu()
+
+    def run(self, fd: int):
+        """Serve the emulated radio on a file descriptor (usually a pty master) until interrupted."""
+        while True:
+            readable, _, _ = select.select([fd], [], [], EMULATOR_POLL_INTERVAL)
+            if not readable:
+                continue
+
+            try:
+                data = os.read(fd, 1024)
+            except OSError: # No client connected to the pty at the moment
+                time.sleep(EMULATOR_POLL_INTERVAL)
+                continue
+
+            response = self.handle(data)
+            if response:
+                logging.log(logging.DEBUG, f"Emulator: {data!r} -> {response!r}")
+                os.write(fd, response)
+
+class Hamlib_Stand_In(threading.Thread):
+    def __init__(self, kind: str, latency: float = 0, host: str = "localhost", port: int = 0) -> None:
+        """
+        A minimal rotctld or rigctld stand-in (see HAMLIB_STAND_IN_KINDS) that answers in plain or extended ('+') response mode.
+        Every received packet is answered after the given latency in seconds, which behaves like a network round trip: pipelined commands only pay it once.
+        If port is 0, the kernel picks a free port. Each connection is served in its own thread.
+        """
+        if kind not in HAMLIB_STAND_IN_KINDS:
+            raise ValueError(f"Unknown hamlib stand-in '{kind}'")
+        super().__init__(name=f"{kind}-stand-in", daemon=True)
+
+        self.kind = kind
+        self.latency = latency
+        self.server = socket.create_server((host, port))
+        self.port = self.server.getsockname()[1]
+
+        self.rotor = Simulated_Rotor()
+        self.vfo_frequencies = {"currVFO": 145000000} # Frequency of each VFO, "currVFO" is used by commands without a VFO argument and "TX" by split commands
+        self.split = False
+
+    @property
+    def frequency(self) -> int:
+        return self.vfo_frequencies["currVFO"]
+
+    def _reply(self, line: str) -> str:
+        """Get the reply to a single command line."""
+        extended = line.startswith("+")
+        tokens = line.lstrip("+").split()
+        if not tokens:
+            return ""
+        command, args = tokens[0], tokens[1:]
+
+        values = [] # (key, value) pairs of get commands
+        code = 0
+        if self.kind == "rotctld" and command in ("P", "\\set_pos") and len(args) == 2:
+            self.rotor.set_target(float(args[0]), float(args[1]))
+        elif self.kind == "rotctld" and command in ("p", "\\get_pos"):
+            self.rotor.update()
+            values = [("Azimuth", f"{self.rotor.azimuth:.6f}"), ("Elevation", f"{self.rotor.elevation:.6f}")]
+        elif self.kind == "rigctld" and command in ("F", "\\set_freq") and len(args) in (1, 2): # With a VFO argument in VFO mode
+            self.vfo_frequencies[args[0] if len(args) == 2 else "currVFO"] = int(float(args[-1]))
+        elif self.kind == "rigctld" and command in ("f", "\\get_freq") and len(args) in (0, 1):
+            values = [("Frequency", str(self.vfo_frequencies.get(args[0] if args else "currVFO", 0)))]
+        elif self.kind == "rigctld" and command in ("I", "\\set_split_freq") and len(args) == 1:
+            self.vfo_frequencies["TX"] = int(float(args[0]))
+        elif self.kind == "rigctld" and command in ("i", "\\get_split_freq"):
+            values = [("TX Frequency", str(self.vfo_frequencies.get("TX", 0)))]
+        elif self.kind == "rigctld" and command in ("S", "\\set_split_vfo") and len(args) == 2:
+            self.split = args[0] == "1"
+        elif command in ("_", "\\get_info"):
+            values = [("Info", f"satgs {self.kind} stand-in")]
+        else:
+            code = -11 # Feature not available
+
+        if not extended:
+            return "".join(value+"\n" for _, value in values) if values else f"RPRT {code}\n"
+        return f"{command}: {' '.join(args)}\n" + "".join(f"{key}: {value}\n" for key, value in values) + f"RPRT {code}\n"
+
+    def _serve(self, connection: socket.socket):
+        buffer = bytearray()
+        with connection:
+            while True:
+                try:
+                    data = connection.recv(4096)
+                except OSError:
+                    return
+                if not data:
+                    return
+                buffer += data
+
+                response = ""
+                while b"\n" in buffer:
+                    index = buffer.index(b"\n")
+                    response += self._reply(buffer[:index].decode("ascii", errors="replace").strip())
+                    del buffer[:index+1]
+
+                if self.latency > 0:
+                    time.sleep(self.latency)
+                try:
+                    connection.sendall(response.encode("ascii"))
+                except OSError:
+                    return
+
+    def run(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError: # Server was closed
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def stop(self):
+        self.server.close()
@@ -0,0 +1,124 @@
+from src import hamlib_client
+from typing import List
+import importlib.util, logging, time
+
+HAMLIB_DUMMY_RIG_MODEL = 1 # Hamlib's dummy rig and rotator, which don't need any hardware
+HAMLIB_DUMMY_ROTOR_MODEL = 1
+HAMLIB_ERROR_NOT_AVAILABLE = -11 # RIG_ENAVAIL, returned for commands the in-process client doesn't implement
+
+def bindings_available() -> bool:
+    """Check if hamlibs python bindings are installed, without importing them."""
+    return importlib.util.find_spec("Hamlib") is not None
+
+def import_hamlib():
+    """
+    Import hamlibs python bindings and return the module. Exits if they aren't installed.
+    """
+    try:
+        import Hamlib # type: ignore
+    except ImportError:
+        logging.log(logging.ERROR, "The hamlib backend requires hamlibs python bindings. Install them using your package manager (usually python3-hamlib).")
+        exit()
+
+    Hamlib.rig_set_debug(Hamlib.RIG_DEBUG_NONE)
+    return Hamlib
+
+def raise_for_status(Hamlib, code: int, name: str):
+    """Raise an `OSError` if a hamlib call failed because the device couldn't be reached, so callers handle it like a broken connection."""
+    if code == Hamlib.RIG_ETIMEOUT:
+        raise TimeoutError(f"{name} didn't respond")
+    if code in (Hamlib.RIG_EIO, Hamlib.RIG_EPROTO):
+        raise OSError(f"Communication with {name} failed: {Hamlib.rigerror(code).strip()}")
+
+class Rig_Binding_Client():
+    def __init__(self, model: int, usb_port: str, serial_speed: int, name: str = "hamlib") -> None:
+        """
+        An in-process replacement for a client connected to rigctld, which calls hamlib directly through its python bindings instead of
+        going through a rigctld process, a socket and the text protocol. Understands the commands the radio controller uses
+        (F, f, I, i, S and _, with optional VFO arguments) and answers them with the same responses.
+        An empty USB port or a serial speed of 0 leave hamlibs defaults, which is useful for the dummy rig.
+        """
+        self.Hamlib = import_hamlib()
+        self.name = name
+
+        self.rig = self.Hamlib.Rig(model)
+        if usb_port:
+            self.rig.set_conf("rig_pathname", usb_port)
+        if serial_speed:
+            self.rig.set_conf("serial_speed", str(serial_speed))
+        self.timeout = 3.0
+        self.rig.open()
+        if self.rig.error_status != self.Hamlib.RIG_OK:
+            raise OSError(f"Failed to open {name}: {self.Hamlib.rigerror(self.rig.error_status).strip()}")
+
+        self.rtt = None # Smoothed duration of pipeline calls, like the socket clients round trip time
+        self.reset_statistics()
+
+    @property
+    def timeout(self) -> float:
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, seconds: float):
+        """
+        Set hamlibs timeout for each read from the rig. Unlike the socket clients deadline it applies to every read (and hamlibs retries),
+        so a call to an unresponsive rig can take a multiple of it.
+        """
+        self._timeout = seconds
+        self.rig.set_conf("timeout", str(max(round(seconds*1000), 1)))
+
+    def reset_statistics(self):
+        self.rtt_max = 0.0
+        self.exchanges = 0
+
+    @property
+    def latency(self) -> float:
+        """Estimated time in seconds until a command reaches the rig (half the smoothed duration of a call)."""
+        return self.rtt/2 if self.rtt is not None else 0
+
+    def _vfo(self, args: List[str], count: int) -> int:
+        """Get the VFO of a command that takes count arguments after an optional VFO argument."""
+        return self.Hamlib.rig_parse_vfo(args[0]) if len(args) > count else self.Hamlib.RIG_VFO_CURR
+
+    def _execute(self, command: str) -> hamlib_client.Hamlib_Response:
+        """Execute a single command."""
+        tokens = command.split()
+        name, args = tokens[0], tokens[1:]
+
+        values = []
+        if name in ("F", "\\set_freq"):
+            self.rig.set_freq(self._vfo(args, 1), float(args[-1]))
+        elif name in ("f", "\\get_freq"):
+            values = [str(round(self.rig.get_freq(self._vfo(args, 0))))]
+        elif name in ("I", "\\set_split_freq"):
+            self.rig.set_split_freq(self._vfo(args, 1), float(args[-1]))
+        elif name in ("i", "\\get_split_freq"):
+            values = [str(round(self.rig.get_split_freq(self._vfo(args, 0))))]
+        elif name in ("S", "\\set_split_vfo"):
+            self.rig.set_split_vfo(self._vfo(args, 2), int(args[-2]), self.Hamlib.rig_parse_vfo(args[-1]))
+        elif name in ("_", "\\get_info"):
+            values = [str(self.rig.get_info())]
+        else:
+            return hamlib_client.Hamlib_Response(command, [], HAMLIB_ERROR_NOT_AVAILABLE)
+
+        code = self.rig.error_status
+        raise_for_status(self.Hamlib, code, self.name)
+        return hamlib_client.Hamlib_Response(command, values if code == self.Hamlib.RIG_OK else [], code)
+
+    def pipeline(self, commands: List[str]) -> List[hamlib_client.Hamlib_Response]:
+        """Execute several commands and return their responses in order."""
+        start_time = time.monotonic()
+        responses = [self._execute(command) for command in commands]
+
+        duration = time.monotonic() - start_time
+        self.rtt = duration if self.rtt is None else self.rtt + hamlib_client.RTT_SMOOTHING*(duration - self.rtt)
+        self.rtt_max = max(self.rtt_max, duration)
+        self.exchanges += 1
+        return responses
+
+    def command(self, command: str) -> hamlib_client.Hamlib_Response:
+        """Execute a single command and return its response."""
+        return self.pipeline([command])[0]
+
+    def close(self):
+        self.rig.close()
@@ -0,0 +1,347 @@
+from typing import List, Tuple
+import socket, selectors, logging, time, threading, concurrent.futures
+
+BREAKER_FAILURE_THRESHOLD = 3 # Consecutive failed commands after which a device is quarantined
+BREAKER_PROBE_INTERVAL = 1 # First delay in seconds between probes of a quarantined device
+BREAKER_PROBE_MAX_INTERVAL = 30 # Maximum delay in seconds between probes
+IN_PROCESS_WORKERS = 8 # Threads that in-process clients are run in by `dispatch`
+RTT_SMOOTHING = 0.2 # Weight of a new round trip time measurement in the smoothed round trip time
+
+# Number of reply lines of get commands in the default (non-extended) response mode. Set commands reply with a single RPRT line.
+PLAIN_RESPONSE_LINES = {
+    "f": 1, "\\get_freq": 1,
+    "i": 1, "\\get_split_freq": 1,
+    "m": 2, "\\get_mode": 2,
+    "v": 1, "\\get_vfo": 1,
+    "p": 2, "\\get_pos": 2,
+    "_": 1, "\\get_info": 1
+}
+
+class Hamlib_Error(Exception):
+    """Raised when a hamlib daemon answers a command with an error code."""
+    def __init__(self, command: str, code: int) -> None:
+        super().__init__(f"Hamlib command '{command}' failed with error code {code}")
+        self.command = command
+        self.code = code
+
+class Device_Quarantined(ConnectionError):
+    """Raised instead of sending a command to a device that is quarantined by its circuit breaker."""
+    def __init__(self, name: str) -> None:
+        super().__init__(f"{name} is quarantined after repeated failures")
+        self.name = name
+
+class Hamlib_Response():
+    def __init__(self, command: str, values: List[str], code: int) -> None:
+        """
+        A parsed response to a single hamlib command. Values are the returned values without their keys, code is the RPRT code (0 if none was sent).
+        """
+        self.command = command
+        self.values = values
+        self.code = code
+
+    @property
+    def ok(self) -> bool:
+        return self.code >= 0
+
+    def raise_for_code(self):
+        """Raise a `Hamlib_Error` if the command failed."""
+        if not self.ok:
+            raise Hamlib_Error(self.command, self.code)
+
+class Circuit_Breaker():
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD) -> None:
+        """
+        Counts consecutive failures of a device. Once the threshold is reached, the breaker opens and the device is quarantined until it's closed again.
+        A threshold of 0 disables the breaker.
+        """
+        self.failure_threshold = failure_threshold
+        self.failures = 0
+        self.open = False
+        self.trips = 0
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self) -> bool:
+        """Count a failure. Returns True if this failure opened the breaker."""
+        self.failures += 1
+        if self.open or (self.failure_threshold == 0) or (self.failures < self.failure_threshold):
+            return False
+
+        self.open = True
+        self.trips += 1
+        return True
+
+    def close(self):
+        self.failures = 0
+        self.open = False
+
+class Hamlib_Client():
+    def __init__(self, host: str, port: int, timeout: float = 3, extended: bool = True, name: str = "hamlib",
+                 failure_threshold: int = BREAKER_FAILURE_THRESHOLD, probe_command: str = "_") -> None:
+        """
+        A client for the rigctld/rotctld line protocol.
+        If extended is set, commands are sent in extended response mode ('+' prefix) and every response is framed by its RPRT line.
+        Otherwise, responses are framed by the known number of reply lines of each command (for servers like SDR++ that don't support extended responses).
+        The name is only used for logging.
+        If the connection breaks, the failing command raises and the next command reconnects, so a restarted daemon is picked up transparently.
+        The timeout is a deadline for a whole `pipeline` call, not for every single read.
+        After failure_threshold consecutive failures, the client is quarantined by its circuit breaker: commands raise `Device_Quarantined` right away
+        while the device is probed with probe_command in the background, until it answers again.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.extended = extended
+        self.name = name
+        self.probe_command = probe_command
+
+        self.breaker = Circuit_Breaker(failure_threshold)
+        self.deadline = 0 # Monotonic time by which the current pipeline call has to be done
+        self.start_time = 0 # Monotonic time the current exchange was sent
+        self.rtt = None # Smoothed round trip time of exchanges in seconds, None until the first successful exchange
+        self.rtt_max = 0.0
+        self.exchanges = 0
+
+        self.sock = None
+        self.buffer = bytearray()
+        self._connect()
+
+    def _connect(self):
+        """Open the connection to the daemon."""
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = bytearray()
+
+    def _disconnect(self):
+        """Drop the connection and anything left in the buffer, so the next command reconnects."""
+        if self.sock:
+            self.sock.close()
+        self.sock = None
+        self.buffer = bytearray()
+
+    def _parse_response(self, command: str, lines: List[str], index: int) -> Tuple[Hamlib_Response, int] | None:
+        """
+        Parse the response to a single command from received lines, starting at index.
+        Returns the response and the index of the line after it, or None if the response isn't complete yet.
+        """
+
+        if self.extended:
+            # Extended responses are a header line, 'Key: value' lines and a final RPRT line
+            values = []
+            first_line = True
+            while index < len(lines):
+                line = lines[index]
+                index += 1
+                if line.startswith("RPRT"):
+                    return (Hamlib_Response(command, values, int(line.split()[1])), index)
+                if first_line:
+                    first_line = False
+                    continue
+                values.append(line.split(":", 1)[1].strip() if ":" in line else line)
+            return None
+
+        # Plain responses are either the expected number of value lines or a single RPRT line
+        expected_lines = PLAIN_RESPONSE_LINES.get(command.split()[0], 0)
+        if index >= len(lines):
+            return None
+        if lines[index].startswith("RPRT"):
+            return (Hamlib_Response(command, [], int(lines[index].split()[1])), index+1)
+
+        values = lines[index:index+max(expected_lines, 1)]
+        if len(values) < max(expected_lines, 1):
+            return None
+        return (Hamlib_Response(command, values, 0), index+len(values))
+
+    def _parse_responses(self, commands: List[str]) -> List[Hamlib_Response] | None:
+        """
+        Parse the responses to all commands from the receive buffer and remove them from it.
+        Returns None and leaves the buffer untouched if they haven't all been received yet.
+        """
+        end = self.buffer.rfind(b"\n")
+        if end < 0:
+            return None
+        lines = self.buffer[:end].decode("ascii").split("\n")
+
+        responses = []
+        index = 0
+        for command in commands:
+            result = self._parse_response(command, [line.strip() for line in lines], index)
+            if result is None:
+                return None
+            response, index = result
+            responses.append(response)
+
+        del self.buffer[:sum(len(line)+1 for line in lines[:index])]
+        return responses
+
+    def _receive(self):
+        """Receive whatever is available on the socket into the buffer."""
+        data = self.sock.recv(4096) # type: ignore
+        if not data:
+            raise ConnectionError(f"Connection to {self.name} at {self.host}:{self.port} was closed")
+        self.buffer += data
+
+    def _send(self, commands: List[str]):
+        """Start an exchange: send all commands in a single write and set the deadline for their responses."""
+        if self.breaker.open:
+            raise Device_Quarantined(self.name)
+
+        self.start_time = time.monotonic()
+        self.deadline = self.start_time + self.timeout
+        logging.log(logging.DEBUG, f"Sending {self.name} command(s) {commands}")
+        prefix = "+" if self.extended else ""
+        payload = "".join(prefix + cmd + "\n" for cmd in commands)
+
+        if self.sock is None:
+            logging.log(logging.DEBUG, f"Reconnecting to {self.name} at {self.host}:{self.port}")
+            self._connect()
+        self.sock.settimeout(self.timeout) # type: ignore
+        self.sock.sendall(payload.encode("ascii")) # type: ignore
+
+    def _exchange_failed(self):
+        """
+        Handle a failed exchange (including timeouts and closed connections). Responses can't be matched to commands anymore, so start over.
+        """
+        self._disconnect()
+        if self.breaker.record_failure():
+            logging.log(logging.WARN, f"{self.name} failed {self.breaker.failures} times in a row. Quarantining it until it responds again.")
+            threading.Thread(target=self._probe, daemon=True).start()
+
+    def _exchange_done(self):
+        """Record a successful exchange and its round trip time."""
+        self.breaker.record_success()
+        rtt = time.monotonic() - self.start_time
+        self.rtt = rtt if self.rtt is None else self.rtt + RTT_SMOOTHING*(rtt - self.rtt)
+        self.rtt_max = max(self.rtt_max, rtt)
+        self.exchanges += 1
+
+    def pipeline(self, commands: List[str]) -> List[Hamlib_Response]:
+        """
+        Send several commands at once and return their responses in order. All commands go out in a single write, so they only cost one round trip.
+        """
+        result = dispatch([(self, commands)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def reset_statistics(self):
+        """Reset the maximum round trip time and the exchange counter. The smoothed round trip time is kept, it's used for latency compensation."""
+        self.rtt_max = 0.0
+        self.exchanges = 0
+
+    @property
+    def latency(self) -> float:
+        """Estimated one way latency to the device in seconds (half the smoothed round trip time)."""
+        return self.rtt/2 if self.rtt is not None else 0
+
+    def _probe(self):
+        """Probe a quarantined device on a separate connection with increasing delays, and close the breaker once it answers."""
+        interval = BREAKER_PROBE_INTERVAL
+        while self.breaker.open:
+            time.sleep(interval)
+            try:
+                probe = Hamlib_Client(self.host, self.port, self.timeout, self.extended, self.name, failure_threshold=0)
+                try:
+                    probe.command(self.probe_command)
+                finally:
+                    probe.close()
+            except OSError as e:
+                logging.log(logging.DEBUG, f"Probe of quarantined {self.name} failed: {e}")
+                interval = min(interval*2, BREAKER_PROBE_MAX_INTERVAL)
+                continue
+
+            logging.log(logging.INFO, f"{self.name} responds again, re-admitting it")
+            self.breaker.close()
+
+    def command(self, command: str) -> Hamlib_Response:
+        """Send a single command and return its response."""
+        return self.pipeline([command])[0]
+
+    def close(self):
+        """Close the connection."""
+        self._disconnect()
+
+_executor = None
+
+def _in_process_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Get the thread pool in-process clients are run in by `dispatch`."""
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(IN_PROCESS_WORKERS, thread_name_prefix="hamlib-in-process")
+    return _executor
+
+def dispatch(requests: List[Tuple[Hamlib_Client, List[str]]]) -> List[List[Hamlib_Response] | Exception]:
+    """
+    Send commands to several clients at once and gather their responses, so an update takes as long as the slowest device instead of the sum of all.
+    Takes a list of clients and the commands to pipeline to each. Returns the responses for each client in order,
+    or the exception its exchange failed with (`Device_Quarantined`, a timeout or another `OSError`, or anything an in-process client raised).
+    Each client has its own deadline (its timeout), a slow device doesn't make the others fail. A client may only appear once.
+    Other clients with a `pipeline` method (like in-process hamlib bindings) can be mixed in, they are run in threads at the same time.
+    """
+    results: List[List[Hamlib_Response] | Exception | None] = [None]*len(requests)
+    pending = {} # Index of each pending request by client
+
+    # In-process clients (like the hamlib bindings) block while talking to their device, so they run in threads while the sockets are served
+    in_process = {}
+    for index, (client, commands) in enumerate(requests):
+        if (not isinstance(client, Hamlib_Client)) and commands:
+            in_process[index] = _in_process_executor().submit(client.pipeline, commands)
+
+    with selectors.DefaultSelector() as selector:
+        for index, (client, commands) in enumerate(requests):
+            if index in in_process:
+                continue
+            if not commands:
+                results[index] = []
+                continue
+            try:
+                client._send(commands)
+            except Device_Quarantined as e:
+                results[index] = e
+                continue
+            except OSError as e:
+                client._exchange_failed()
+                results[index] = e
+                continue
+            pending[client] = index
+            selector.register(client.sock, selectors.EVENT_READ, client) # type: ignore
+
+        while pending:
+            # Fail clients that are past their deadline
+            now = time.monotonic()
+            for client in [client for client in pending if client.deadline <= now]:
+                selector.unregister(client.sock) # type: ignore
+                client._exchange_failed()
+                results[pending.pop(client)] = TimeoutError(f"{client.name} didn't respond within {client.timeout}s")
+            if not pending:
+                break
+
+            events = selector.select(min(client.deadline for client in pending) - now)
+            for key, _ in events:
+                client = key.data
+                index = pending[client]
+                commands = requests[index][1]
+                try:
+                    client._receive()
+                    responses = client._parse_responses(commands)
+                except (OSError, ValueError) as e:
+                    selector.unregister(client.sock) # type: ignore
+                    client._exchange_failed()
+                    results[index] = e
+                    del pending[client]
+                    continue
+
+                if responses is not None:
+                    selector.unregister(client.sock) # type: ignore
+                    client._exchange_done()
+                    results[index] = responses
+                    del pending[client]
+
+    for index, future in in_process.items():
+        try:
+            results[index] = future.result()
+        except Exception as e: # In-process clients can fail with anything their library raises, it only fails this device
+            results[index] = e
+
+    return results # type: ignore
@@ -0,0 +1,297 @@
+from src import hamlib_client, util
+from typing import Dict, List
+import subprocess, logging, time, threading
+
+DAEMON_READY_TIMEOUT = 5 # Maximum seconds to wait for a daemon to accept connections
+DAEMON_CONNECT_BACKOFF_MIN = 0.005 # First delay in seconds between connection attempts while waiting for a daemon
+DAEMON_CONNECT_BACKOFF_MAX = 0.2 # Maximum delay in seconds between connection attempts
+DAEMON_PORT_RETRIES = 3 # Times a daemon is restarted on a new port if its port was taken in the meantime
+DAEMON_TERMINATE_TIMEOUT = 2 # Seconds to wait for a daemon to exit after terminating it before killing it
+
+SUPERVISOR_CHECK_INTERVAL = 1 # Seconds between checks if supervised daemons are still running
+HEALTH_CHECK_INTERVAL = 5 # Seconds between health check commands sent to each daemon
+HEALTH_CHECK_TIMEOUT = 2 # Seconds a daemon may take to answer a health check
+HEALTH_CHECK_FAILURES = 2 # Consecutive failed health checks after which a daemon is restarted
+HEALTH_CHECK_COMMAND = "_" # get_info, answered by both rigctld and rotctld. Its error code doesn't matter, only that there is an answer
+
+class Daemon_Error(Exception):
+    """Raised when a hamlib daemon fails to start. Returncode is None if the daemon is running but didn't become ready."""
+    def __init__(self, name: str, message: str, stderr: str = "", returncode: int | None = None) -> None:
+        super().__init__(f"{name} {message}")
+        self.name = name
+        self.stderr = stderr
+        self.returncode = returncode
+
+class Hamlib_Daemon():
+    def __init__(self, args: List[str], name: str, port: int = 0, extended: bool = True) -> None:
+        """
+        A rotctld/rigctld process. Args are the command line arguments without the port (-t), which is appended on start.
+        If port is 0, a port is assigned by the kernel, otherwise the given port is used.
+        The name is used for logging, extended is passed on to the hamlib client.
+        """
+        self.args = args
+        self.name = name
+        self.fixed_port = port
+        self.port = port
+        self.extended = extended
+
+        self.process = None
+        self.start_time = 0
+        self.clients: List[hamlib_client.Hamlib_Client] = [] # Clients returned by `wait_until_ready`, which follow the daemon if it moves to another port
+
+    def start(self):
+        """Start the daemon without waiting for it to be ready."""
+        if self.fixed_port == 0:
+            self.port = util.get_unused_port(self.name)
+
+        logging.log(logging.INFO, f"Starting {self.name}")
+        self.start_time = time.monotonic()
+        self.process = subprocess.Popen(
+            self.args + ["-t", str(self.port)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+
+    def _exit_error(self) -> Daemon_Error:
+        """Build the error for a daemon that exited during startup."""
+        stderr = self.process.stderr.read().strip() if self.process.stderr else "" # type: ignore
+        return Daemon_Error(self.name, f"exited with error code {self.process.returncode}", stderr, self.process.returncode) # type: ignore
+
+    def _probe(self, client: hamlib_client.Hamlib_Client, deadline: float) -> bool:
+        """
+        Check that a connection reached this daemon and not another process that took its port: the daemon must still be running
+        and answer a hamlib command before the deadline. The client is closed if it didn't.
+        """
+        client.timeout = max(min(HEALTH_CHECK_TIMEOUT, deadline - time.monotonic()), DAEMON_CONNECT_BACKOFF_MAX)
+        try:
+            client.command(HEALTH_CHECK_COMMAND)
+            if self.process.poll() is None: # type: ignore
+                return True
+        except (OSError, ValueError) as e: # ValueError: an answer that isn't the hamlib protocol
+            logging.log(logging.DEBUG, f"Readiness probe of {self.name} on port {self.port} failed: {e}")
+        client.close()
+        return False
+
+    def _wait_until_listening(self, timeout: float) -> hamlib_client.Hamlib_Client:
+        """
+        Wait until the daemon accepts connections and answers a probe command, and return a client connected to it.
+        Connecting is retried with exponential backoff, so this returns as soon as the daemon is listening.
+        Raises a `Daemon_Error` if the daemon exits or doesn't become ready within the timeout.
+        If a kernel assigned port was taken by another process before the daemon could bind it, the daemon exits and is restarted on a new port.
+        Until then, the probe makes sure that the other process isn't mistaken for the daemon.
+        """
+        port_retries = 0
+        backoff = DAEMON_CONNECT_BACKOFF_MIN
+        deadline = time.monotonic() + timeout
+
+        while True:
+            if self.process.poll() is not None: # type: ignore
+                error = self._exit_error()
+                if (self.fixed_port == 0) and ("bind" in error.stderr.lower()) and (port_retries < DAEMON_PORT_RETRIES):
+                    port_retries += 1
+                    logging.log(logging.DEBUG, f"{self.name} couldn't bind port {self.port}, retrying on another port")
+                    self.start()
+                    continue
+                raise error
+
+            try:
+                client = hamlib_client.Hamlib_Client("localhost", self.port, timeout=3, extended=self.extended, name=self.name)
+                if not self._probe(client, deadline):
+                    raise ConnectionError(f"{self.name} didn't answer on port {self.port}")
+                client.timeout = 3
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.terminate()
+                    raise Daemon_Error(self.name, f"didn't accept connections on port {self.port} within {timeout}s")
+                time.sleep(backoff)
+                backoff = min(backoff*2, DAEMON_CONNECT_BACKOFF_MAX)
+                continue
+
+            logging.log(logging.DEBUG, f"{self.name} ready on port {self.port} after {(time.monotonic()-self.start_time)*1000:.0f}ms")
+            return client
+
+    def wait_until_ready(self, timeout: float = DAEMON_READY_TIMEOUT) -> hamlib_client.Hamlib_Client:
+        """
+        Wait until the started daemon accepts connections and return a client connected to it. See `_wait_until_listening`.
+        """
+        client = self._wait_until_listening(timeout)
+        self.clients.append(client)
+        return client
+
+    def restart(self, timeout: float = DAEMON_READY_TIMEOUT) -> hamlib_client.Hamlib_Client:
+        """
+        Stop the daemon, start it again and wait until it accepts connections. Returns a client for the restarted daemon.
+        Clients returned by `wait_until_ready` are pointed at the new port and reconnect on their next command.
+        """
+        self.terminate()
+        self.start()
+        client = self._wait_until_listening(timeout)
+        for other_client in self.clients:
+            other_client.port = self.port
+        return client
+
+    def terminate(self):
+        """Terminate the daemon if it is running. It is killed if it doesn't exit in time."""
+        if self.process and (self.process.poll() is None):
+            self.process.terminate()
+            try:
+                self.process.wait(DAEMON_TERMINATE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+def log_daemon_error(error: Daemon_Error, usb_flag: str):
+    """Log why a daemon failed to start, with a tip for the usual causes. The usb flag is the command line flag to overwrite the daemons USB port."""
+    logging.log(logging.ERROR, f"{error}")
+    if error.stderr:
+        logging.log(logging.ERROR, "Error: "+error.stderr)
+    if "error = IO error" in error.stderr:
+        logging.log(logging.INFO, "Tip: Make sure you have the correct USB port selected. " \
+                                  f"You can overwrite the USB port in the config file using {usb_flag}")
+
+class Hamlib_Supervisor(threading.Thread):
+    def __init__(self) -> None:
+        """
+        Owns hamlib daemons. Daemons are started in parallel with `launch`.
+        Once the thread is started, it checks that they are still running, health checks them with a cheap command and restarts them if they crashed or hung.
+        """
+        super().__init__(daemon=True)
+
+        self.daemons: List[Hamlib_Daemon] = []
+        self.lock = threading.Lock() # Held while checking daemons and changing the supervised daemons and their health clients
+        self.stopping = threading.Event()
+
+        self.health_clients: Dict[Hamlib_Daemon, hamlib_client.Hamlib_Client] = {}
+        self.last_health_check: Dict[Hamlib_Daemon, float] = {}
+        self.health_failures: Dict[Hamlib_Daemon, int] = {}
+        self.down_since: Dict[Hamlib_Daemon, float] = {}
+
+        self.reset_statistics()
+
+    def launch(self, daemons: List[Hamlib_Daemon]) -> List[hamlib_client.Hamlib_Client | Daemon_Error]:
+        """
+        Start daemons in parallel and wait for all of them to be ready. Daemons that started are supervised from then on.
+        Returns a client or the `Daemon_Error` it failed with for each daemon, in order.
+        """
+        for daemon in daemons:
+            daemon.start()
+
+        results = []
+        for daemon in daemons:
+            try:
+                results.append(daemon.wait_until_ready())
+            except Daemon_Error as e:
+                results.append(e)
+                continue
+
+            with self.lock:
+                self.daemons.append(daemon)
+        return results
+
+    def remove(self, daemon: Hamlib_Daemon):
+        """Stop supervising a daemon, usually before terminating it."""
+        with self.lock:
+            if daemon in self.daemons:
+                self.daemons.remove(daemon)
+            client = self.health_clients.pop(daemon, None)
+            if client:
+                client.close()
+
+    def reset_statistics(self):
+        """Reset restart counters."""
+        self.restarts: Dict[str, int] = {}
+        self.downtime: Dict[str, float] = {}
+
+    def log_statistics(self):
+        """Log how often each daemon had to be restarted and how long it was down."""
+        if not self.restarts:
+            logging.log(logging.DEBUG, "No hamlib daemons had to be restarted")
+            return
+
+        for name, restarts in self.restarts.items():
+            logging.log(logging.INFO, f"{name} was restarted {restarts} time(s) and was down for {self.downtime.get(name, 0):.1f}s")
+
+    def _restart(self, daemon: Hamlib_Daemon):
+        """
+        Restart a daemon and record its downtime once it's back. Called without holding the lock, so controllers can remove daemons meanwhile.
+        A daemon that was removed while it restarted is terminated again.
+        """
+        with self.lock:
+            client = self.health_clients.pop(daemon, None)
+        if client:
+            client.close()
+
+        self.restarts[daemon.name] = self.restarts.get(daemon.name, 0) + 1
+        try:
+            client = daemon.restart()
+        except Daemon_Error as e:
+            with self.lock:
+                removed = daemon not in self.daemons
+            if not removed:
+                logging.log(logging.ERROR, f"Failed to restart {e}. Trying again.")
+            return
+
+        with self.lock:
+            removed = daemon not in self.daemons
+            if not removed:
+                self.health_clients[daemon] = client
+        if removed: # Its controller closed it while it was restarting
+            client.close()
+            daemon.terminate()
+            return
+
+        downtime = time.monotonic() - self.down_since.pop(daemon)
+        self.downtime[daemon.name] = self.downtime.get(daemon.name, 0) + downtime
+        self.health_failures[daemon] = 0
+        self.last_health_check[daemon] = time.monotonic()
+        logging.log(logging.INFO, f"{daemon.name} is back after {downtime:.1f}s")
+
+    def _check(self, daemon: Hamlib_Daemon) -> bool:
+        """Check if a daemon exited, or health check it if it's due. Returns True if it has to be restarted."""
+        now = time.monotonic()
+
+        if daemon in self.down_since: # A previous restart failed
+            return True
+
+        if daemon.process.poll() is not None: # type: ignore
+            logging.log(logging.WARN, f"{daemon.name} exited with error code {daemon.process.returncode}. Restarting it.") # type: ignore
+            self.down_since[daemon] = now
+            return True
+
+        if now - self.last_health_check.get(daemon, 0) < HEALTH_CHECK_INTERVAL:
+            return False
+        self.last_health_check[daemon] = now
+
+        try:
+            if daemon not in self.health_clients:
+                self.health_clients[daemon] = hamlib_client.Hamlib_Client("localhost", daemon.port, timeout=HEALTH_CHECK_TIMEOUT, extended=daemon.extended, name=daemon.name,
+                                                                           failure_threshold=0)
+            self.health_clients[daemon].command(HEALTH_CHECK_COMMAND)
+        except OSError as e:
+            self.health_failures[daemon] = self.health_failures.get(daemon, 0) + 1
+            logging.log(logging.DEBUG, f"Health check of {daemon.name} failed: {e}")
+            if self.health_failures[daemon] >= HEALTH_CHECK_FAILURES:
+                logging.log(logging.WARN, f"{daemon.name} stopped responding. Restarting it.")
+                self.down_since[daemon] = now - HEALTH_CHECK_INTERVAL*(HEALTH_CHECK_FAILURES-1)
+                return True
+            return False
+
+        self.health_failures[daemon] = 0
+        return False
+
+    def stop(self):
+        """Stop supervising. Daemons keep running until their controllers close them."""
+        self.stopping.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        while not self.stopping.wait(SUPERVISOR_CHECK_INTERVAL):
+            # Restarts can take up to DAEMON_READY_TIMEOUT, so they happen after releasing the lock to not block `remove`
+            with self.lock:
+                failed = [daemon for daemon in self.daemons if (not self.stopping.is_set()) and self._check(daemon)]
+            for daemon in failed:
+                if self.stopping.is_set():
+                    break
+                self._restart(daemon)
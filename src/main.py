@@ -16,9 +16,6 @@ def main():
     if not os.path.exists(paths.TLE_DIRECTORY_PATH):
         os.makedirs(paths.TLE_DIRECTORY_PATH, exist_ok=True)
 
-    if not os.path.exists(paths.TRANSPONDERS_DIRECTORY_PATH):
-        os.makedirs(paths.TRANSPONDERS_DIRECTORY_PATH, exist_ok=True)
-
     resources_files = importlib_resources.files().joinpath("resources")
     if not os.path.exists(paths.ROTOR_CONFIG_DIRECTORY_PATH):
         os.makedirs(paths.ROTOR_CONFIG_DIRECTORY_PATH, exist_ok=True)
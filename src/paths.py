@@ -5,11 +5,14 @@ CONFIG_DIR = platformdirs.user_config_dir("satgs")
 DATA_DIR = platformdirs.user_data_dir("satgs")
 
 TLE_DIRECTORY_PATH = os.path.join(DATA_DIR, "tle/")
-TRANSPONDERS_DIRECTORY_PATH = os.path.join(DATA_DIR, "transponders/")
+TRANSPONDER_DATABASE_PATH = os.path.join(DATA_DIR, "transponders.sqlite")
+LEGACY_TRANSPONDERS_DIRECTORY_PATH = os.path.join(DATA_DIR, "transponders/") # Transponder files of older versions, removed on the next update
 SOURCES_PATH = os.path.join(CONFIG_DIR, "sources.txt")
 LAST_TLE_UPDATE_PATH = os.path.join(DATA_DIR, "last_tle_update.txt")
 
 ROTOR_CONFIG_DIRECTORY_PATH = os.path.join(CONFIG_DIR, "rotors/")
 RADIO_CONFIG_DIRECTORY_PATH = os.path.join(CONFIG_DIR, "radios/")
+ROTOR_PROFILE_SUFFIX = ".profile.json" # Measured rotor profiles are stored next to the rotor config with this suffix
 
 SETTINGS_FILE_PATH = os.path.join(CONFIG_DIR, "settings.json")
+TRANSPONDER_DEFAULTS_PATH = os.path.join(CONFIG_DIR, "transponder_defaults.json") # Last selected transponders of each satellite
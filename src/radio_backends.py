@@ -0,0 +1,256 @@
+from src import hamlib_client, hamlib_bindings
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+import logging, time
+
+CAT_BACKENDS = ["civ", "yaesu", "ft847"] # civ: Icom CI-V. yaesu: Yaesu 5 byte CAT (FT-817/857/897). ft847: Yaesu 5 byte CAT with the FT-847s satellite VFOs
+DEFAULT_SERIAL_SPEEDS = {"civ": 19200, "yaesu": 4800, "ft847": 57600}
+HAMLIB_ERROR_REJECTED = -9 # RIG_ERJCTED, returned when the radio answers a command with NG
+
+CIV_PREAMBLE = b"\xFE\xFE"
+CIV_END = 0xFD
+CIV_CONTROLLER_ADDRESS = 0xE0 # Default address of the controller (this program) on the CI-V bus
+CIV_NG = 0xFA
+CIV_DEFAULT_ADDRESS = 0xA2 # CI-V address of the IC-9700
+
+def civ_frame(to_address: int, from_address: int, command: bytes) -> bytes:
+    """Build a CI-V frame from the command (command number, sub command and data)."""
+    return CIV_PREAMBLE + bytes([to_address, from_address]) + command + bytes([CIV_END])
+
+def civ_encode_frequency(frequency: int) -> bytes:
+    """
+    Encode a frequency in herz as the 5 byte BCD data of CI-V frequency commands (least significant digits first).
+    Raises `ValueError` if it doesn't fit in 10 digits.
+    """
+    if not 0 <= frequency < 10**10:
+        raise ValueError(f"Frequency {frequency} Hz can't be sent over CI-V")
+    digits = f"{frequency:010d}"[::-1]
+    return bytes(int(digits[i+1])<<4 | int(digits[i]) for i in range(0, 10, 2))
+
+def civ_decode_frequency(data: bytes) -> int:
+    """Decode the BCD data of a CI-V frequency command to herz."""
+    return sum(((byte >> 4)*10 + (byte & 0x0F)) * 100**i for i, byte in enumerate(data))
+
+def yaesu_encode_frequency(frequency: int) -> bytes:
+    """
+    Encode a frequency in herz as the 4 byte BCD parameters of Yaesu CAT commands (most significant digits first, in 10 Hz).
+    Raises `ValueError` if it doesn't fit in 8 digits.
+    """
+    if not 0 <= round(frequency/10) < 10**8:
+        raise ValueError(f"Frequency {frequency} Hz can't be sent over Yaesu CAT")
+    digits = f"{round(frequency/10):08d}"
+    return bytes(int(digits[i])<<4 | int(digits[i+1]) for i in range(0, 8, 2))
+
+def yaesu_decode_frequency(data: bytes) -> int:
+    """Decode the 4 BCD bytes of a Yaesu frequency response to herz."""
+    return sum(((byte >> 4)*10 + (byte & 0x0F)) * 100**(3-i) for i, byte in enumerate(data)) * 10
+
+class CAT_Rejected(Exception):
+    """Raised when a radio answers a command with NG."""
+
+class CAT_Client(ABC):
+    vfos: List[str] = [] # VFO names that can be given to F and f
+    split = False # If split operation (S, I and i) is supported
+
+    def __init__(self, usb_port: str, serial_speed: int, name: str) -> None:
+        """
+        Base class for clients that talk to a radio directly over its binary CAT protocol, without rigctld.
+        They understand the hamlib commands the radio controller uses (F, f, I, i, S and _, with VFO arguments if the radio has any)
+        and answer them like rigctld would, so they can be used in place of a hamlib client. Set commands are sent without waiting
+        for an answer, read commands wait for the radios response. Requires pyserial to be installed.
+        """
+        try:
+            import serial
+        except ImportError:
+            logging.log(logging.ERROR, "Native CAT backends require pyserial. Install it using `pip install pyserial`.")
+            exit()
+
+        self.name = name
+        self.port = serial.Serial(usb_port, serial_speed, timeout=3)
+        self.rtt = None # Smoothed duration of pipeline calls, like the socket clients round trip time
+        self.reset_statistics()
+
+    @property
+    def timeout(self) -> float:
+        return self.port.timeout # type: ignore
+
+    @timeout.setter
+    def timeout(self, seconds: float):
+        self.port.timeout = seconds
+
+    def reset_statistics(self):
+        self.rtt_max = 0.0
+        self.exchanges = 0
+
+    @property
+    def latency(self) -> float:
+        """Estimated time in seconds until a command reaches the radio (half the smoothed duration of a call)."""
+        return self.rtt/2 if self.rtt is not None else 0
+
+    def _read(self, size: int) -> bytes:
+        data = self.port.read(size)
+        if len(data) != size:
+            raise TimeoutError(f"{self.name} didn't respond")
+        return data
+
+    @abstractmethod
+    def set_frequency(self, vfo: str | None, frequency: int):
+        """Set the frequency of a VFO (None for the current VFO, "TX" for the split VFO) without waiting for an answer."""
+
+    @abstractmethod
+    def get_frequency(self, vfo: str | None) -> int:
+        """Read the frequency of a VFO in herz."""
+
+    def set_split(self, enabled: bool):
+        """Enable or disable split operation. Only called on radios that support split, others answer it as rejected."""
+        raise CAT_Rejected(f"{self.name} doesn't support split operation")
+
+    def _execute(self, command: str) -> hamlib_client.Hamlib_Response:
+        """Execute a single command. Returns `HAMLIB_ERROR_NOT_AVAILABLE` for commands the radio or client doesn't support
+        and `HAMLIB_ERROR_REJECTED` for commands the radio refused or that can't be encoded for it."""
+        tokens = command.split()
+        name, args = tokens[0], tokens[1:]
+        vfo = args[0] if (name, len(args)) in (("F", 2), ("f", 1)) else None # VFO argument, given in VFO mode
+        if (vfo is not None and vfo not in self.vfos) or (name in ("I", "i", "S") and not self.split):
+            return hamlib_client.Hamlib_Response(command, [], hamlib_bindings.HAMLIB_ERROR_NOT_AVAILABLE)
+
+        try:
+            values = self._run(name, args, vfo)
+        except (CAT_Rejected, ValueError): # ValueError: a frequency the protocol can't represent, no radio would accept it
+            return hamlib_client.Hamlib_Response(command, [], HAMLIB_ERROR_REJECTED)
+        if values is None:
+            return hamlib_client.Hamlib_Response(command, [], hamlib_bindings.HAMLIB_ERROR_NOT_AVAILABLE)
+        return hamlib_client.Hamlib_Response(command, values, 0)
+
+    def _run(self, name: str, args: List[str], vfo: str | None) -> List[str] | None:
+        """Run a command and return its values, or None if the command is unknown."""
+        values = []
+        if name == "F":
+            self.set_frequency(vfo, int(float(args[-1])))
+        elif name == "f":
+            values = [str(self.get_frequency(vfo))]
+        elif name == "I":
+            self.set_frequency("TX", int(float(args[-1])))
+        elif name == "i":
+            values = [str(self.get_frequency("TX"))]
+        elif name == "S":
+            self.set_split(args[0] == "1")
+        elif name == "_":
+            values = [self.name]
+        else:
+            return None
+        return values
+
+    def pipeline(self, commands: List[str]) -> List[hamlib_client.Hamlib_Response]:
+        """Execute several commands and return their responses in order. Returns once all set commands have been written out."""
+        start_time = time.monotonic()
+        responses = [self._execute(command) for command in commands]
+        self.port.flush()
+
+        duration = time.monotonic() - start_time
+        self.rtt = duration if self.rtt is None else self.rtt + hamlib_client.RTT_SMOOTHING*(duration - self.rtt)
+        self.rtt_max = max(self.rtt_max, duration)
+        self.exchanges += 1
+        return responses
+
+    def command(self, command: str) -> hamlib_client.Hamlib_Response:
+        """Execute a single command and return its response."""
+        return self.pipeline([command])[0]
+
+    def close(self):
+        self.port.close()
+
+class Icom_CIV_Client(CAT_Client):
+    split = True
+
+    def __init__(self, usb_port: str, serial_speed: int, name: str, address: int = CIV_DEFAULT_ADDRESS) -> None:
+        """
+        Icom CI-V protocol. The current VFO is set with command 05 and read with 03. The split (TX) frequency is the frequency of the
+        unselected VFO, which is set and read with command 25 01 (IC-9700, IC-705, IC-7300 and newer radios).
+        Frames echoed by the radio or bus and the OK answers to set commands are skipped.
+        """
+        super().__init__(usb_port, serial_speed, name)
+        self.address = address
+
+    def _send(self, command: bytes):
+        self.port.write(civ_frame(self.address, CIV_CONTROLLER_ADDRESS, command))
+
+    def _receive(self, command: bytes) -> bytes:
+        """Read frames until the radios answer to a read command arrives and return its data (after the command and sub command)."""
+        while True:
+            frame = self.port.read_until(bytes([CIV_END]))
+            if not frame.endswith(bytes([CIV_END])):
+                raise TimeoutError(f"{self.name} didn't respond")
+
+            start = frame.rfind(CIV_PREAMBLE)
+            if start < 0 or len(frame) < start+6:
+                continue
+            to_address, from_address, body = frame[start+2], frame[start+3], frame[start+4:-1]
+            if to_address != CIV_CONTROLLER_ADDRESS or from_address != self.address: # Echoes and broadcasts
+                continue
+            if body[:1] == bytes([CIV_NG]):
+                raise CAT_Rejected(f"{self.name} rejected CI-V command {command.hex()}")
+            if body.startswith(command):
+                return body[len(command):]
+
+    def set_frequency(self, vfo: str | None, frequency: int):
+        self._send((b"\x25\x01" if vfo == "TX" else b"\x05") + civ_encode_frequency(frequency))
+
+    def get_frequency(self, vfo: str | None) -> int:
+        command = b"\x25\x01" if vfo == "TX" else b"\x03"
+        self.port.reset_input_buffer() # Drop answers to set commands
+        self._send(command)
+        return civ_decode_frequency(self._receive(command)[:5])
+
+    def set_split(self, enabled: bool):
+        self._send(b"\x0F\x01" if enabled else b"\x0F\x00")
+
+class Yaesu_CAT_Client(CAT_Client):
+    """
+    Yaesu 5 byte CAT protocol (FT-817, FT-857, FT-897): four parameter bytes followed by the opcode. Set commands aren't answered,
+    reading the frequency answers with the frequency in four BCD bytes and the mode. These radios can only address the current VFO.
+    """
+    opcodes: Dict[str | None, Tuple[int, int]] = {None: (0x01, 0x03)} # Set and read opcodes of each VFO, None is the current VFO
+
+    def set_frequency(self, vfo: str | None, frequency: int):
+        self.port.write(yaesu_encode_frequency(frequency) + bytes([self.opcodes[vfo][0]]))
+
+    def get_frequency(self, vfo: str | None) -> int:
+        self.port.reset_input_buffer()
+        self.port.write(bytes([0, 0, 0, 0, self.opcodes[vfo][1]]))
+        return yaesu_decode_frequency(self._read(5)[:4])
+
+class FT847_CAT_Client(Yaesu_CAT_Client):
+    """
+    Yaesu FT-847 CAT protocol. Like the other 5 byte CAT radios, but CAT has to be switched on first and the satellite mode
+    VFOs can be addressed directly ("SatRX" and "SatTX", "Main" is the normal VFO), so uplink and downlink can be set without switching VFOs.
+    """
+    opcodes = {None: (0x01, 0x03), "Main": (0x01, 0x03), "SatRX": (0x11, 0x13), "SatTX": (0x21, 0x23)}
+    vfos = ["Main", "SatRX", "SatTX"]
+
+    def __init__(self, usb_port: str, serial_speed: int, name: str) -> None:
+        super().__init__(usb_port, serial_speed, name)
+        self.port.write(bytes([0, 0, 0, 0, 0x00])) # CAT on
+
+    def close(self):
+        self.port.write(bytes([0, 0, 0, 0, 0x80])) # CAT off
+        self.port.flush()
+        super().close()
+
+CAT_CLIENTS = {"civ": Icom_CIV_Client, "yaesu": Yaesu_CAT_Client, "ft847": FT847_CAT_Client}
+
+def create_cat_client(backend: str, usb_port: str, serial_speed: int, name: str, civ_address: int = CIV_DEFAULT_ADDRESS) -> CAT_Client:
+    """
+    Create a native CAT client by its backend name (see CAT_BACKENDS).
+    If serial_speed is 0, the usual speed of the protocol is used.
+    """
+    if serial_speed == 0:
+        serial_speed = DEFAULT_SERIAL_SPEEDS[backend]
+
+    logging.log(logging.DEBUG, f"Opening {backend} CAT backend on {usb_port} at {serial_speed} baud")
+    if backend == "civ":
+        return Icom_CIV_Client(usb_port, serial_speed, name, civ_address)
+    elif backend in CAT_CLIENTS:
+        return CAT_CLIENTS[backend](usb_port, serial_speed, name)
+
+    raise ValueError(f"Unknown CAT backend '{backend}'")
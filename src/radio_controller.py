@@ -1,15 +1,138 @@
-from src import paths, util
-from typing import Dict
-import subprocess, os, json, logging, socket
+from src import paths, util, hamlib_client, hamlib_daemon, hamlib_bindings, radio_backends
+from typing import Dict, List, Tuple
+import os, json, logging, time
+import numpy as np
 
 RADIO_SDR_CONF_EXPECTED_KEYS = set(["rigctl_port"])
+RADIO_SDR_CONF_OPTIONAL_KEYS = { # Optional keys and their default values
+    "rigctl_host": "localhost",     # Host of the rigctl server
+    "offset": 0,                    # Frequency offset in herz
+    "readback_interval": 3,         # Seconds between frequency reads to detect manual retuning (0 to read on every update)
+    "tuning_step": 1,               # Tuning step of the radio in herz, frequencies are rounded to it
+    "deadband": 0,                  # Minimum change in herz before a new frequency is sent (at least one tuning step)
+    "transponder": 1                # Which of the tracked transponders the radio follows, in the order they were selected
+}
 RADIO_RX_CONF_EXPECTED_KEYS = set(["usb_port", "rigctl_ID", "rigctl_port_overwrite", "serial_speed", "offset"])
+RADIO_RX_CONF_OPTIONAL_KEYS = {
+    "rigctld_address": "",          # host:port of a remote rigctld to use instead of starting one (empty to start rigctld locally)
+    "backend": "rigctld",           # How to talk to the radio, see RADIO_BACKENDS
+    "civ_address": "A2",            # CI-V address of the radio in hex, only used by the civ backend
+    "readback_interval": 3,
+    "tuning_step": 1,
+    "deadband": 0,
+    "transponder": 1
+}
 RADIO_TX_CONF_EXPECTED_KEYS = RADIO_RX_CONF_EXPECTED_KEYS
+RADIO_TX_CONF_OPTIONAL_KEYS = RADIO_RX_CONF_OPTIONAL_KEYS
+RADIO_TRX_CONF_EXPECTED_KEYS = set(["usb_port", "rigctl_ID", "rigctl_port_overwrite", "serial_speed"])
+RADIO_TRX_CONF_OPTIONAL_KEYS = {
+    "rx_offset": 0,                 # Frequency offset in herz of the downlink
+    "tx_offset": 0,                 # Frequency offset in herz of the uplink
+    "vfo_mode": "split",            # How uplink and downlink are set, see TRX_VFO_MODES
+    "rx_vfo": "Sub",                # VFO used for the downlink in sub VFO mode
+    "tx_vfo": "Main",               # VFO used for the uplink in sub VFO mode
+    "rigctld_address": "",
+    "backend": "rigctld",
+    "civ_address": "A2",
+    "readback_interval": 3,
+    "tuning_step": 1,
+    "deadband": 0,
+    "transponder": 1
+}
+RADIO_BACKENDS = ["rigctld", "hamlib"] + radio_backends.CAT_BACKENDS # rigctld: through a rigctld process (local or remote). hamlib: in-process through hamlibs python bindings. Others: native CAT
+TRX_VFO_MODES = ["split", "sub"] # split: downlink on the current VFO (F/f), uplink on the split VFO (I/i). sub: each on its own VFO, rigctld runs in VFO mode (--vfo)
+TRX_SPLIT_COMMAND = "S 1 VFOB" # Enables split operation with VFO B for transmitting
+RIG_ROLES = [("rx", "receiver", "-r"), ("tx", "transmitter", "-t"), ("trx", "transceiver", "-x")] # Config section, description and USB overwrite flag of hamlib controlled radios
+LOCK_THRESHOLD = 4 # Minimum summed offset in herz of manually retuned radios before the lock follows them
+SPEED_OF_LIGHT = 299792.458 # km/s
+RESIDUAL_MAX_AGE = 10 # Maximum seconds between a frequency prediction and the update it's checked in, the range rate trend is only linear for a short time
+MAX_UPDATE_DELAY = 10 # Maximum seconds until the next update, even if no radio frequency is expected to change
+RETRY_MIN_DELAY = 0.5 # Seconds until a failed frequency set is retried, doubled after every further failure
+RETRY_MAX_DELAY = 10 # Maximum seconds between retries of a failing frequency set
+
+def _device_description(description: str, index: int, devices: List) -> str:
+    """Describe a radio for logging. Radios are numbered if there are several of the same type."""
+    return f"{description} {index+1}" if len(devices) > 1 else description
+
+def _config_int(device_config: Dict, key: str, description: str) -> int:
+    """Get an integer value from a radio config section. Exits if it isn't a valid integer."""
+    try:
+        return int(device_config[key])
+    except ValueError:
+        logging.log(logging.ERROR, f"Configured {key.replace('_', ' ')} '{device_config[key]}' of {description} is not a valid integer.")
+        exit()
 
-def parse_radio_config(radio_config_name: str) -> Dict[str, Dict[str, str | int]]:
+def _check_radio_section(json_data: Dict, section: str, expected_keys: set, optional_keys: Dict, radio_config_name: str, description: str):
+    """
+    Make sure every radio in a section of a radio config only has the expected and optional keys, then fill in the defaults of missing optional keys.
+    A section can be a single radio or a list of radios, it's turned into a list.
+    """
+    if type(json_data[section]) is not list:
+        json_data[section] = [json_data[section]]
+    if not json_data[section]:
+        logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. The "+description+" section doesn't define any radios.")
+        exit()
+
+    for device_config in json_data[section]:
+        if type(device_config) is not dict:
+            logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. Invalid radio in "+description+" section of config file.")
+            exit()
+
+        keys = set(device_config.keys())
+        if (not expected_keys.issubset(keys)) or (not keys.issubset(expected_keys | optional_keys.keys())):
+            logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. Invalid keys present in "+description+" section of config file.")
+            exit()
+
+        for key, default in optional_keys.items():
+            device_config.setdefault(key, default)
+
+        address = device_config.get("rigctld_address")
+        if address and (util.parse_address(str(address)) is None):
+            logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. Invalid rigctld address '"+str(address)+"' in "+description+" section, expected host:port.")
+            exit()
+
+        for key, minimum in (("tuning_step", 1), ("deadband", 0), ("transponder", 1)):
+            value = device_config[key]
+            if (type(value) is not int) or (value < minimum):
+                logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. "+key+" in "+description+" section must be an integer of at least "+str(minimum)+".")
+                exit()
+
+        if ("backend" in device_config) and (device_config["backend"] not in RADIO_BACKENDS):
+            logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. Unknown backend '"+str(device_config["backend"])+"' in "+description+" section, expected one of "+", ".join(RADIO_BACKENDS)+".")
+            exit()
+        backend = device_config.get("backend", "rigctld")
+        if (backend != "rigctld") and address:
+            logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. The "+str(backend)+" backend can't be used with a remote rigctld in "+description+" section.")
+            exit()
+        if "civ_address" in device_config:
+            try:
+                device_config["civ_address"] = int(str(device_config["civ_address"]), 16)
+            except ValueError:
+                device_config["civ_address"] = -1
+            if not 0 <= device_config["civ_address"] <= 0xFF:
+                logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. civ_address in "+description+" section must be a hex address like A2.")
+                exit()
+
+        if ("vfo_mode" in device_config) and (device_config["vfo_mode"] not in TRX_VFO_MODES):
+            logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. Invalid vfo_mode '"+str(device_config["vfo_mode"])+"' in "+description+" section, expected one of "+", ".join(TRX_VFO_MODES)+".")
+            exit()
+
+        cat_client = radio_backends.CAT_CLIENTS.get(backend)
+        if ("vfo_mode" in device_config) and cat_client: # Transceivers with a native CAT backend need a VFO mode the protocol supports
+            if (device_config["vfo_mode"] == "split") and not cat_client.split:
+                logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. The "+backend+" backend doesn't support split operation in "+description+" section, use another vfo_mode.")
+                exit()
+            if (device_config["vfo_mode"] == "sub") and not cat_client.vfos:
+                logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. The "+backend+" backend doesn't support vfo_mode sub in "+description+" section, use vfo_mode split.")
+                exit()
+            if (device_config["vfo_mode"] == "sub") and not {str(device_config["rx_vfo"]), str(device_config["tx_vfo"])}.issubset(cat_client.vfos):
+                logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. Invalid rx_vfo or tx_vfo for the "+backend+" backend in "+description+" section, expected "+" or ".join(cat_client.vfos)+".")
+                exit()
+
+def parse_radio_config(radio_config_name: str) -> Dict[str, List[Dict[str, str | int]]]:
     """
     Parse a radio config file by its file name (excluding file exension).
-    Returns all values specified in the README section for the radio config files in a dictionary.
+    Returns all values specified in the README section for the radio config files in a dictionary, with a list of radios for each radio type.
     """
     
     # Try to read and parse JSON data
@@ -30,46 +153,85 @@ def parse_radio_config(radio_config_name: str) -> Dict[str, Dict[str, str | int]
     # Make sure that atleast one valid radio type is defined and that the defined ones have the expected keys.
     valid_radio_type_defined = False
     if "sdr" in json_data:
-        if set(json_data["sdr"].keys()) != RADIO_SDR_CONF_EXPECTED_KEYS:
-            logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. Invalid keys present in SDR section of config file.")
-            exit()
+        _check_radio_section(json_data, "sdr", RADIO_SDR_CONF_EXPECTED_KEYS, RADIO_SDR_CONF_OPTIONAL_KEYS, radio_config_name, "SDR")
         valid_radio_type_defined = True
     
     if "rx" in json_data:
-        if set(json_data["rx"].keys()) != RADIO_RX_CONF_EXPECTED_KEYS:
-            logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. Invalid keys present in RX section of config file.")
-            exit()
+        _check_radio_section(json_data, "rx", RADIO_RX_CONF_EXPECTED_KEYS, RADIO_RX_CONF_OPTIONAL_KEYS, radio_config_name, "RX")
         valid_radio_type_defined = True
     
     if "tx" in json_data:
-        if set(json_data["tx"].keys()) != RADIO_TX_CONF_EXPECTED_KEYS:
-            logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. Invalid keys present in TX section of config file.")
-            exit()
+        _check_radio_section(json_data, "tx", RADIO_TX_CONF_EXPECTED_KEYS, RADIO_TX_CONF_OPTIONAL_KEYS, radio_config_name, "TX")
         valid_radio_type_defined = True
 
-    # TODO: transceiver
+    if "trx" in json_data:
+        _check_radio_section(json_data, "trx", RADIO_TRX_CONF_EXPECTED_KEYS, RADIO_TRX_CONF_OPTIONAL_KEYS, radio_config_name, "TRX")
+        valid_radio_type_defined = True
 
     if not valid_radio_type_defined:
         logging.log(logging.ERROR, "Failed parsing file radio config file '"+radio_config_name+".json'. Couldn't find any valid radio types defined.")
 
     return json_data
 
+class Tracked_Transponder():
+    def __init__(self, downlink_frequency: int | None, uplink_frequency: int | None, inverting: bool = False) -> None:
+        """
+        The frequencies of a transponder that radios follow. Downlink or uplink can be None if the transponder doesn't have them.
+        The current frequencies start in the middle of the transponder and follow manual tuning of the radios.
+        """
+        self.downlink_freq = downlink_frequency
+        self.uplink_freq = uplink_frequency
+        self.inversion_multi = -1 if inverting else 1 # A multiplier to be applied to an offset if the transponder is inverting
+
+        self.current_downlink_frequency = downlink_frequency if downlink_frequency is not None else 0 # Frequency that the doppler correction will be applied to
+        self.current_uplink_frequency = uplink_frequency if uplink_frequency is not None else 0
+
+class Radio_Channel():
+    def __init__(self, client: hamlib_client.Hamlib_Client, name: str, direction: str, offset: int, radio_config: Dict,
+                 set_command: str = "F", get_command: str = "f") -> None:
+        """
+        A frequency that is doppler corrected on a radio: the only one of a receiver, transmitter or SDR, or the downlink or uplink of a transceiver.
+        Direction is "downlink" or "uplink", the offset is added to the corrected frequency in herz.
+        The radio config section provides the read-back interval, tuning step and deadband.
+        The set and get commands are the hamlib commands without the frequency (like "F" or "F Sub").
+        """
+        self.client = client
+        self.name = name
+        self.direction = direction
+        self.offset = offset
+        self.set_command = set_command
+        self.get_command = get_command
+
+        self.transponder = int(radio_config["transponder"]) - 1 # Index of the tracked transponder
+        self.readback_interval = float(radio_config["readback_interval"])
+        self.tuning_step = int(radio_config["tuning_step"])
+        self.min_change = max(-(-int(radio_config["deadband"]) // self.tuning_step), 1) * self.tuning_step # The deadband rounded up to whole tuning steps
+
+    def quantize(self, freq: float) -> int:
+        """Round a frequency to the tuning step of the radio."""
+        return round(freq / self.tuning_step) * self.tuning_step
+
 class Radio_Controller():
-    def __init__(self, radio_config_name: str, downlink_frequency: int | None, uplink_frequency: int | None, rx_usb_overwrite: str | None, tx_usb_overwrite: str | None, trx_usb_overwrite: str | None, inverting: bool = False, lock: bool = True) -> None:
+    def __init__(self, radio_config_name: str, downlink_frequency: int | None, uplink_frequency: int | None, rx_usb_overwrite: str | None, tx_usb_overwrite: str | None, trx_usb_overwrite: str | None, inverting: bool = False, lock: bool = True, supervisor: hamlib_daemon.Hamlib_Supervisor | None = None,
+                 extra_transponders: List[Tracked_Transponder] | None = None) -> None:
         """
         Initialize radio object. Must provide the name of the radio config file to be read (without the file extension).
         Optionally the downlink and uplink frequency of the satellite transponder, if it is inverting, USB port overwrites and wether to lock downlink and uplink together can be provided.
+        A supervisor can be provided to restart rigctld instances if they crash, it is only active once the supervisors thread is started.
+        Further transponders can be tracked at the same time, radios choose which one they follow with their `transponder` config key.
         """
         
         self.downlink_freq = downlink_frequency
         self.uplink_freq = uplink_frequency
+        self.transponders = [Tracked_Transponder(downlink_frequency, uplink_frequency, inverting)] + (extra_transponders if extra_transponders else [])
 
         self.lock = lock
-        self.inversion_multi = -1 if inverting else 1 # A multiplier to be applied to an offset if the transponder is inverting
 
         self.corrected_downlink = None
         self.corrected_uplink = None
 
+        self.supervisor = supervisor if supervisor else hamlib_daemon.Hamlib_Supervisor()
+
         # Parse config
         radio_config = parse_radio_config(radio_config_name)
 
@@ -79,207 +241,308 @@ class Radio_Controller():
         if (("sdr" in radio_config) or ("rx" in radio_config) or ("trx" in radio_config)) and downlink_frequency is None: # Warn user if a receiver has been defined but no downlink freq was provided
             logging.log(logging.WARN, "Receiver/Transceiver/SDR is defined in the configuration but no downlink frequency was provided. Receivers will be ignored.")
 
-        if ("tx" in radio_config) and ("rx" in radio_config):
-            if radio_config["tx"]["usb_port"] == radio_config["rx"]["usb_port"]:
-                logging.log(logging.ERROR, "Defined transmitter and receiver can't be the same device! Try defining a transceiver instead.")
-                exit()
-
-        # Initialize SDR if present in config
-        if "sdr" in radio_config:
-            sdr_config = radio_config["sdr"]
-            self.sdr_rigctld_port = int(sdr_config["rigctl_port"])
-
-            # Try to connect to SDR rigctl
-            try:
-                logging.log(logging.DEBUG, "Opening socket to rigctl (SDR)")
-                self.sdr_sock = socket.create_connection(("localhost", int(self.sdr_rigctld_port)), timeout=3)
-            except Exception as e:
-                logging.log(logging.ERROR, "Failed to open connection to SDR rigctl server. Skipping this radio.")
-                logging.log(logging.ERROR, e)
-                self.sdr_sock = None
-        else:
-            self.sdr_sock = None
-
-        # Initialize receiver in config
-        if "rx" in radio_config:
-            rx_config = radio_config["rx"]
-            self.rx_usb_port = rx_usb_overwrite if rx_usb_overwrite else rx_config["usb_port"]
-            self.rx_rigctl_ID = rx_config["rigctl_ID"]
-            self.rx_serial_speed = rx_config["serial_speed"]
-            self.rx_offset = rx_config["offset"]
-            self.rx_rigctld_port = util.get_unused_port("rigctld (receiver)") if rx_config["rigctl_port_overwrite"] == 0 else rx_config["rigctl_port_overwrite"]
-
-            # Check if offset and speed are ints
-            try:
-                self.rx_serial_speed = int(self.rx_serial_speed)
-            except ValueError:
-                logging.log(logging.ERROR, f"Configured receiver serial speed '{self.rx_serial_speed}' is not a valid integer.")
-                exit()
-            try:
-                self.rx_offset = int(self.rx_offset)
-            except ValueError:
-                logging.log(logging.ERROR, f"Configured receiver offset '{self.rx_offset}' is not a valid integer.")
-                exit()
-
-            # Attempt to start rigctld
-            logging.log(logging.INFO, "Starting rigctld (receiver)")
-            self.rx_rigctld = subprocess.Popen(
-                ["rigctld", "-m", str(self.rx_rigctl_ID), "-r", str(self.rx_usb_port), "-t", str(self.rx_rigctld_port), "-s", str(self.rx_serial_speed)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-
-            try:
-                stdout, stderr = self.rx_rigctld.communicate(timeout=1)
-                if self.rx_rigctld.returncode != 0:
-                    logging.log(logging.ERROR, "Rigctld failed with error code "+str(self.rx_rigctld.returncode))
-                    logging.log(logging.ERROR, "Error: "+str(stderr))
-                    if stderr == "rig_open: error = IO error":
-                        logging.log(logging.INFO, "Tip: Make sure you have the correct USB port selected." \
-                                                  "You can overwrite the USB port in the config file using -r")
+        # Make sure no two locally controlled radios are on the same USB port
+        usb_ports = {}
+        for role, description, _ in RIG_ROLES:
+            for index, device_config in enumerate(radio_config.get(role, [])):
+                if device_config["rigctld_address"]:
+                    continue
+                other = usb_ports.setdefault(device_config["usb_port"], _device_description(description, index, radio_config[role]))
+                if other != _device_description(description, index, radio_config[role]):
+                    logging.log(logging.ERROR, f"Defined {other} and {_device_description(description, index, radio_config[role])} can't be the same device! Try defining a transceiver instead.")
                     exit()
-                if self.rx_rigctld is None:
-                    logging.log(logging.ERROR, "Rigctld failed to start.")
-            except subprocess.TimeoutExpired: # Rigctld is running
-                pass
-
-            # Open socket to rigctld
-            try:
-                logging.log(logging.DEBUG, "Opening socket to rigctl (receiver)")
-                self.rx_sock = socket.create_connection(("localhost", int(self.rx_rigctld_port)), timeout=3)
-            except Exception as e:
-                logging.log(logging.ERROR, "Failed to open connection to receiver rigctl server. Skipping this radio.")
-                logging.log(logging.ERROR, e)
-                self.rx_sock = None
-        else:
-            self.rx_sock = None
-
-        # Initialize transmitter in config (this is the same as the receiver part)
-        if "tx" in radio_config:
-            tx_config = radio_config["tx"]
-            self.tx_usb_port = tx_usb_overwrite if tx_usb_overwrite else tx_config["usb_port"]
-            self.tx_rigctl_ID = tx_config["rigctl_ID"]
-            self.tx_serial_speed = tx_config["serial_speed"]
-            self.tx_offset = tx_config["offset"]
-            self.tx_rigctld_port = util.get_unused_port("rigctld (transmitter)") if tx_config["rigctl_port_overwrite"] == 0 else tx_config["rigctl_port_overwrite"]
-
-            # Check if offset and speed are ints
-            try:
-                self.tx_serial_speed = int(self.tx_serial_speed)
-            except ValueError:
-                logging.log(logging.ERROR, f"Configured transmitter serial speed '{self.tx_serial_speed}' is not a valid integer.")
-                exit()
-            try:
-                self.tx_offset = int(self.tx_offset)
-            except ValueError:
-                logging.log(logging.ERROR, f"Configured transmitter offset '{self.tx_offset}' is not a valid integer.")
-                exit()
-
-            # Attempt to start rigctld
-            logging.log(logging.INFO, "Starting rigctld (transmitter)")
-            self.tx_rigctld = subprocess.Popen(
-                ["rigctld", "-m", str(self.tx_rigctl_ID), "-r", str(self.tx_usb_port), "-t", str(self.tx_rigctld_port), "-s", str(self.tx_serial_speed)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
 
-            try:
-                stdout, stderr = self.tx_rigctld.communicate(timeout=1)
-                if self.tx_rigctld.returncode != 0:
-                    logging.log(logging.ERROR, "Rigctld failed with error code "+str(self.tx_rigctld.returncode))
-                    logging.log(logging.ERROR, "Error: "+str(stderr))
-                    if stderr == "rig_open: error = IO error":
-                        logging.log(logging.INFO, "Tip: Make sure you have the correct USB port selected." \
-                                                  "You can overwrite the USB port in the config file using -t")
-                    exit()
-                if self.tx_rigctld is None:
-                    logging.log(logging.ERROR, "Rigctld failed to start.")
-            except subprocess.TimeoutExpired: # Rigctld is running
-                pass
+        self.clients: List[hamlib_client.Hamlib_Client] = [] # Clients of all connected radios
+        self.daemons: Dict[hamlib_client.Hamlib_Client, hamlib_daemon.Hamlib_Daemon] = {} # Local rigctld instance of each radio that has one
+        self.channels: List[Radio_Channel] = [] # The frequencies that are doppler corrected, a transceiver has one for each direction
 
-            # Open socket to rigctld
+        # Connect to all SDRs in config
+        for index, sdr_config in enumerate(radio_config.get("sdr", [])):
+            name = f"rigctl ({_device_description('SDR', index, radio_config['sdr'])})"
             try:
-                logging.log(logging.DEBUG, "Opening socket to rigctl (transmitter)")
-                self.tx_sock = socket.create_connection(("localhost", int(self.tx_rigctld_port)), timeout=3)
+                logging.log(logging.DEBUG, f"Opening socket to {name}")
+                client = hamlib_client.Hamlib_Client(str(sdr_config["rigctl_host"]), int(sdr_config["rigctl_port"]), timeout=3, extended=False, name=name, probe_command="f")
             except Exception as e:
-                logging.log(logging.ERROR, "Failed to open connection to transmitter rigctl server. Skipping this radio.")
+                logging.log(logging.ERROR, f"Failed to open connection to {name} server. Skipping this radio.")
                 logging.log(logging.ERROR, e)
-                self.tx_sock = None
-        else:
-            self.tx_sock = None
+                continue
+            self.clients.append(client)
+            self.channels.append(Radio_Channel(client, name, "downlink", _config_int(sdr_config, "offset", name), sdr_config))
+
+        # Prepare rigctld for all hamlib controlled radios, they're started together. A remote rigctld is used as is
+        usb_overwrites = {"rx": rx_usb_overwrite, "tx": tx_usb_overwrite, "trx": trx_usb_overwrite}
+        rigs = [] # Role, description, config and local rigctld (or None) of every hamlib controlled radio
+        for role, description, _ in RIG_ROLES:
+            for index, device_config in enumerate(radio_config.get(role, [])):
+                device_description = _device_description(description, index, radio_config[role])
+                usb_port = usb_overwrites[role] if (usb_overwrites[role] and index == 0) else device_config["usb_port"] # Overwrites apply to the first radio of a role
+                serial_speed = _config_int(device_config, "serial_speed", device_description)
+
+                rigctld = None
+                if (not device_config["rigctld_address"]) and (device_config["backend"] == "rigctld"):
+                    vfo_flag = ["--vfo"] if device_config.get("vfo_mode") == "sub" else []
+                    rigctld = hamlib_daemon.Hamlib_Daemon(
+                        ["rigctld", "-m", str(device_config["rigctl_ID"]), "-r", str(usb_port), "-s", str(serial_speed)] + vfo_flag,
+                        f"rigctld ({device_description})",
+                        int(device_config["rigctl_port_overwrite"])
+                    )
+                rigs.append((role, device_description, device_config, rigctld, (str(usb_port), serial_speed)))
+
+        # Start all local rigctld instances in parallel and wait for them to accept connections
+        daemons = [rigctld for _, _, _, rigctld, _ in rigs if rigctld]
+        results = dict(zip(daemons, self.supervisor.launch(daemons)))
+
+        usb_flags = {role: usb_flag for role, _, usb_flag in RIG_ROLES}
+        for role, device_description, device_config, rigctld, serial_port in rigs:
+            if device_config["backend"] == "hamlib":
+                client = self._open_hamlib_bindings(int(device_config["rigctl_ID"]), serial_port, device_description) # type: ignore
+            elif device_config["backend"] in radio_backends.CAT_BACKENDS:
+                client = self._open_cat_client(str(device_config["backend"]), serial_port, int(device_config["civ_address"]), device_description) # type: ignore
+            elif rigctld:
+                client = self._check_daemon_result(rigctld, results[rigctld], usb_flags[role])
+            else:
+                client = self._connect_remote_rigctld(str(device_config["rigctld_address"]), device_description)
+            if not client:
+                continue
+            self.clients.append(client)
+            if rigctld:
+                self.daemons[client] = rigctld
+
+            if role == "rx":
+                self.channels.append(Radio_Channel(client, client.name, "downlink", _config_int(device_config, "offset", device_description), device_config))
+            elif role == "tx":
+                self.channels.append(Radio_Channel(client, client.name, "uplink", _config_int(device_config, "offset", device_description), device_config))
+            else:
+                self._add_transceiver(client, device_config, device_description)
+
+        for channel in [channel for channel in self.channels if channel.transponder >= len(self.transponders)]:
+            logging.log(logging.WARN, f"{channel.name} follows transponder {channel.transponder+1}, but only {len(self.transponders)} transponder(s) are tracked. Skipping it.")
+            self.channels.remove(channel)
+
+        # Frequency read-back state. Reads of the channels are spread out over their read-back interval
+        now = time.monotonic()
+        self.next_readback = {channel: now + channel.readback_interval*(index+1)/len(self.channels)
+                              for index, channel in enumerate(self.channels)}
+        self.last_sent: Dict[Radio_Channel, int] = {} # Last frequency sent to each channel
+        self.set_failures: Dict[Radio_Channel, int] = {} # Consecutive failed sets of each channel
+        self.retry_time: Dict[Radio_Channel, float] = {} # Monotonic time a channel whose set failed is tried again
+        self.failing_clients = set() # Radios whose last exchange failed, failures are only logged once until they answer again
+        self.targets: Dict[Radio_Channel, float] = {} # Unquantized frequency each channel should be on after the last update
+        self.last_update = None # Monotonic time of the last update
+        self.correction_rates: Dict[Radio_Channel, float] = {} # Change of each channels doppler correction in herz per second
+        self.predictions = {} # Expected application time, predicted and uncompensated doppler factor and base frequency of each channels last frequency
+        self.residuals: Dict[Radio_Channel, List[float]] = {}
+        self.reset_statistics()
+
+        self.downlink_correction = 0 # Doppler correction factor in hz of the first transponder
+        self.uplink_correction = 0
 
-        # TODO: transceiver
+    @property
+    def current_downlink_frequency(self) -> int:
+        """Downlink frequency of the first transponder that the doppler correction is applied to."""
+        return self.transponders[0].current_downlink_frequency
 
-        self.downlink_correction = 0 # Doppler correction factor in hz 
-        self.uplink_correction = 0
-        self.current_downlink_frequency = downlink_frequency if downlink_frequency is not None else 0 # Frequency that the doppler correction will be applied to
-        self.current_uplink_frequency = uplink_frequency if uplink_frequency is not None else 0
+    @property
+    def current_uplink_frequency(self) -> int:
+        """Uplink frequency of the first transponder that the doppler correction is applied to."""
+        return self.transponders[0].current_uplink_frequency
 
-    def _send_rigctl_command(self, sock: socket.socket, cmd: str):
+    def _check_daemon_result(self, rigctld: hamlib_daemon.Hamlib_Daemon, result: hamlib_client.Hamlib_Client | hamlib_daemon.Daemon_Error, usb_flag: str) -> hamlib_client.Hamlib_Client | None:
         """
-        Send a command to a specified rigctl(d) and return response lines (without newlines).
+        Get the client of a launched rigctld instance. Exits if rigctld exited. If it's running but doesn't accept connections, the radio is skipped and None is returned.
         """
-        logging.log(logging.DEBUG, f"Sending rigctl command '{cmd}'")
+        if not isinstance(result, hamlib_daemon.Daemon_Error):
+            return result
 
-        sock.sendall((cmd + '\n').encode('ascii'))
-        response = sock.recv(4096).decode('ascii') # if this line fails its probably a config error
-    
-        # multiple lines, strip trailing newline
-        return [line.strip() for line in response.splitlines()]
+        hamlib_daemon.log_daemon_error(result, usb_flag)
+        if result.returncode is not None:
+            exit()
+        logging.log(logging.ERROR, f"Failed to open connection to {rigctld.name}. Skipping this radio.")
+        return None
 
-    def _set_frequency(self, sock: socket.socket, freq: int):
+    def _open_hamlib_bindings(self, model: int, serial_port: Tuple[str, int], description: str) -> hamlib_bindings.Rig_Binding_Client | None:
+        """
+        Open a radio in-process through hamlibs python bindings, given its rigctl ID, USB port and serial speed. Returns None (skipping the radio) if it can't be opened.
+        """
+        logging.log(logging.INFO, f"Opening {description} through hamlibs python bindings")
+        try:
+            return hamlib_bindings.Rig_Binding_Client(model, serial_port[0], serial_port[1], name=f"hamlib ({description})")
+        except OSError as e:
+            logging.log(logging.ERROR, f"{e}. Skipping this radio.")
+            return None
+
+    def _open_cat_client(self, backend: str, serial_port: Tuple[str, int], civ_address: int, description: str) -> radio_backends.CAT_Client | None:
+        """
+        Open a radio with a native CAT backend, given its USB port and serial speed. Returns None (skipping the radio) if the port can't be opened.
         """
-        Send a rigctl(d) command to a specified socket to change the rig frequency. Frequency must be in herz.
+        logging.log(logging.INFO, f"Opening {description} using the {backend} CAT backend")
+        try:
+            return radio_backends.create_cat_client(backend, serial_port[0], serial_port[1], f"{backend} ({description})", civ_address)
+        except OSError as e:
+            logging.log(logging.ERROR, f"Failed to open {description} on {serial_port[0]}: {e}. Skipping this radio.")
+            return None
+
+    def _connect_remote_rigctld(self, address: str, description: str) -> hamlib_client.Hamlib_Client | None:
         """
+        Connect to a remote rigctld. The connection stays open and reconnects if it breaks. Returns None (skipping the radio) if it can't be reached.
+        """
+        host, port = util.parse_address(address) # type: ignore
+        logging.log(logging.INFO, f"Connecting to rigctld ({description}) at {address}")
+        try:
+            return hamlib_client.Hamlib_Client(host, port, timeout=3, name=f"rigctld ({description}, {address})", probe_command="f")
+        except OSError as e:
+            logging.log(logging.ERROR, f"Failed to open connection to {description} rigctl server at {address}. Skipping this radio.")
+            logging.log(logging.ERROR, e)
+            return None
+
+    def _add_transceiver(self, client: hamlib_client.Hamlib_Client, trx_config: Dict, description: str):
+        """
+        Add the downlink and uplink channels of a transceiver. In split mode, split operation is enabled on the transceiver.
+        In sub VFO mode, the VFOs are addressed directly.
+        """
+        rx_offset = _config_int(trx_config, "rx_offset", description)
+        tx_offset = _config_int(trx_config, "tx_offset", description)
 
-        self._send_rigctl_command(sock, f"F {freq}")
+        if trx_config["vfo_mode"] == "sub":
+            rx_vfo, tx_vfo = str(trx_config["rx_vfo"]), str(trx_config["tx_vfo"])
+            rx_commands, tx_commands = (f"F {rx_vfo}", f"f {rx_vfo}"), (f"F {tx_vfo}", f"f {tx_vfo}")
+        else:
+            rx_commands, tx_commands = ("F", "f"), ("I", "i")
+            try:
+                response = client.command(TRX_SPLIT_COMMAND)
+                if not response.ok:
+                    logging.log(logging.WARN, f"{client.name} rejected command '{response.command}' with error code {response.code}. "
+                                              "Make sure split operation is enabled on the radio.")
+            except OSError as e:
+                logging.log(logging.ERROR, f"Failed to enable split operation on {client.name}: {e}")
+
+        self.channels.append(Radio_Channel(client, client.name+" downlink", "downlink", rx_offset, trx_config, *rx_commands))
+        self.channels.append(Radio_Channel(client, client.name+" uplink", "uplink", tx_offset, trx_config, *tx_commands))
+
+    def set_io_deadline(self, seconds: float):
+        """Set the time a single exchange with each radio may take before it counts as failed, so one unresponsive radio can't stall the others for long."""
+        for client in self.clients:
+            client.timeout = seconds
+
+    def _dispatch(self, commands: Dict[Radio_Channel, str], action: str) -> Dict[Radio_Channel, hamlib_client.Hamlib_Response]:
+        """
+        Send one command for each of several channels concurrently and return the responses of the channels whose radio answered.
+        Commands for channels of the same radio are pipelined, so every radio costs one round trip.
+        The action (like "set frequency on") is used to log failures. Failed radios are tried again on the next update.
+        """
+        batches: Dict[hamlib_client.Hamlib_Client, List[Radio_Channel]] = {}
+        for channel in commands:
+            batches.setdefault(channel.client, []).append(channel)
+        results = hamlib_client.dispatch([(client, [commands[channel] for channel in channels]) for client, channels in batches.items()])
+
+        responses = {}
+        for (client, channels), result in zip(batches.items(), results):
+            if isinstance(result, hamlib_client.Device_Quarantined): # Skip the device until it responds again
+                continue
+            if isinstance(result, Exception): # The daemon might be restarting, try again on the next update
+                if client not in self.failing_clients:
+                    logging.log(logging.WARN, f"Failed to {action} {client.name}: {result}")
+                self.failing_clients.add(client)
+                continue
+            if client in self.failing_clients:
+                logging.log(logging.INFO, f"{client.name} responds again")
+                self.failing_clients.discard(client)
+            responses.update(zip(channels, result))
+        return responses
+
+    def _set_frequencies(self, frequencies: Dict[Radio_Channel, int]):
+        """
+        Set the frequencies of several channels at once. Frequencies must be in herz and quantized to the channels tuning step.
+        A channels command is skipped if its frequency didn't change by at least its deadband since it was last set.
+        A channel whose set failed (rejected or no answer) is retried with increasing delays, only the first failure in a row is logged.
+        """
 
-    def _read_frequency(self, sock: socket.socket, direction: str) -> int:
+        now = time.monotonic()
+        commands = {}
+        for channel, freq in frequencies.items():
+            if now < self.retry_time.get(channel, 0):
+                self.sets_delayed += 1
+                continue
+            if (channel in self.last_sent) and (abs(freq - self.last_sent[channel]) < channel.min_change):
+                self.sets_unchanged += 1
+                continue
+            commands[channel] = f"{channel.set_command} {freq}"
+
+        responses = self._dispatch(commands, "set frequency on")
+        for channel in commands:
+            response = responses.get(channel)
+            if response is not None:
+                self.sets_sent += 1
+                if response.ok:
+                    self.last_sent[channel] = frequencies[channel]
+                    if self.set_failures.pop(channel, 0) > 1:
+                        logging.log(logging.INFO, f"{channel.name} accepts frequencies again")
+                    self.retry_time.pop(channel, None)
+                    continue
+
+            failures = self.set_failures.get(channel, 0) + 1
+            self.set_failures[channel] = failures
+            self.retry_time[channel] = now + min(RETRY_MIN_DELAY * 2**(failures-1), RETRY_MAX_DELAY)
+            if response is not None and failures == 1:
+                logging.log(logging.WARN, f"{channel.name} rejected command '{response.command}' with error code {response.code}. "
+                                          "Retrying with increasing delays, further failures aren't logged.")
+
+    def _read_offsets(self, channels: List[Radio_Channel]) -> Dict[Radio_Channel, int]:
         """
-        Send a rigctl(d) command to a specified socket to read the current rig frequency.
-        Direction must be provided (either "uplink" or "downlink") to remove doppler correction from the frequency reading.
-        Returns frequency in herz.
+        Read the current frequency of several channels at once.
+        Returns how far in herz each channel was tuned away from the frequency that was last sent to it.
+        Channels that weren't sent anything yet or whose connection failed are left out.
         """
 
-        freq = int(self._send_rigctl_command(sock, "f")[0])
-        if direction == "uplink":
-            freq -= self.uplink_correction
-                
-            return round(freq)
-        elif direction == "downlink":
-            freq -= self.downlink_correction
+        commands = {channel: channel.get_command for channel in channels if channel in self.last_sent}
 
-            return round(freq)
-        else:
-            logging.log(logging.ERROR, "Invalid direction specified for read frequency command. This should never happen.")
-            exit()
+        offsets = {}
+        for channel, response in self._dispatch(commands, "read frequency from").items():
+            self.reads_sent += 1
+            try:
+                response.raise_for_code()
+                offsets[channel] = round(float(response.values[0])) - self.last_sent[channel]
+            except (hamlib_client.Hamlib_Error, ValueError, IndexError) as e: # Probably a config error, the channel is still set, just not followed
+                logging.log(logging.WARN, f"Failed to read frequency from {channel.name}: {e}")
+        return offsets
 
     def update_lock(self):
         """
         Synchronise the frequencies of uplink and downlink devices. The `update` function must be called to apply these updated frequencies.
+        Radios are only read when their read-back interval has passed. A radio that was read is still set by the following `update`
+        if its frequency left the deadband, so doppler correction continues even if it's read on every update.
         """
 
-        # Meassure frequencies of all downlink radios
-        down_freqs = {}
-        if self.sdr_sock:
-            down_freqs["sdr"] = self._read_frequency(self.sdr_sock, "downlink")
-        
-        if self.rx_sock: 
-            down_freqs["rx"] = self._read_frequency(self.rx_sock, "downlink")
-
-        # Meassure frequencies of all uplink radios
-        up_freqs = {}
-        if self.tx_sock:
-            up_freqs["tx"] = self._read_frequency(self.tx_sock, "uplink")
+        # Meassure frequencies of all channels that are due for a read-back
+        due = []
+        now = time.monotonic()
+        for channel in self.channels:
+            if now < self.next_readback[channel]:
+                self.reads_skipped += 1
+                continue
+            self.next_readback[channel] = now + channel.readback_interval
+            due.append(channel)
+        offsets = self._read_offsets(due)
+
+        for index, transponder in enumerate(self.transponders):
+            self._lock_transponder(transponder, {channel: offset for channel, offset in offsets.items() if channel.transponder == index})
+
+    def _lock_transponder(self, transponder: Tracked_Transponder, offsets: Dict[Radio_Channel, int]):
+        """Follow manual tuning of the radios of a transponder, given how far each read channel was tuned away from the frequency last sent to it."""
+
+        down_offsets = []
+        up_offsets = []
+        for channel, offset in offsets.items():
+            if channel.direction == "downlink":
+                down_offsets.append(offset)
+            else:
+                up_offsets.append(offset)
 
         # Check which downlink device has the greatest frequency offset from the current frequency
         down_offset = 0
         down_offset_abs = -1
 
-        for _, frequency in down_freqs.items():
-            offset = frequency - self.current_downlink_frequency
+        for offset in down_offsets:
             offset_abs = abs(offset)
             if offset_abs > down_offset_abs:
                 down_offset_abs = offset_abs
@@ -289,15 +552,14 @@ class Radio_Controller():
         up_offset = 0
         up_offset_abs = -1
 
-        for _, frequency in up_freqs.items():
-            offset = frequency - self.current_uplink_frequency
+        for offset in up_offsets:
             offset_abs = abs(offset)
             if offset_abs > up_offset_abs:
                 up_offset_abs = offset_abs
                 up_offset = offset
         
         # Check if it's necessary to update the other devices
-        if (up_offset_abs + down_offset_abs) < 4:
+        if (max(up_offset_abs, 0) + max(down_offset_abs, 0)) < LOCK_THRESHOLD:
             return
 
         # Check which radio has the biggest offset to know what offset should be applied to all other radios and set offsets
@@ -306,57 +568,161 @@ class Radio_Controller():
         if down_offset_abs < up_offset_abs: # uplink is the guide offset
             uplink_offset = up_offset
             if self.lock:
-                downlink_offset = up_offset * self.inversion_multi
+                downlink_offset = up_offset * transponder.inversion_multi
         else: # downlink is the guide offset
             downlink_offset = down_offset
             if self.lock:
-                uplink_offset = down_offset * self.inversion_multi
+                uplink_offset = down_offset * transponder.inversion_multi
 
         # Apply offsets
-        if self.downlink_freq:
-            self.current_downlink_frequency += downlink_offset
-        if self.uplink_freq:
-            self.current_uplink_frequency += uplink_offset
+        if transponder.downlink_freq:
+            transponder.current_downlink_frequency += downlink_offset
+        if transponder.uplink_freq:
+            transponder.current_uplink_frequency += uplink_offset
+
+        # Frequencies changed, so all radios of the transponder have to be set (even if the change is within their deadband)
+        for channel in self.channels:
+            if self.transponders[channel.transponder] is transponder:
+                self.last_sent.pop(channel, None)
+
+    def reset_statistics(self):
+        """Reset the counters of sent and skipped frequency reads and sets and the round trip statistics of the radios."""
+        self.reads_sent = 0
+        self.reads_skipped = 0
+        self.sets_sent = 0
+        self.sets_delayed = 0
+        self.sets_unchanged = 0
+        self.residuals = {}
+        for client in self.clients:
+            client.reset_statistics()
+
+    def device_latencies(self) -> Dict[str, Tuple[float, float]]:
+        """Get the smoothed and maximum round trip time in seconds of each radio by its name, for diagnostics."""
+        return {client.name: (client.rtt if client.rtt is not None else 0, client.rtt_max) for client in self.clients}
+
+    def log_statistics(self):
+        """Log how many frequency reads and sets were sent and how many were saved since the last reset, and the round trip times of each radio."""
+        total_sets = self.sets_sent + self.sets_delayed + self.sets_unchanged
+        logging.log(logging.INFO, f"Radio frequency reads sent: {self.reads_sent}/{self.reads_sent + self.reads_skipped}, "
+                                  f"sets sent: {self.sets_sent}/{total_sets} ({self.sets_unchanged} saved by tuning step and deadband, {self.sets_delayed} delayed after failures)")
+        for name, (rtt, rtt_max) in self.device_latencies().items():
+            logging.log(logging.INFO, f"{name} round trip time: {rtt*1000:.0f}ms (smoothed), {rtt_max*1000:.0f}ms (max)")
+        for channel, (count, total, maximum, uncompensated) in self.residuals.items():
+            logging.log(logging.INFO, f"{channel.name} doppler residual: {total/count:.1f}hz (mean), {maximum:.1f}hz (max), "
+                                      f"{uncompensated/count:.1f}hz (mean) without latency compensation")
+
+    def _doppler_factor(self, range_rate: float, range_rate_trend: float, seconds: float | np.ndarray) -> float | np.ndarray:
+        """
+        Get the relative doppler correction for a point in time, extrapolated from the range rate (km/s) and its trend (km/s²) at the sample time.
+        Seconds can be an array to get the corrections for several points in time at once.
+        """
+        return -(range_rate + range_rate_trend*seconds) / SPEED_OF_LIGHT
 
-    def update(self, range_rate: float):
+    def _record_residuals(self, range_rate: float, range_rate_trend: float, sample_time: float):
+        """
+        Check the frequencies of the last update against the doppler shift at the time they were expected to be applied,
+        which is known now from the current range rate and its trend.
+        """
+        for channel, (apply_time, predicted, uncompensated, base) in self.predictions.items():
+            if abs(sample_time - apply_time) > RESIDUAL_MAX_AGE:
+                continue
+            actual = self._doppler_factor(range_rate, range_rate_trend, apply_time - sample_time)
+            residual = abs(predicted - actual) * base
+            statistics = self.residuals.setdefault(channel, [0, 0.0, 0.0, 0.0]) # count, total residual, max residual, total uncompensated error
+            statistics[0] += 1
+            statistics[1] += residual
+            statistics[2] = max(statistics[2], residual)
+            statistics[3] += abs(uncompensated - actual) * base
+        self.predictions = {}
+
+    def update(self, range_rate: float, range_rate_trend: float = 0, sample_time: float | None = None):
         """
         Update all defined transmitters/receivers with the satellites range rate specified in km/s.
+        If the trend of the range rate (in km/s²) and the unix timestamp the range rate was calculated for are provided,
+        each radio gets the frequency for the time its command is expected to arrive there, based on its measured latency.
+        The frequencies of all radios (following any of the tracked transponders) are calculated together from the same range rate.
+        The commands are sent to all radios at once, so an update takes about as long as the slowest radio.
         """
 
-        # Handle downlink
+        now = time.monotonic()
+
+        # Calulate corrected frequencies of the first transponder for display
         if self.downlink_freq:
-            # Calulate corrected frequency
-            self.downlink_correction = -(range_rate / 299792.458) * self.current_downlink_frequency # type: ignore
+            self.downlink_correction = -(range_rate / SPEED_OF_LIGHT) * self.current_downlink_frequency # type: ignore
             self.corrected_downlink = round(self.downlink_correction + self.current_downlink_frequency)
-
-            # Update downlink listeners
-            if self.sdr_sock:
-                self._set_frequency(self.sdr_sock, self.corrected_downlink) # type: ignore
-
-            if self.rx_sock:
-                self._set_frequency(self.rx_sock, self.corrected_downlink+self.rx_offset) # type: ignore
-
-        # Handle uplink
         if self.uplink_freq:
-            # Calulate corrected frequency
-            self.uplink_correction = -(range_rate / 299792.458) * self.uplink_freq # type: ignore
+            self.uplink_correction = -(range_rate / SPEED_OF_LIGHT) * self.uplink_freq # type: ignore
             self.corrected_uplink = round(self.uplink_correction + self.current_uplink_frequency)
 
-            # Update uplink listeners
-            if self.tx_sock:
-                self._set_frequency(self.tx_sock, round(self.corrected_uplink)+self.tx_offset) # type: ignore
+        sample_age = (time.time() - sample_time) if sample_time is not None else 0
+        if sample_time is not None:
+            self._record_residuals(range_rate, range_rate_trend, sample_time)
+
+        # The doppler correction is applied to the base frequency of each channel, the offset (including manual tuning of the uplink) is added to it
+        channels = []
+        bases = []
+        offsets = []
+        for channel in self.channels:
+            transponder = self.transponders[channel.transponder]
+            if channel.direction == "downlink" and transponder.downlink_freq:
+                bases.append(transponder.current_downlink_frequency)
+                offsets.append(channel.offset)
+            elif channel.direction == "uplink" and transponder.uplink_freq:
+                bases.append(transponder.uplink_freq)
+                offsets.append(transponder.current_uplink_frequency - transponder.uplink_freq + channel.offset)
+            else:
+                continue
+            channels.append(channel)
+
+        # Calculate all channels frequencies for the time their commands arrive in one go, extrapolated along the range rate trend
+        bases = np.array(bases, dtype=float)
+        apply_ages = sample_age + np.array([channel.client.latency for channel in channels], dtype=float)
+        factors = self._doppler_factor(range_rate, range_rate_trend, apply_ages)
+        targets = bases + factors*bases + np.array(offsets, dtype=float)
+        rates = -(range_rate_trend / SPEED_OF_LIGHT) * bases
+
+        uncompensated = self._doppler_factor(range_rate, 0, 0)
+        for index, channel in enumerate(channels):
+            self.targets[channel] = float(targets[index])
+            self.correction_rates[channel] = float(rates[index])
+            if sample_time is not None:
+                self.predictions[channel] = (sample_time + float(apply_ages[index]), float(factors[index]), uncompensated, float(bases[index])) # type: ignore
+        self.last_update = now
+
+        self._set_frequencies({channel: channel.quantize(target) for channel, target in self.targets.items()})
+
+    def next_update_time(self) -> float:
+        """
+        Get the monotonic time at which the radios need their next `update_lock` and `update` call:
+        when the next read-back is due, a radios quantized frequency is expected to leave its deadband or a failed set is retried, whichever comes first.
+        The frequency change is predicted from how fast the doppler correction changed between the last two updates.
+        """
+        if self.last_update is None:
+            return 0
+
+        next_time = min(self.next_readback.values(), default=self.last_update + MAX_UPDATE_DELAY)
+        for channel in self.channels:
+            if channel not in self.targets:
+                continue
+            if channel not in self.last_sent: # Never set or the last set failed, retry right away or once its retry delay has passed
+                next_time = min(next_time, self.retry_time.get(channel, self.last_update))
+                continue
+            rate = self.correction_rates[channel]
+            if rate == 0:
+                continue
+
+            # The next command goes out once the frequency rounds to a value at least min_changes away from the sent one
+            boundary = self.last_sent[channel] + (1 if rate > 0 else -1) * (channel.min_change - channel.tuning_step/2)
+            next_time = min(next_time, self.last_update + max((boundary - self.targets[channel]) / rate, 0))
+
+        return min(next_time, self.last_update + MAX_UPDATE_DELAY)
 
     def close(self):
-        """Close all sockets and terminate rigctl instances"""
+        """Close all connections and terminate rigctl instances"""
         logging.log(logging.DEBUG, "Closing radio controller")
 
-        if self.sdr_sock:
-            self.sdr_sock.close()
-        
-        if self.rx_sock:
-            self.rx_sock.close()
-            self.rx_rigctld.terminate()
-
-        if self.tx_sock:
-            self.tx_sock.close()
-            self.tx_rigctld.terminate()
+        for client in self.clients:
+            client.close()
+            if client in self.daemons:
+                self.supervisor.remove(self.daemons[client])
+                self.daemons[client].terminate()
@@ -0,0 +1,214 @@
+from src import hamlib_client, hamlib_bindings
+from abc import ABC, abstractmethod
+from typing import Tuple
+import logging, re
+
+NATIVE_BACKENDS = ["gs232a", "gs232b", "easycomm2", "easycomm3", "rot2prog"]
+BACKENDS = ["rotctld", "hamlib"] + NATIVE_BACKENDS
+
+DEFAULT_SERIAL_SPEEDS = {"gs232a": 9600, "gs232b": 9600, "easycomm2": 9600, "easycomm3": 9600, "rot2prog": 600}
+SERIAL_TIMEOUT = 1 # Serial read timeout in seconds
+ROT2PROG_RESOLUTION = 10 # Pulses per degree used in Rot2Prog commands
+
+POSITION_REGEX = re.compile(r"[-+]?\d+(?:\.\d+)?")
+
+class Rotctld_Backend():
+    def __init__(self, client: hamlib_client.Hamlib_Client) -> None:
+        """
+        A rotor backend that talks to a rotctld instance using a hamlib client.
+        """
+        self.client = client
+
+    @property
+    def latency(self) -> float:
+        """Estimated one way latency to rotctld in seconds."""
+        return self.client.latency
+
+    def exchange(self, position: Tuple[int, int] | None, poll: bool) -> Tuple[float, float] | None:
+        """
+        Send a position (if provided) and read the current position (if poll is set) in a single round trip.
+        Returns the read position, or None if poll isn't set.
+        """
+        commands = [f"P {position[0]} {position[1]}"] if position else []
+        if poll:
+            commands.append("p")
+
+        responses = self.client.pipeline(commands)
+
+        if position and not responses[0].ok:
+            logging.log(logging.WARN, f"Rotctld rejected command '{responses[0].command}' with error code {responses[0].code}")
+        if poll:
+            responses[-1].raise_for_code()
+            return (float(responses[-1].values[0]), float(responses[-1].values[1]))
+        return None
+
+    def close(self):
+        self.client.close()
+
+class Hamlib_Rotor_Backend():
+    def __init__(self, model: int, usb_port: str, limits: Tuple[int, int, int, int]) -> None:
+        """
+        A rotor backend that calls hamlib in-process through its python bindings, without rotctld.
+        Takes the rotctl model ID, the USB port (empty for hamlibs default) and the minimum and maximum azimuth and elevation.
+        """
+        self.Hamlib = hamlib_bindings.import_hamlib()
+        self.rot = self.Hamlib.Rot(model)
+        if usb_port:
+            self.rot.set_conf("rot_pathname", usb_port)
+        for key, value in zip(("min_az", "max_az", "min_el", "max_el"), limits):
+            self.rot.set_conf(key, str(value))
+        self.rot.open()
+        if self.rot.error_status != self.Hamlib.RIG_OK:
+            raise OSError(f"Failed to open rotor: {self.Hamlib.rigerror(self.rot.error_status).strip()}")
+        self.latency = 0 # Serial latency is small compared to the rotors response time
+
+    def exchange(self, position: Tuple[int, int] | None, poll: bool) -> Tuple[float, float] | None:
+        """
+        Send a position (if provided) and read the current position (if poll is set).
+        Returns the read position, or None if poll isn't set.
+        """
+        if position:
+            self.rot.set_position(position[0], position[1])
+            if self.rot.error_status != self.Hamlib.RIG_OK:
+                hamlib_bindings.raise_for_status(self.Hamlib, self.rot.error_status, "rotor")
+                logging.log(logging.WARN, f"Rotor rejected position {position} with error code {self.rot.error_status}")
+        if poll:
+            azimuth, elevation = self.rot.get_position()
+            hamlib_bindings.raise_for_status(self.Hamlib, self.rot.error_status, "rotor")
+            if self.rot.error_status != self.Hamlib.RIG_OK:
+                raise hamlib_client.Hamlib_Error("get_position", self.rot.error_status)
+            return (float(azimuth), float(elevation))
+        return None
+
+    def close(self):
+        self.rot.close()
+
+class Serial_Rotor_Backend(ABC):
+    def __init__(self, usb_port: str, serial_speed: int) -> None:
+        """
+        Base class for rotor backends that talk to the rotor controller directly over a serial port, without rotctld.
+        Requires pyserial to be installed.
+        """
+        try:
+            import serial
+        except ImportError:
+            logging.log(logging.ERROR, "Native rotor backends require pyserial. Install it using `pip install pyserial`.")
+            exit()
+
+        self.port = serial.Serial(usb_port, serial_speed, timeout=SERIAL_TIMEOUT)
+        self.latency = 0 # Serial latency is small compared to the rotors response time
+
+    def _read_until(self, terminator: bytes) -> bytes:
+        """Read from the serial port until the terminator is received."""
+        data = self.port.read_until(terminator)
+        if not data.endswith(terminator):
+            raise TimeoutError(f"Rotor controller at {self.port.port} didn't respond")
+        return data
+
+    def _parse_numbers(self, response: bytes) -> Tuple[float, float]:
+        """Get the first two numbers in a text response."""
+        numbers = POSITION_REGEX.findall(response.decode("ascii", errors="replace"))
+        if len(numbers) < 2:
+            raise ValueError(f"Invalid position response from rotor controller: {response!r}")
+        return (float(numbers[0]), float(numbers[1]))
+
+    @abstractmethod
+    def set_position(self, azimuth: int, elevation: int):
+        """Send a position to the rotor controller."""
+
+    @abstractmethod
+    def get_position(self) -> Tuple[float, float]:
+        """Read the current azimuth and elevation from the rotor controller."""
+
+    def exchange(self, position: Tuple[int, int] | None, poll: bool) -> Tuple[float, float] | None:
+        """
+        Send a position (if provided) and read the current position (if poll is set).
+        Returns the read position, or None if poll isn't set.
+        """
+        if position:
+            self.set_position(position[0], position[1])
+        if poll:
+            return self.get_position()
+        return None
+
+    def close(self):
+        self.port.close()
+
+class GS232_Backend(Serial_Rotor_Backend):
+    """
+    Yaesu GS-232A/B protocol. The variants only differ in their position response format, which is parsed the same way.
+    """
+
+    def set_position(self, azimuth: int, elevation: int):
+        self.port.write(f"W{azimuth:03d} {elevation:03d}\r".encode("ascii"))
+
+    def get_position(self) -> Tuple[float, float]:
+        self.port.reset_input_buffer() # Drop anything the controller sent in response to set commands
+        self.port.write(b"C2\r")
+        return self._parse_numbers(self._read_until(b"\r"))
+
+class Easycomm_Backend(Serial_Rotor_Backend):
+    def __init__(self, usb_port: str, serial_speed: int, version: int = 2) -> None:
+        """
+        Easycomm II/III protocol. Easycomm III reads azimuth and elevation with separate queries.
+        """
+        super().__init__(usb_port, serial_speed)
+        self.version = version
+
+    def set_position(self, azimuth: int, elevation: int):
+        self.port.write(f"AZ{azimuth:.1f} EL{elevation:.1f}\n".encode("ascii"))
+
+    def get_position(self) -> Tuple[float, float]:
+        self.port.reset_input_buffer()
+        if self.version == 3:
+            self.port.write(b"AZ\nEL\n")
+            azimuth = self._read_until(b"\n")
+            elevation = self._read_until(b"\n")
+            return self._parse_numbers(azimuth + b" " + elevation)
+
+        self.port.write(b"AZ EL\n")
+        return self._parse_numbers(self._read_until(b"\n"))
+
+class Rot2Prog_Backend(Serial_Rotor_Backend):
+    """
+    SPID Rot2Prog protocol. Commands are 13 byte binary frames, status responses are 12 byte frames.
+    """
+
+    def _command(self, azimuth: float, elevation: float, command: int) -> bytes:
+        """Build a Rot2Prog command frame."""
+        horizontal = f"{round((azimuth+360)*ROT2PROG_RESOLUTION):04d}".encode("ascii")
+        vertical = f"{round((elevation+360)*ROT2PROG_RESOLUTION):04d}".encode("ascii")
+        return b"W" + horizontal + bytes([ROT2PROG_RESOLUTION]) + vertical + bytes([ROT2PROG_RESOLUTION, command, 0x20])
+
+    def set_position(self, azimuth: int, elevation: int):
+        self.port.write(self._command(azimuth, elevation, 0x2F)) # The controller doesn't respond to set commands
+
+    def get_position(self) -> Tuple[float, float]:
+        self.port.write(self._command(0, 0, 0x1F))
+        response = self.port.read(12)
+        if len(response) != 12 or response[0:1] != b"W":
+            raise ValueError(f"Invalid status response from Rot2Prog controller: {response!r}")
+
+        azimuth = response[1]*100 + response[2]*10 + response[3] + response[4]/10 - 360
+        elevation = response[6]*100 + response[7]*10 + response[8] + response[9]/10 - 360
+        return (azimuth, elevation)
+
+def create_native_backend(backend: str, usb_port: str, serial_speed: int) -> Serial_Rotor_Backend:
+    """
+    Create a native serial rotor backend by its name (see NATIVE_BACKENDS).
+    If serial_speed is 0, the usual speed of the protocol is used.
+    """
+    if serial_speed == 0:
+        serial_speed = DEFAULT_SERIAL_SPEEDS[backend]
+
+    logging.log(logging.DEBUG, f"Opening {backend} rotor backend on {usb_port} at {serial_speed} baud")
+    if backend in ("gs232a", "gs232b"):
+        return GS232_Backend(usb_port, serial_speed)
+    elif backend == "easycomm2":
+        return Easycomm_Backend(usb_port, serial_speed, 2)
+    elif backend == "easycomm3":
+        return Easycomm_Backend(usb_port, serial_speed, 3)
+    elif backend == "rot2prog":
+        return Rot2Prog_Backend(usb_port, serial_speed)
+
+    raise ValueError(f"Unknown rotor backend '{backend}'")
@@ -1,8 +1,48 @@
-from src import paths, util
-from typing import Dict, Tuple
-import subprocess, os, json, logging, socket, time
+from src import paths, util, rotor_planner, rotor_backends, hamlib_client, hamlib_daemon
+from typing import Dict, List, Tuple
+import os, json, logging, time, threading
 
 ROTOR_CONF_EXPECTED_KEYS = set(["usb_port", "rotctl_ID", "min_az", "max_az", "min_el", "max_el", "control_type", "home_on_end"])
+ROTOR_CONF_OPTIONAL_KEYS = { # Optional keys and their default values
+    "command_deadband": 1,          # Minimum change in degrees before a new position command is sent
+    "position_poll_interval": 5,    # Seconds between position reads while tracking (0 to disable)
+    "az_speed": rotor_planner.DEFAULT_AZ_SPEED, # Azimuth slew speed in degrees per second
+    "el_speed": rotor_planner.DEFAULT_EL_SPEED, # Elevation slew speed in degrees per second
+    "backend": "rotctld",           # How to talk to the rotor: rotctld, hamlib (in-process through hamlibs python bindings) or one of the native serial backends
+    "serial_speed": 0,              # Serial speed for native backends (0 to use the protocols usual speed)
+    "lead_time": 0,                 # Seconds the rotor points ahead of the satellite, to make up for slow rotors or wide beams
+    "rotctld_address": ""           # host:port of a remote rotctld to use instead of starting one (empty to start rotctld locally)
+}
+ROTOR_POLL_MIN_INTERVAL = 0.1 # Shortest interval between position reads while waiting for the rotor (near the target)
+ROTOR_POLL_MAX_INTERVAL = 2.0 # Longest interval between position reads while waiting for the rotor (far from the target)
+ROTOR_STALL_TIMEOUT = 10 # Seconds without progress after which the rotor is considered stalled
+ROTOR_STALL_MIN_PROGRESS = 0.5 # Degrees the rotor has to get closer to the target to count as progress
+ROTOR_TIMEOUT_MARGIN = 30 # Seconds added to twice the estimated slew time to get the timeout of a blocking rotation
+ROTOR_PROFILE_CONFIG_KEYS = ["az_speed", "el_speed"] # Keys that a measured rotor profile provides if they aren't set in the config
+
+def load_rotor_profile(rotor_config_name: str) -> Dict[str, float]:
+    """
+    Load the measured profile of a rotor (see `satgs test rotor characterize`). Returns an empty dict if the rotor hasn't been characterized.
+    """
+
+    file_path = os.path.join(paths.ROTOR_CONFIG_DIRECTORY_PATH, rotor_config_name+paths.ROTOR_PROFILE_SUFFIX)
+    try:
+        with open(file_path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        logging.log(logging.WARN, f"Rotor profile '{rotor_config_name+paths.ROTOR_PROFILE_SUFFIX}' contains invalid JSON. Ignoring it.")
+        return {}
+
+def save_rotor_profile(rotor_config_name: str, profile: Dict[str, float]):
+    """
+    Save a measured rotor profile next to the rotor config file.
+    """
+
+    file_path = os.path.join(paths.ROTOR_CONFIG_DIRECTORY_PATH, rotor_config_name+paths.ROTOR_PROFILE_SUFFIX)
+    with open(file_path, "w") as f:
+        json.dump(profile, f, indent=4)
 
 def parse_rotor_config(rotor_config_name: str) -> Dict[str, str | int]:
     """
@@ -23,87 +63,283 @@ def parse_rotor_config(rotor_config_name: str) -> Dict[str, str | int]:
         logging.log(logging.ERROR, "Failed parsing file rotor config file '"+rotor_config_name+".json'. JSON data parsed to invalid data type.")
         exit()
 
-    if set(json_data.keys()) != ROTOR_CONF_EXPECTED_KEYS:
+    keys = set(json_data.keys())
+    if (not ROTOR_CONF_EXPECTED_KEYS.issubset(keys)) or (not keys.issubset(ROTOR_CONF_EXPECTED_KEYS | ROTOR_CONF_OPTIONAL_KEYS.keys())):
         logging.log(logging.ERROR, "Failed parsing file rotor config file '"+rotor_config_name+".json'. Invalid keys present in config file.")
         exit()
 
+    # Use measured values from the rotor profile for keys that weren't set, then fill in defaults
+    profile = load_rotor_profile(rotor_config_name)
+    for key in ROTOR_PROFILE_CONFIG_KEYS:
+        if (key not in json_data) and (key in profile):
+            json_data[key] = profile[key]
+
+    for key, default in ROTOR_CONF_OPTIONAL_KEYS.items():
+        json_data.setdefault(key, default)
+
+    if json_data["backend"] not in rotor_backends.BACKENDS:
+        logging.log(logging.ERROR, "Failed parsing file rotor config file '"+rotor_config_name+".json'. Unknown backend '"+str(json_data["backend"])+"'. " \
+                                   "Valid backends are: "+", ".join(rotor_backends.BACKENDS))
+        exit()
+
+    if json_data["rotctld_address"] and (util.parse_address(str(json_data["rotctld_address"])) is None):
+        logging.log(logging.ERROR, "Failed parsing file rotor config file '"+rotor_config_name+".json'. Invalid rotctld address '"+str(json_data["rotctld_address"])+"', expected host:port.")
+        exit()
+
     return json_data
 
+class Rotor_Stall_Error(Exception):
+    """Raised when the rotor stops moving before reaching its target or doesn't reach it in time."""
+    pass
+
+class Rotor_Worker(threading.Thread):
+    def __init__(self, rotor: "Rotor_Controller") -> None:
+        """
+        A background thread that does all rotor I/O while tracking, so the tracking loop never blocks on the rotor.
+        Only the newest pending position command is kept, older ones are dropped. The position is polled in the background.
+        """
+        super().__init__(name="rotor-worker", daemon=True)
+        self.rotor = rotor
+        self.condition = threading.Condition()
+        self.pending_command = None
+        self.pending_time = 0 # Monotonic time the pending command was submitted
+        self.stopping = False
+
+        self.commands_coalesced = 0
+        self.commands_sent = 0
+        self.command_age_total = 0.0 # Time between submitting and sending commands
+        self.command_age_max = 0.0
+        self.io_errors = 0
+        self.io_count = 0
+        self.io_latency_total = 0.0
+        self.io_latency_max = 0.0
+
+    def submit(self, command: Tuple[int, int]):
+        """Queue a target position, replacing any position that hasn't been sent yet."""
+        with self.condition:
+            if self.pending_command is not None:
+                self.commands_coalesced += 1
+            self.pending_command = command
+            self.pending_time = time.monotonic()
+            self.condition.notify()
+
+    def stop(self):
+        """Stop the worker after its current exchange and wait for it to finish."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.join()
+
+    def _seconds_until_poll(self) -> float | None:
+        """Get the seconds until the next position poll is due, or None if polling is disabled."""
+        if self.rotor.position_poll_interval <= 0:
+            return None
+        return max(self.rotor.last_poll_time + self.rotor.position_poll_interval - time.monotonic(), 0)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while (not self.stopping) and (self.pending_command is None):
+                    wait_time = self._seconds_until_poll()
+                    if wait_time == 0:
+                        break
+                    self.condition.wait(wait_time)
+                if self.stopping:
+                    return
+                command = self.pending_command
+                command_time = self.pending_time
+                self.pending_command = None
+
+            wait_time = self._seconds_until_poll()
+            poll = (wait_time is not None) and (wait_time == 0)
+
+            start_time = time.monotonic()
+            if command:
+                self.commands_sent += 1
+                self.command_age_total += start_time - command_time
+                self.command_age_max = max(self.command_age_max, start_time - command_time)
+            try:
+                self.rotor._exchange(command, poll)
+            except hamlib_client.Device_Quarantined: # Already logged when the rotor was quarantined
+                time.sleep(0.5)
+                continue
+            except Exception as e:
+                self.io_errors += 1
+                logging.log(logging.WARN, f"Rotor '{self.rotor.name}' I/O failed: {e}")
+                time.sleep(0.5) # Don't busy loop while the rotor is unreachable
+                continue
+            latency = time.monotonic() - start_time
+
+            self.io_count += 1
+            self.io_latency_total += latency
+            self.io_latency_max = max(self.io_latency_max, latency)
+
 class Rotor_Controller():
-    def __init__(self, rotor_config_name: str, usb_overwrite: str | None = None, rotor_mode_overwrite: int | None = None) -> None:
+    def __init__(self, rotor_config_name: str, usb_overwrite: str | None = None, rotor_mode_overwrite: int | None = None, supervisor: hamlib_daemon.Hamlib_Supervisor | None = None) -> None:
         """
         Initialize rotor object. Must provide the name of the rotor config file to be read, without the extension.
         Optionally, define a usb port to overwrite the one in the config.
+        A supervisor can be provided to restart rotctld if it crashes, it is only active once the supervisors thread is started.
         """
 
         # Parse config
         rotor_config = parse_rotor_config(rotor_config_name)
 
+        self.name = rotor_config_name
         self.usb_port = str(rotor_config["usb_port"]) if usb_overwrite is None else usb_overwrite
         self.rotctl_ID = str(rotor_config["rotctl_ID"])
-        self.rotctld_port = util.get_unused_port("rotctld")
+        self.backend_name = str(rotor_config["backend"])
+        self.serial_speed = int(rotor_config["serial_speed"])
         self.min_az = int(rotor_config["min_az"])
         self.max_az = int(rotor_config["max_az"])
         self.min_el = int(rotor_config["min_el"])
         self.max_el = int(rotor_config["max_el"])
         self.control_type = int(rotor_config["control_type"]) if rotor_mode_overwrite is None else rotor_mode_overwrite
         self.home_on_end = bool(rotor_config["home_on_end"])
+        self.command_deadband = float(rotor_config["command_deadband"])
+        self.position_poll_interval = float(rotor_config["position_poll_interval"])
+        self.az_speed = float(rotor_config["az_speed"])
+        self.el_speed = float(rotor_config["el_speed"])
+        self.lead_time = float(rotor_config["lead_time"])
+        self.rotctld_address = str(rotor_config["rotctld_address"])
+        self.command_latency = float(load_rotor_profile(rotor_config_name).get("command_latency", 0))
 
-        # Attempt to start rotctld
-        logging.log(logging.INFO, "Starting rotctld")
-        set_conf_arg = "--set-conf=min_az="+str(self.min_az)+",max_az="+str(self.max_az)+",min_el="+str(self.min_el)+",max_el="+str(self.max_el)
-        self.rotctld = subprocess.Popen(
-            ["rotctld", "-m", str(self.rotctl_ID), "-r", str(self.usb_port), "-t", str(self.rotctld_port), set_conf_arg],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-
-        try:
-            stdout, stderr = self.rotctld.communicate(timeout=1)
-            if self.rotctld.returncode != 0:
-                logging.log(logging.ERROR, "Rotctld failed with error code "+str(self.rotctld.returncode))
-                logging.log(logging.ERROR, "Error: "+str(stderr))
-                if stderr == "rot_open: error = IO error":
-                    logging.log(logging.INFO, "Tip: Make sure you have the correct USB port selected." \
-                                              "You can overwrite the USB port in the config file using -o")
+        # Open native backend or start rotctld
+        self.supervisor = supervisor if supervisor else hamlib_daemon.Hamlib_Supervisor()
+        self.rotctld = None
+        if self.backend_name in rotor_backends.NATIVE_BACKENDS:
+            logging.log(logging.INFO, f"Opening {self.backend_name} rotor backend")
+            try:
+                self.backend = rotor_backends.create_native_backend(self.backend_name, self.usb_port, self.serial_speed)
+            except OSError as e: # Includes pyserials SerialException, for example if the port doesn't exist or is busy
+                logging.log(logging.ERROR, f"Failed to open rotor on {self.usb_port}: {e}")
                 exit()
-            if self.rotctld is None:
-                logging.log(logging.ERROR, "Rotctld failed to start.")
-        except subprocess.TimeoutExpired: # Rotctld is running
-            pass
-
-        logging.log(logging.DEBUG, "Opening socket to rotctld")
-        self.sock = socket.create_connection(("localhost", int(self.rotctld_port)), timeout=3)
+        elif self.backend_name == "hamlib":
+            logging.log(logging.INFO, "Opening rotor through hamlibs python bindings")
+            try:
+                self.backend = rotor_backends.Hamlib_Rotor_Backend(int(self.rotctl_ID), self.usb_port, (self.min_az, self.max_az, self.min_el, self.max_el))
+            except OSError as e:
+                logging.log(logging.ERROR, e)
+                exit()
+        elif self.rotctld_address:
+            self.backend = rotor_backends.Rotctld_Backend(self._connect_remote_rotctld())
+        else:
+            self.backend = rotor_backends.Rotctld_Backend(self._start_rotctld())
 
         self.current_az = None
         self.current_el = None
 
-    def _send_rotctld_command(self, cmd: str):
+        self.plan = None # Pass plan, set with `plan_pass`
+
+        self.client_lock = threading.Lock() # Held for every exchange with the backend, as the worker thread shares it
+        self.worker = None # Background I/O worker, started with `start_worker`
+
+        self.last_sent_az = None # Last position sent to the rotor, used for the command deadband
+        self.last_sent_el = None
+        self.last_poll_time = 0
+
+        self.reset_statistics()
+
+    def _connect_remote_rotctld(self) -> hamlib_client.Hamlib_Client:
         """
-        Send a command to rotctld and return response lines (without newlines).
+        Connect to the remote rotctld configured in rotctld_address. The connection stays open, reconnects if it breaks and its latency is compensated while tracking.
         """
-        logging.log(logging.DEBUG, f"Sending rotctld command '{cmd}'")
-        self.sock.sendall((cmd + '\n').encode('ascii'))
-        response = self.sock.recv(4096).decode('ascii')
-    
-        # multiple lines, strip trailing newline
-        return [line.strip() for line in response.splitlines()]
-    
-    def _apply_control_mode(self, azimuth: int, elevation: int) -> Tuple[int, int]:
+        host, port = util.parse_address(self.rotctld_address) # type: ignore
+        logging.log(logging.INFO, f"Connecting to rotctld at {self.rotctld_address}")
+        try:
+            return hamlib_client.Hamlib_Client(host, port, timeout=3, name=f"rotctld ({self.rotctld_address})", probe_command="p")
+        except OSError as e:
+            logging.log(logging.ERROR, f"Failed to connect to rotctld at {self.rotctld_address}: {e}")
+            exit()
+
+    def _start_rotctld(self) -> hamlib_client.Hamlib_Client:
+        """
+        Start a rotctld instance for the rotor and return a client connected to it once it's ready.
+        """
+        set_conf_arg = "--set-conf=min_az="+str(self.min_az)+",max_az="+str(self.max_az)+",min_el="+str(self.min_el)+",max_el="+str(self.max_el)
+        self.rotctld = hamlib_daemon.Hamlib_Daemon(["rotctld", "-m", str(self.rotctl_ID), "-r", str(self.usb_port), set_conf_arg], "rotctld")
+        client = self.supervisor.launch([self.rotctld])[0]
+        if isinstance(client, hamlib_daemon.Daemon_Error):
+            hamlib_daemon.log_daemon_error(client, "-o")
+            exit()
+
+        return client
+
+    @property
+    def target_offset(self) -> float:
+        """
+        Seconds ahead of now that the rotor should be pointed to: the configured lead time plus the measured latency of the link to the rotor.
+        """
+        return self.lead_time + self.backend.latency
+
+    def _apply_control_mode(self, azimuth: int, elevation: int, timestamp: float | None = None) -> Tuple[int, int]:
         """
         Applies control mode to target azimuth/elevation to get the real position that the rotor needs to spin to.
+        If a pass plan is set, the plan is followed instead. The timestamp (unix time) is used to look up the planned position.
+        Without a plan, control type 0 uses the frame of control type 1 until a plan has chosen one, like the planner does.
         """
 
-        if self.control_type == 2:
-            azimuth = (round(self.max_az/2) + azimuth) % self.max_az
+        if self.plan:
+            return self.plan.to_rotor(azimuth, elevation, self.min_az, self.max_az, self.min_el, self.max_el, timestamp)
 
+        azimuth = round(rotor_planner.frame_azimuth(azimuth, rotor_planner.frame_offset(self.control_type, self.max_az)))
         return (azimuth, elevation)
+
+    def plan_pass(self, samples: List[Tuple[float, float, float]]) -> rotor_planner.Rotor_Plan | None:
+        """
+        Plan the rotor path for a whole pass and follow it in all following updates.
+        Samples must be a list of (unix timestamp, azimuth, elevation) tuples covering the pass.
+        Control type 0 lets the planner choose between control type 1 and 2, otherwise the configured control type is kept.
+        """
+
+        control_types = [1, 2] if self.control_type == 0 else [self.control_type]
+
+        start_position = None
+        try:
+            self.update_current_position()
+            start_position = (self.current_az, self.current_el)
+        except Exception as e:
+            logging.log(logging.DEBUG, f"Failed to read rotor position for pass planning: {e}")
+
+        self.plan = rotor_planner.plan_pass(samples, control_types, self.min_az, self.max_az, self.min_el, self.max_el, start_position, self.az_speed, self.el_speed) # type: ignore
+        return self.plan
+
+    def estimate_slew_time(self, azimuth: float, elevation: float, timestamp: float | None = None) -> float:
+        """
+        Estimate how many seconds the rotor needs to move from its last read position to a target azimuth and elevation.
+        Control mode (or pass plan) is applied to the target. The timestamp is used to look up the planned position.
+        """
+
+        if self.current_az is None or self.current_el is None:
+            self.update_current_position()
+
+        target_azimuth, target_elevation = self._apply_control_mode(azimuth, elevation, timestamp) # type: ignore
+        return self.command_latency + rotor_planner.slew_time(self.current_az, self.current_el, target_azimuth, target_elevation, self.az_speed, self.el_speed) # type: ignore
+
+    def find_intercept(self, samples: List[Tuple[float, float, float]], start_timestamp: float) -> Tuple[float, float, float] | None:
+        """
+        Find the first pass sample (unix timestamp, azimuth, elevation) the rotor can reach in time when it starts moving at start_timestamp.
+        The rotor points `lead_time` ahead of the satellite, so it has to reach a samples position that much earlier.
+        Returns None if no sample can be reached.
+        """
+
+        for sample in samples:
+            timestamp, azimuth, elevation = sample
+            if self.estimate_slew_time(azimuth, elevation, timestamp) + self.lead_time <= timestamp - start_timestamp:
+                return sample
+        return None
+
+    def clear_plan(self):
+        """Stop following the current pass plan. The control type chosen by the plan is kept."""
+        if self.plan:
+            self.control_type = self.plan.control_type
+        self.plan = None
     
-    def rotate_to(self, azimuth: int, elevation: int):
+    def _position_command(self, azimuth: int, elevation: int, force: bool = False) -> Tuple[int, int] | None:
         """
-        Send rotctld command to spin rotor to a certain azimuth and elevation. Doesn't take control mode into account. 
+        Get the position to send to the rotor to spin it to a certain azimuth and elevation. Doesn't take control mode into account.
         Automatically clamps too high/low azimuth/elevation to maximum/minimum.
+        Returns None if the position hasn't changed by at least the configured deadband, unless force is set.
         """
 
         # Clamp elevation value
@@ -112,7 +348,7 @@ class Rotor_Controller():
         elif elevation > self.max_el:
             if self.max_el > 90:
                 logging.log(logging.WARN, "Tried to rotate to a too high elevation on a rotor that supports elevations of more than 90°. This is likely due to a bug and will cause issues.")
-            elevation = self.max_az
+            elevation = self.max_el
 
         # Clamp azimuth value
         if azimuth < self.min_az:
@@ -122,34 +358,114 @@ class Rotor_Controller():
                 logging.log(logging.WARN, "Tried to rotate to a too high azimuth on a rotor that supports azimuths of more than 360°. This is likely due to a bug and will cause issues.")
             azimuth = self.max_az
 
-        self._send_rotctld_command(f"P {azimuth} {elevation}")
+        # Skip command if target hasn't moved out of the deadband since the last sent position
+        if (not force) and (self.last_sent_az is not None) and (self.last_sent_el is not None):
+            if (abs(azimuth - self.last_sent_az) < self.command_deadband) and (abs(elevation - self.last_sent_el) < self.command_deadband):
+                self.commands_skipped += 1
+                return None
+
+        return (azimuth, elevation)
+
+    def rotate_to(self, azimuth: int, elevation: int, force: bool = False):
+        """
+        Send command to spin rotor to a certain azimuth and elevation. Doesn't take control mode into account. 
+        Automatically clamps too high/low azimuth/elevation to maximum/minimum.
+        The command is skipped if the position hasn't changed by at least the configured deadband, unless force is set.
+        """
+
+        position = self._position_command(azimuth, elevation, force)
+        if position:
+            self._exchange(position, False)
+
+    def read_position(self) -> Tuple[float, float]:
+        """
+        Read the current rotor position without rounding. Returns a tuple of azimuth and elevation.
+        """
+        with self.client_lock:
+            position = self.backend.exchange(None, True)
+        self.last_poll_time = time.monotonic()
+        self.polls_sent += 1
+
+        return position # type: ignore
+
+    def _exchange(self, position: Tuple[int, int] | None, poll: bool):
+        """
+        Send a position and/or a position read (in a single round trip where the backend allows it) and store the read position.
+        The position only counts as sent for the command deadband once the exchange succeeded, so a failed command is sent again.
+        """
+        with self.client_lock:
+            try:
+                read_position = self.backend.exchange(position, poll)
+            except Exception:
+                if position:
+                    self.commands_failed += 1
+                raise
+
+        if position:
+            self.last_sent_az, self.last_sent_el = position
+            self.commands_sent += 1
+
+        if read_position:
+            self.last_poll_time = time.monotonic()
+            self.polls_sent += 1
+            self.current_az = round(read_position[0])
+            self.current_el = round(read_position[1])
+
+    def start_worker(self):
+        """
+        Move rotor I/O to a background worker. While it runs, `update` never blocks on the rotor and position reads happen in the background.
+        """
+        if self.worker is None:
+            self.worker = Rotor_Worker(self)
+            self.worker.start()
+
+    def stop_worker(self):
+        """Stop the background worker. Pending commands that haven't been sent yet are dropped."""
+        if self.worker is not None:
+            self.worker.stop()
+            self.last_worker = self.worker # Kept for statistics
+            self.worker = None
 
     def update_current_position(self):
         """
         Get current rotor position and store it in the current_az and current_el variables.
         """
-        resp = self._send_rotctld_command("p")
+        azimuth, elevation = self.read_position()
         
-        self.current_az = round(float(resp[0]))
-        self.current_el = round(float(resp[1]))
+        self.current_az = round(azimuth)
+        self.current_el = round(elevation)
 
-    def update(self, new_azimuth: int, new_elevation: int):
+    def update(self, new_azimuth: int, new_elevation: int, timestamp: float | None = None):
         """
         Update rotor movement with new target elevation and azimuth values.
+        Optionally provide the unix timestamp the position was calculated for to follow the pass plan.
         """
         
-        # Read azimuth and elevation
-        self.update_current_position()
-
         # Apply alternate control style if option is set
-        new_azimuth, new_elevation = self._apply_control_mode(new_azimuth, new_elevation)
+        new_azimuth, new_elevation = self._apply_control_mode(new_azimuth, new_elevation, timestamp)
+
+        command = self._position_command(new_azimuth, new_elevation)
 
-        self.rotate_to(new_azimuth, new_elevation)
+        # Hand the command to the background worker if it's running. It also takes care of position reads.
+        if self.worker is not None:
+            if command:
+                self.worker.submit(command)
+            return
 
-    def rotate_to_blocking(self, azimuth: int, elevation: int, tolerance: int = 2):
+        # Read azimuth and elevation if polling is enabled and due. This goes out in the same round trip as the position command.
+        poll = (self.position_poll_interval > 0) and (time.monotonic() - self.last_poll_time >= self.position_poll_interval)
+        if not poll:
+            self.polls_skipped += 1
+
+        self._exchange(command, poll)
+
+    def rotate_to_blocking(self, azimuth: int, elevation: int, tolerance: int = 2, timeout: float | None = None) -> float:
         """
         Spins the rotor to a certain position and blocks (sleeps) until it has reached the target position.
         Requires target azimuth, elevation, and inaccuracy tolerance in degrees.
+        The position is read rarely while the rotor is far from the target and often when it is close, based on the observed slew speed.
+        Raises `Rotor_Stall_Error` if the rotor stops making progress or doesn't arrive within the timeout
+        (by default twice the estimated slew time plus a margin). Returns the time waited in seconds.
         """
 
         # If alternate control type is used, make sure the correct target azimuth is being checked for
@@ -172,21 +488,96 @@ class Rotor_Controller():
         elif target_elevation > self.max_el:
             if abs(target_elevation - self.max_el) > tolerance:
                 logging.log(logging.WARN, f"Target elevation {target_elevation} is too far from maximum possible elevation to be in tolerance. Setting target to closest elevation possible.")
-                target_elevation = self.min_el
+                target_elevation = self.max_el
 
         # Rotate to target location
-        self.update(azimuth, elevation)
+        start_time = time.monotonic()
+        self.rotate_to(target_azimuth, target_elevation, force=True)
+        azimuth_reading, elevation_reading = self.read_position()
+
+        if timeout is None:
+            timeout = 2*(self.command_latency + rotor_planner.slew_time(azimuth_reading, elevation_reading, target_azimuth, target_elevation, self.az_speed, self.el_speed)) + ROTOR_TIMEOUT_MARGIN
+
+        az_speed = self.az_speed # Observed speeds, start with the configured ones
+        el_speed = self.el_speed
+        last_reading_time = start_time
+        best_remaining = max(abs(target_azimuth-azimuth_reading), abs(target_elevation-elevation_reading))
+        last_progress_time = start_time
 
         # Check if current rotation is within tolerated range of target angles
-        while (abs(target_azimuth-self.current_az) > 2) or (abs(target_elevation-self.current_el) > 2): # type: ignore
-            self.update_current_position()
-            logging.log(logging.DEBUG, f"Rotating to target - AZ {self.current_az} -> {target_azimuth}  EL {self.current_el} -> {target_elevation}")
-            time.sleep(0.5)
+        while (abs(target_azimuth-azimuth_reading) > tolerance) or (abs(target_elevation-elevation_reading) > tolerance):
+            now = time.monotonic()
+            remaining_az = abs(target_azimuth-azimuth_reading)
+            remaining_el = abs(target_elevation-elevation_reading)
+
+            # Check for stall and timeout
+            if max(remaining_az, remaining_el) < best_remaining - ROTOR_STALL_MIN_PROGRESS:
+                best_remaining = max(remaining_az, remaining_el)
+                last_progress_time = now
+            if now - last_progress_time > ROTOR_STALL_TIMEOUT + self.command_latency:
+                raise Rotor_Stall_Error(f"Rotor stalled at AZ {round(azimuth_reading, 1)} EL {round(elevation_reading, 1)} while rotating to AZ {target_azimuth} EL {target_elevation} " \
+                                        f"(no progress for {ROTOR_STALL_TIMEOUT}s)")
+            if now - start_time > timeout:
+                raise Rotor_Stall_Error(f"Rotor didn't reach AZ {target_azimuth} EL {target_elevation} within {round(timeout)}s " \
+                                        f"(currently at AZ {round(azimuth_reading, 1)} EL {round(elevation_reading, 1)})")
+
+            # Predict arrival and sleep for half of the predicted time, so polling gets denser close to the target
+            predicted_arrival = max(max(remaining_az-tolerance, 0)/az_speed, max(remaining_el-tolerance, 0)/el_speed)
+            time.sleep(min(max(predicted_arrival/2, ROTOR_POLL_MIN_INTERVAL), ROTOR_POLL_MAX_INTERVAL))
+
+            # Read new position and update observed speeds
+            previous_az, previous_el = azimuth_reading, elevation_reading
+            azimuth_reading, elevation_reading = self.read_position()
+            now = time.monotonic()
+            elapsed = now - last_reading_time
+            last_reading_time = now
+            if abs(azimuth_reading-previous_az) > 0:
+                az_speed = (az_speed + abs(azimuth_reading-previous_az)/elapsed) / 2
+            if abs(elevation_reading-previous_el) > 0:
+                el_speed = (el_speed + abs(elevation_reading-previous_el)/elapsed) / 2
+
+            logging.log(logging.DEBUG, f"Rotating to target - AZ {round(azimuth_reading)} -> {target_azimuth}  EL {round(elevation_reading)} -> {target_elevation}")
+
+        self.current_az = round(azimuth_reading)
+        self.current_el = round(elevation_reading)
+
+        waited = time.monotonic() - start_time
+        logging.log(logging.INFO, f"Rotor '{self.name}' reached target in {round(waited, 1)}s")
+        return waited
+
+    def reset_statistics(self):
+        """Reset the counters of sent and skipped rotor commands."""
+        self.commands_sent = 0 # Position commands the rotor received
+        self.commands_skipped = 0
+        self.commands_failed = 0
+        self.polls_sent = 0
+        self.polls_skipped = 0
+        self.last_worker = None
+
+    def log_statistics(self):
+        """Log how many position commands and reads were sent and how many were saved since the last reset."""
+        worker = self.worker if self.worker is not None else self.last_worker
+        coalesced = worker.commands_coalesced if worker else 0
+
+        total_commands = self.commands_sent + self.commands_skipped + coalesced + self.commands_failed
+        logging.log(logging.INFO, f"Rotor '{self.name}' commands sent: {self.commands_sent}/{total_commands} ({self.commands_skipped} saved by deadband, {coalesced} coalesced, {self.commands_failed} failed)")
+
+        if worker:
+            average_latency = (worker.io_latency_total / worker.io_count) if worker.io_count else 0
+            average_age = (worker.command_age_total / worker.commands_sent) if worker.commands_sent else 0
+            logging.log(logging.INFO, f"Rotor '{self.name}' I/O: {self.polls_sent} position reads, {worker.io_errors} errors, "
+                                      f"latency avg {round(average_latency*1000)}ms / max {round(worker.io_latency_max*1000)}ms, "
+                                      f"command age avg {round(average_age*1000)}ms / max {round(worker.command_age_max*1000)}ms")
+        else:
+            logging.log(logging.INFO, f"Rotor '{self.name}' position reads: {self.polls_sent}/{self.polls_sent + self.polls_skipped} ({self.polls_skipped} saved)")
 
     def close(self):
-        """Close socket and terminate rotctl instance"""
+        """Close connection and terminate rotctl instance"""
         logging.log(logging.DEBUG, "Closing rotor controller")
 
-        self.sock.close()
-        self.rotctld.terminate()
+        self.stop_worker()
+        self.backend.close()
+        if self.rotctld:
+            self.supervisor.remove(self.rotctld)
+            self.rotctld.terminate()
 
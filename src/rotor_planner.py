@@ -0,0 +1,187 @@
+from typing import List, Tuple
+import bisect, logging
+
+UNWIND_THRESHOLD = 180 # Azimuth jumps between two pass samples larger than this (in degrees) count as an unwind
+FLIP_OVER_TOLERANCE = 5 # How many degrees the maximum elevation may be short of 180-min_el for flip-over to still be used
+DEFAULT_AZ_SPEED = 3.0 # Default rotor azimuth speed in degrees per second
+DEFAULT_EL_SPEED = 2.0 # Default rotor elevation speed in degrees per second
+OUT_OF_RANGE_PENALTY = 10.0 # Cost in seconds per degree of pointing error caused by positions outside the rotor range
+
+def slew_time(from_az: float, from_el: float, to_az: float, to_el: float, az_speed: float = DEFAULT_AZ_SPEED, el_speed: float = DEFAULT_EL_SPEED) -> float:
+    """
+    Estimate the time in seconds a rotor needs to move between two rotor positions.
+    Azimuth and elevation are assumed to move at the same time.
+    """
+    return max(abs(to_az-from_az)/az_speed, abs(to_el-from_el)/el_speed)
+
+def frame_offset(control_type: int, max_az: int) -> int:
+    """Get the azimuth offset between true north and the rotors zero position for a control type."""
+    if control_type == 2:
+        return round(max_az/2)
+    return 0
+
+def frame_azimuth(azimuth: float, offset: int) -> float:
+    """Convert a true azimuth to the rotor frame with the given frame offset (see frame_offset), wrapped to 0-360°."""
+    return (azimuth + offset) % 360
+
+def flip_over_supported(min_el: int, max_el: int) -> bool:
+    """Check if a rotor's elevation range is large enough to track passes flipped over the zenith."""
+    return max_el >= 180 - min_el - FLIP_OVER_TOLERANCE
+
+def _rotor_azimuth_candidates(azimuth: float, offset: int, flip: bool, min_az: int, max_az: int) -> List[Tuple[float, float]]:
+    """
+    Get all rotor azimuths that point to a true azimuth, together with the pointing error caused by clamping.
+    If no winding is inside the rotor range, both range limits are returned.
+    """
+    base = frame_azimuth(azimuth + (180 if flip else 0), offset)
+
+    candidates = []
+    winding = base - 360*((base - min_az) // 360) # Lowest winding at or above min_az
+    while winding <= max_az:
+        candidates.append((winding, 0.0))
+        winding += 360
+    if candidates:
+        return candidates
+
+    # No winding in range, fall back to the range limits
+    error_min = min((base - min_az) % 360, (min_az - base) % 360)
+    error_max = min((base - max_az) % 360, (max_az - base) % 360)
+    return [(min_az, error_min), (max_az, error_max)]
+
+def _rotor_elevation(elevation: float, flip: bool, min_el: int, max_el: int) -> Tuple[float, float]:
+    """Get the rotor elevation for a true elevation and the pointing error caused by clamping."""
+    if flip:
+        elevation = 180 - elevation
+    clamped = min(max(elevation, min_el), max_el)
+    return (clamped, abs(clamped-elevation))
+
+class Rotor_Plan():
+    def __init__(self, control_type: int, flip: bool, offset: int, times: List[float], azimuths: List[float], elevations: List[float], unwinds: int, total_slew_time: float) -> None:
+        """
+        A planned rotor path for a whole pass. Times are unix timestamps, azimuths and elevations are in rotor coordinates.
+        """
+        self.control_type = control_type
+        self.flip = flip
+        self.offset = offset
+        self.times = times
+        self.azimuths = azimuths
+        self.elevations = elevations
+        self.unwinds = unwinds
+        self.total_slew_time = total_slew_time
+
+    def _planned_index(self, timestamp: float | None) -> int:
+        """Get the index of the plan sample closest to a timestamp. The first sample is used if no timestamp is given."""
+        if timestamp is None:
+            return 0
+
+        index = bisect.bisect_left(self.times, timestamp)
+        if index >= len(self.times):
+            return len(self.times)-1
+        if index > 0 and (timestamp - self.times[index-1]) < (self.times[index] - timestamp):
+            return index-1
+        return index
+
+    def to_rotor(self, azimuth: float, elevation: float, min_az: int, max_az: int, min_el: int, max_el: int, timestamp: float | None = None) -> Tuple[int, int]:
+        """
+        Convert a true azimuth and elevation to the rotor position that follows this plan.
+        The winding closest to the planned rotor azimuth at the given timestamp is chosen.
+        """
+        planned_azimuth = self.azimuths[self._planned_index(timestamp)]
+
+        candidates = _rotor_azimuth_candidates(azimuth, self.offset, self.flip, min_az, max_az)
+        rotor_azimuth, _ = min(candidates, key=lambda c: abs(c[0]-planned_azimuth))
+        rotor_elevation, _ = _rotor_elevation(elevation, self.flip, min_el, max_el)
+
+        return (round(rotor_azimuth), round(rotor_elevation))
+
+    def describe(self) -> str:
+        """Get a short human readable description of the plan."""
+        mode = f"control mode {self.control_type}"
+        if self.flip:
+            mode += " with flip-over"
+        unwinds = "no unwinds" if self.unwinds == 0 else f"{self.unwinds} unwind(s)"
+        return f"{mode}, start at AZ {round(self.azimuths[0])}° EL {round(self.elevations[0])}°, " \
+               f"{unwinds}, {round(self.total_slew_time)}s total slew"
+
+def _plan_option(samples: List[Tuple[float, float, float]], offset: int, flip: bool, min_az: int, max_az: int, min_el: int, max_el: int,
+                 start_position: Tuple[float, float] | None, az_speed: float, el_speed: float) -> Tuple[int, float, List[float], List[float]]:
+    """
+    Find the cheapest rotor path through all pass samples for one frame offset and flip setting.
+    Uses dynamic programming over all azimuth windings of every sample.
+    Returns the number of unwinds, the total cost and the planned rotor azimuths and elevations.
+    """
+
+    elevations = []
+    layers = []
+    for _, azimuth, elevation in samples:
+        rotor_elevation, elevation_error = _rotor_elevation(elevation, flip, min_el, max_el)
+        elevations.append(rotor_elevation)
+        layers.append([(candidate, error + elevation_error) for candidate, error in _rotor_azimuth_candidates(azimuth, offset, flip, min_az, max_az)])
+
+    # Costs are compared as (unwinds, seconds) tuples so that avoiding unwinds always comes first
+    costs = []
+    for candidate, error in layers[0]:
+        cost = error * OUT_OF_RANGE_PENALTY
+        if start_position is not None:
+            cost += slew_time(start_position[0], start_position[1], candidate, elevations[0], az_speed, el_speed)
+        costs.append((0, cost))
+    back_pointers = []
+
+    for i in range(1, len(layers)):
+        new_costs = []
+        pointers = []
+        for candidate, error in layers[i]:
+            best = None
+            best_index = 0
+            for j, (previous, _) in enumerate(layers[i-1]):
+                unwinds, cost = costs[j]
+                if abs(candidate-previous) > UNWIND_THRESHOLD:
+                    unwinds += 1
+                cost += slew_time(previous, elevations[i-1], candidate, elevations[i], az_speed, el_speed) + error * OUT_OF_RANGE_PENALTY
+                if best is None or (unwinds, cost) < best:
+                    best = (unwinds, cost)
+                    best_index = j
+            new_costs.append(best)
+            pointers.append(best_index)
+        costs = new_costs
+        back_pointers.append(pointers)
+
+    # Walk back through the cheapest path
+    index = min(range(len(costs)), key=lambda k: costs[k])
+    unwinds, total_cost = costs[index]
+    azimuths = [layers[-1][index][0]]
+    for i in range(len(back_pointers)-1, -1, -1):
+        index = back_pointers[i][index]
+        azimuths.append(layers[i][index][0])
+    azimuths.reverse()
+
+    return (unwinds, total_cost, azimuths, elevations)
+
+def plan_pass(samples: List[Tuple[float, float, float]], control_types: List[int], min_az: int, max_az: int, min_el: int, max_el: int,
+              start_position: Tuple[float, float] | None = None, az_speed: float = DEFAULT_AZ_SPEED, el_speed: float = DEFAULT_EL_SPEED) -> Rotor_Plan | None:
+    """
+    Plan the rotor path for a whole pass before AOS.
+    Samples must be a list of (unix timestamp, azimuth, elevation) tuples covering the pass.
+    All provided control types, the overlap range (max_az > 360) and flip-over (if max_el is large enough) are considered.
+    The plan with the least unwinds, and then the least total slew time, is returned. Returns None if there are no samples.
+    """
+
+    if not samples:
+        return None
+
+    flip_options = [False, True] if flip_over_supported(min_el, max_el) else [False]
+
+    best_plan = None
+    best_cost = None
+    for control_type in control_types:
+        offset = frame_offset(control_type, max_az)
+        for flip in flip_options:
+            unwinds, cost, azimuths, elevations = _plan_option(samples, offset, flip, min_az, max_az, min_el, max_el, start_position, az_speed, el_speed)
+            logging.log(logging.DEBUG, f"Rotor plan option: control type {control_type}, flip {flip}: {unwinds} unwind(s), cost {round(cost, 1)}")
+
+            if best_cost is None or (unwinds, cost) < best_cost:
+                best_cost = (unwinds, cost)
+                total_slew_time = sum(slew_time(azimuths[i-1], elevations[i-1], azimuths[i], elevations[i], az_speed, el_speed) for i in range(1, len(azimuths)))
+                best_plan = Rotor_Plan(control_type, flip, offset, [s[0] for s in samples], azimuths, elevations, unwinds, total_slew_time)
+
+    return best_plan
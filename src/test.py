@@ -1,5 +1,15 @@
-from src import radio_controller, rotor_controller
-import logging, time
+from src import radio_controller, rotor_controller, rotor_backends, emulators, hamlib_daemon, hamlib_bindings
+from typing import List, Tuple
+import logging, time, datetime
+import numpy as np
+
+CHARACTERIZE_POLL_INTERVAL = 0.05 # Seconds between position reads while characterizing a rotor
+CHARACTERIZE_SETTLE_TIME = 1.5 # Seconds the position must stay unchanged for a move to count as finished
+CHARACTERIZE_MOVE_TIMEOUT = 180 # Maximum seconds a single characterization move may take
+CHARACTERIZE_AZ_SPAN = 90 # Azimuth span in degrees used to measure slew rate
+CHARACTERIZE_EL_SPAN = 40 # Elevation span in degrees used to measure slew rate
+CHARACTERIZE_BACKLASH_APPROACH = 10 # Degrees from which the backlash test point is approached from both sides
+BENCHMARK_FREQUENCY = 145800000 # Base frequency in herz set on the dummy rig while benchmarking
 
 def rotor_home(rotor_config_name: str, usb_overwrite: str | None = None, rotor_mode_overwrite: int | None = None):
     """A testing function to home a rotor to north"""
@@ -77,6 +87,156 @@ def rotor_test_full(rotor_config_name: str, usb_overwrite: str | None = None, ro
 
     rotor.close()
 
+def _record_move(rotor: rotor_controller.Rotor_Controller, azimuth: int, elevation: int) -> List[Tuple[float, float, float]]:
+    """
+    Command a raw rotor position (without control mode) and record (seconds since command, azimuth, elevation) readings until the rotor stops.
+    """
+
+    start = time.monotonic()
+    rotor.rotate_to(azimuth, elevation, force=True)
+
+    readings = []
+    last_position = None
+    last_change = start
+    moved = False
+    while time.monotonic() - start < CHARACTERIZE_MOVE_TIMEOUT:
+        position = rotor.read_position()
+        now = time.monotonic()
+        readings.append((now - start, position[0], position[1]))
+
+        if last_position is None or position != last_position:
+            moved = moved or (last_position is not None)
+            last_position = position
+            last_change = now
+        elif now - last_change >= CHARACTERIZE_SETTLE_TIME:
+            at_target = abs(position[0]-azimuth) <= 2 and abs(position[1]-elevation) <= 2
+            if moved or at_target:
+                return readings
+
+        time.sleep(CHARACTERIZE_POLL_INTERVAL)
+
+    logging.log(logging.WARN, f"Rotor didn't settle within {CHARACTERIZE_MOVE_TIMEOUT}s while moving to AZ {azimuth} EL {elevation}.")
+    return readings
+
+def _analyze_move(readings: List[Tuple[float, float, float]], axis: int) -> Tuple[float | None, float | None, float | None]:
+    """
+    Analyze the readings of a move along one axis (1 for azimuth, 2 for elevation).
+    Returns the command-to-motion latency in seconds, the steady slew rate in degrees per second and the acceleration in degrees per second².
+    Values that couldn't be measured are None.
+    """
+
+    times = np.array([r[0] for r in readings])
+    values = np.array([r[axis] for r in readings])
+    travel = values - values[0]
+    total_travel = travel[-1]
+
+    moving = np.nonzero(np.abs(travel) > 0)[0]
+    if len(moving) == 0 or total_travel == 0:
+        return (None, None, None)
+    latency = float(times[moving[0]-1]) if moving[0] > 0 else 0.0
+
+    # Fit steady speed over the middle of the move to exclude acceleration and deceleration
+    progress = travel / total_travel
+    middle = (progress >= 0.2) & (progress <= 0.8)
+    if np.count_nonzero(middle) < 2:
+        return (latency, None, None)
+    speed = abs(float(np.polyfit(times[middle], values[middle], 1)[0]))
+
+    # Acceleration from the time it took to reach 90% of the steady speed
+    acceleration = None
+    step_speeds = np.abs(np.diff(values)) / np.maximum(np.diff(times), 1e-6)
+    fast = np.nonzero(step_speeds >= 0.9*speed)[0]
+    if len(fast) > 0:
+        ramp_time = float(times[fast[0]+1]) - latency
+        if ramp_time > 0:
+            acceleration = speed / ramp_time
+
+    return (latency, speed, acceleration)
+
+def _resolution(readings: List[Tuple[float, float, float]], axis: int) -> float | None:
+    """Get the smallest non-zero change between two consecutive position readings along an axis."""
+    steps = [abs(readings[i][axis]-readings[i-1][axis]) for i in range(1, len(readings))]
+    steps = [step for step in steps if step > 0]
+    return min(steps) if steps else None
+
+def _measure_backlash(rotor: rotor_controller.Rotor_Controller, azimuth: int, elevation: int, axis: int) -> float:
+    """Approach a point from both sides along one axis and return the difference between the settled positions."""
+    settled = []
+    for direction in (-1, 1):
+        approach = CHARACTERIZE_BACKLASH_APPROACH * direction
+        if axis == 1:
+            _record_move(rotor, azimuth+approach, elevation)
+        else:
+            _record_move(rotor, azimuth, elevation+approach)
+        settled.append(_record_move(rotor, azimuth, elevation)[-1][axis])
+
+    return abs(settled[0]-settled[1])
+
+def rotor_characterize(rotor_config_name: str, usb_overwrite: str | None = None, rotor_mode_overwrite: int | None = None):
+    """
+    A test function that runs a scripted motion profile to measure slew rate, acceleration, command latency,
+    readback resolution and backlash of a rotor. The results are stored as the rotors profile next to its config.
+    """
+
+    logging.log(logging.INFO, "Initializing rotor")
+    rotor = rotor_controller.Rotor_Controller(rotor_config_name, usb_overwrite, rotor_mode_overwrite)
+
+    start_azimuth, start_elevation = rotor.read_position()
+
+    # Pick test points inside the rotor range (raw rotor coordinates)
+    az_center = (rotor.min_az + rotor.max_az) / 2
+    az_low = round(max(rotor.min_az + CHARACTERIZE_BACKLASH_APPROACH, az_center - CHARACTERIZE_AZ_SPAN/2))
+    az_high = round(min(rotor.max_az - CHARACTERIZE_BACKLASH_APPROACH, az_center + CHARACTERIZE_AZ_SPAN/2))
+    el_low = rotor.min_el + CHARACTERIZE_BACKLASH_APPROACH
+    el_high = min(rotor.max_el - CHARACTERIZE_BACKLASH_APPROACH, el_low + CHARACTERIZE_EL_SPAN)
+
+    logging.log(logging.INFO, f"Moving to start point AZ {az_low} EL {el_low}")
+    _record_move(rotor, az_low, el_low)
+
+    logging.log(logging.INFO, f"Measuring azimuth dynamics (AZ {az_low} -> {az_high})")
+    az_readings = _record_move(rotor, az_high, el_low)
+    az_latency, az_speed, az_acceleration = _analyze_move(az_readings, 1)
+
+    logging.log(logging.INFO, f"Measuring elevation dynamics (EL {el_low} -> {el_high})")
+    el_readings = _record_move(rotor, az_high, el_high)
+    el_latency, el_speed, el_acceleration = _analyze_move(el_readings, 2)
+
+    logging.log(logging.INFO, "Measuring backlash")
+    backlash_azimuth = round(az_center)
+    backlash_elevation = round((el_low + el_high) / 2)
+    az_backlash = _measure_backlash(rotor, backlash_azimuth, backlash_elevation, 1)
+    el_backlash = _measure_backlash(rotor, backlash_azimuth, backlash_elevation, 2)
+
+    logging.log(logging.INFO, "Returning to start position")
+    _record_move(rotor, round(start_azimuth), round(start_elevation))
+    rotor.close()
+
+    # Build and save profile
+    latencies = [latency for latency in (az_latency, el_latency) if latency is not None]
+    measurements = {
+        "az_speed": az_speed,
+        "el_speed": el_speed,
+        "az_acceleration": az_acceleration,
+        "el_acceleration": el_acceleration,
+        "command_latency": (sum(latencies) / len(latencies)) if latencies else None,
+        "az_resolution": _resolution(az_readings, 1),
+        "el_resolution": _resolution(el_readings, 2),
+        "az_backlash": az_backlash,
+        "el_backlash": el_backlash
+    }
+
+    profile = {}
+    for key, value in measurements.items():
+        if value is None:
+            logging.log(logging.WARN, f"Couldn't measure {key}. It won't be stored in the profile.")
+            continue
+        profile[key] = round(value, 3)
+        logging.log(logging.INFO, f"{key}: {profile[key]}")
+    profile["measured_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat() # type: ignore
+
+    rotor_controller.save_rotor_profile(rotor_config_name, profile)
+    logging.log(logging.INFO, f"Saved rotor profile for '{rotor_config_name}'")
+
 def test_radio(radio_config_name: str, downlink_frequency: int | None, uplink_frequency: int | None, rx_usb_overwrite: str | None, tx_usb_overwrite: str | None, trx_usb_overwrite: str | None):
     """A test function to set a radio to a certain frequency (specified in herz)"""
 
@@ -94,3 +254,110 @@ def test_radio(radio_config_name: str, downlink_frequency: int | None, uplink_fr
             time.sleep(1)
     except Exception:
         radio.close()
+
+def emulate_rotor(protocol: str):
+    """Emulate a rotor controller speaking a native protocol on a pseudo-terminal, to test native rotor backends without hardware"""
+
+    master, slave_path = emulators.open_pty()
+    logging.log(logging.INFO, f"Emulating {protocol} rotor controller on {slave_path}")
+    logging.log(logging.INFO, f"Use it by setting the rotor config backend to '{protocol}' and overwriting the USB port with `-o {slave_path}`. Press Ctrl+C to stop.")
+
+    try:
+        emulators.Rotor_Emulator(protocol).run(master)
+    except KeyboardInterrupt:
+        logging.log(logging.INFO, "Stopping emulator")
+
+def emulate_rig(protocol: str):
+    """Emulate a radio speaking a native CAT protocol on a pseudo-terminal, to test native CAT backends without hardware"""
+
+    master, slave_path = emulators.open_pty()
+    logging.log(logging.INFO, f"Emulating {protocol} radio on {slave_path}")
+    logging.log(logging.INFO, f"Use it by setting the radio config backend to '{protocol}' and overwriting the USB port with `-r/-t/-x {slave_path}`. Press Ctrl+C to stop.")
+
+    try:
+        emulators.Rig_Emulator(protocol).run(master)
+    except KeyboardInterrupt:
+        logging.log(logging.INFO, "Stopping emulator")
+
+def emulate_hamlib(kind: str, latency: float, port: int):
+    """Serve a rotctld or rigctld stand-in that injects latency, to test remote endpoints and latency compensation without hardware"""
+
+    stand_in = emulators.Hamlib_Stand_In(kind, latency, port=port)
+    stand_in.start()
+    logging.log(logging.INFO, f"Serving {kind} stand-in on localhost:{stand_in.port} with {round(latency*1000)}ms of latency")
+    logging.log(logging.INFO, f"Use it by setting the {'rotctld_address' if kind == 'rotctld' else 'rigctld_address'} config key to 'localhost:{stand_in.port}'. Press Ctrl+C to stop.")
+
+    try:
+        while stand_in.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logging.log(logging.INFO, "Stopping stand-in")
+    stand_in.stop()
+
+def _benchmark(name: str, exchange, iterations: int):
+    """Call exchange(i) iterations times and log the average and maximum duration in milliseconds."""
+    durations = []
+    try:
+        for i in range(iterations):
+            start_time = time.monotonic()
+            exchange(i)
+            durations.append(time.monotonic() - start_time)
+    except (OSError, ValueError) as e:
+        logging.log(logging.ERROR, f"{name} failed: {e}")
+        return
+
+    average, maximum = sum(durations)/len(durations)*1000, max(durations)*1000
+    logging.log(logging.INFO, f"{name}: {average:.3f}ms average, {maximum:.3f}ms maximum over {iterations} exchanges")
+
+def _start_dummy_daemon(args: List[str], name: str) -> hamlib_daemon.Hamlib_Daemon | None:
+    daemon = hamlib_daemon.Hamlib_Daemon(args, name)
+    try:
+        daemon.start()
+        daemon.wait_until_ready()
+    except (OSError, hamlib_daemon.Daemon_Error) as e:
+        logging.log(logging.ERROR, f"Failed to start {name}, skipping it: {e}")
+        daemon.terminate()
+        return None
+    return daemon
+
+def benchmark_hamlib(iterations: int):
+    """
+    Compare the per-exchange latency of going through rigctld/rotctld against calling hamlibs python bindings in-process,
+    using hamlibs dummy rig and rotator so no hardware is needed. Each radio exchange sets and reads a frequency, each rotor
+    exchange sets and reads a position, like one tracking update.
+    """
+
+    def radio_exchange(client):
+        return lambda i: client.pipeline([f"F {BENCHMARK_FREQUENCY + i}", "f"])
+
+    def rotor_exchange(backend):
+        return lambda i: backend.exchange((i % 360, i % 90), True)
+
+    logging.log(logging.INFO, f"Benchmarking hamlib backends with {iterations} exchanges each")
+    bindings = hamlib_bindings.bindings_available()
+    if not bindings:
+        logging.log(logging.WARN, "Hamlibs python bindings aren't installed, skipping the in-process backends.")
+
+    daemon = _start_dummy_daemon(["rigctld", "-m", str(hamlib_bindings.HAMLIB_DUMMY_RIG_MODEL)], "rigctld (dummy rig)")
+    if daemon:
+        client = daemon.clients[0]
+        _benchmark("rigctld", radio_exchange(client), iterations)
+        client.close()
+        daemon.terminate()
+
+    if bindings:
+        rig = hamlib_bindings.Rig_Binding_Client(hamlib_bindings.HAMLIB_DUMMY_RIG_MODEL, "", 0, "dummy rig")
+        _benchmark("Hamlib bindings (rig)", radio_exchange(rig), iterations)
+        rig.close()
+
+    daemon = _start_dummy_daemon(["rotctld", "-m", str(hamlib_bindings.HAMLIB_DUMMY_ROTOR_MODEL)], "rotctld (dummy rotator)")
+    if daemon:
+        backend = rotor_backends.Rotctld_Backend(daemon.clients[0])
+        _benchmark("rotctld", rotor_exchange(backend), iterations)
+        backend.close()
+        daemon.terminate()
+
+    if bindings:
+        rotor = rotor_backends.Hamlib_Rotor_Backend(hamlib_bindings.HAMLIB_DUMMY_ROTOR_MODEL, "", (0, 360, 0, 90))
+        _benchmark("Hamlib bindings (rotor)", rotor_exchange(rotor), iterations)
+        rotor.close()
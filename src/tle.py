@@ -1,7 +1,7 @@
 from src import paths, settings
 from skyfield.api import EarthSatellite
 from skyfield.timelib import Timescale
-from typing import List, Tuple
+from typing import List, Set, Tuple
 import logging, json, requests, os, datetime
 
 TLE_OUTDATED_SECONDS = int(settings.get_setting("tles_outdated_seconds")) # Hours until TLEs will be considered out of date in seconds
@@ -270,6 +270,13 @@ def load_tle_data() -> List[Tuple[str, str, str]]:
     
     return data
 
+def get_NORAD_IDs() -> Set[str]:
+    """
+    Get the NORAD IDs of all satellites in the local TLE catalogue without loading their TLEs.
+    """
+
+    return set(file[:-5] for file in os.listdir(paths.TLE_DIRECTORY_PATH) if file.endswith(".json"))
+
 def load_tle(NORAD_ID: str, timescale: Timescale) -> EarthSatellite | None:
     """
     Load a satellite TLE by it's NORAD ID. Will return None if TLE can't be found in local files.
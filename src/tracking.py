@@ -1,14 +1,20 @@
-from src import radio_controller, rotor_controller, tle, paths, settings, transponders
+from src import radio_controller, rotor_controller, hamlib_daemon, tle, paths, settings, transponders
 from skyfield.api import load, wgs84
-from typing import List
-import logging, os, datetime, time, traceback
+from typing import List, Tuple
+import logging, os, datetime, time, traceback, concurrent.futures
+import numpy as np
 
 TRACKING_UPDATE_INTERVAL = float(settings.get_setting("tracking_update_interval")) # Tracking update interval in seconds
+PASS_SAMPLE_INTERVAL = 5 # Interval in seconds between pass samples used for rotor path planning
+PREPOSITION_MARGIN = 5 # Seconds that the rotor should be in position before AOS
+DEVICE_DEADLINE_FRACTION = 0.5 # Fraction of the tracking update interval a single device exchange may take
+RANGE_RATE_TREND_STEP = 1 # Seconds between the two range rates the range rate trend is calculated from
+RADIO_MIN_UPDATE_INTERVAL = 0.1 # Minimum seconds between radio updates, however fast their frequencies change
 
 def list_rotors() -> List[str]:
     """Return a list of all rotor config file names (excluding file extension)"""
     files = os.listdir(paths.ROTOR_CONFIG_DIRECTORY_PATH)
-    files_no_extension = [file[:-5] for file in files]
+    files_no_extension = [file[:-5] for file in files if not file.endswith(paths.ROTOR_PROFILE_SUFFIX)]
 
     return files_no_extension
 
@@ -19,18 +25,61 @@ def list_radios() -> List[str]:
 
     return files_no_extension
 
+def _sample_pass(satellite, station_location, timescale, start: datetime.datetime, end: datetime.datetime) -> List[Tuple[float, float, float]]:
+    """
+    Calculate satellite positions between two times in PASS_SAMPLE_INTERVAL steps.
+    Returns a list of (unix timestamp, azimuth, elevation) tuples.
+    """
+
+    offsets = np.arange(0, (end - start).total_seconds(), PASS_SAMPLE_INTERVAL)
+    offsets = np.append(offsets, (end - start).total_seconds())
+    times = timescale.utc(start.year, start.month, start.day, start.hour, start.minute, start.second + start.microsecond/1e6 + offsets)
+
+    elevations, azimuths, _ = (satellite - station_location).at(times).altaz()
+    start_timestamp = start.timestamp()
+
+    return [(start_timestamp + float(offset), float(az), float(el)) for offset, az, el in zip(offsets, azimuths.degrees, elevations.degrees)]
+
+def _rotate_all_blocking(rotors: List[rotor_controller.Rotor_Controller], azimuth: int, elevation: int):
+    """Rotate several rotors to the same position at the same time and block until all of them have arrived."""
+    if len(rotors) == 1:
+        rotors[0].rotate_to_blocking(azimuth, elevation)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(len(rotors)) as executor:
+        futures = [executor.submit(rotor.rotate_to_blocking, azimuth, elevation) for rotor in rotors]
+        for future in futures:
+            future.result() # Raises exceptions like a stall of any of the rotors
+
+def _seconds_until_wakeup(next_tick: float, radio: radio_controller.Radio_Controller | None) -> float:
+    """Get the seconds until the tracking loop has to run again: the next tick, or earlier if the radios need an update before it."""
+    wakeup = next_tick
+    if radio:
+        wakeup = min(wakeup, max(radio.next_update_time(), time.monotonic() + RADIO_MIN_UPDATE_INTERVAL))
+    return max(wakeup - time.monotonic(), 0)
+
 def track(NORAD_ID: str, 
-          rotor_config_name: str | None = None,
+          rotor_config_names: List[str] | None = None,
           radio_config_name: str | None = None,
           rotor_usb_overwrite: str | None = None,
           rx_usb_overwrite: str | None = None,
           tx_usb_overwrite: str | None = None,
           trx_usb_overwrite: str | None = None,
           lock_up_down: bool = True,
-          rotor_control_mode_overwrite: int | None = None):
-    if rotor_config_name is None and radio_config_name is None:
+          rotor_control_mode_overwrite: int | None = None,
+          intercept: bool = False,
+          transponder_selectors: List[str] | None = None,
+          choose_transponder: bool = False):
+    if not rotor_config_names and radio_config_name is None:
         logging.log(logging.ERROR, "Must provide either a radio config, rotor config or both. Not none.")
         exit()
+    rotor_config_names = rotor_config_names if rotor_config_names else []
+    if len(rotor_config_names) != len(set(rotor_config_names)):
+        logging.log(logging.ERROR, "The same rotor config can't be tracked more than once.")
+        exit()
+    if rotor_usb_overwrite and len(rotor_config_names) > 1:
+        logging.log(logging.ERROR, "The rotor USB port can only be overwritten when tracking a single rotor.")
+        exit()
 
     # Initialize timescale
     timescale = load.timescale()
@@ -52,25 +101,16 @@ def track(NORAD_ID: str,
         else:
             logging.log(logging.INFO, "Successfully loaded TLE for satellite '"+satellite.name+"'")
 
-    # If radio is defined, prompt user to select transponder
+    # If radio is defined, prompt user to select transponders. Radios follow the first one unless configured otherwise
     downlink_start = None
     uplink_start = None
     inverting = False
+    extra_transponders = []
     if radio_config_name:
-        logging.log(logging.INFO, "Please select which transponder the radio(s) should track (or 'help' for help menu):")
-        transponder_UUID = transponders.user_transponder_selection(NORAD_ID)
-        transponder_frequencies = transponders.get_transponder_frequencies(NORAD_ID, transponder_UUID)
-        downlink_lower, downlink_upper, uplink_lower, uplink_upper, inverting = transponder_frequencies
-
-        # Set starting frequency to middle of upper and lower downlink frequency if an upper frequency is given
-        downlink_start = downlink_lower
-        if downlink_upper:
-            downlink_start = (downlink_lower + downlink_upper) // 2
-
-        # The same for uplink
-        uplink_start = uplink_lower
-        if uplink_upper:
-            uplink_start = (uplink_lower + uplink_upper) // 2
+        selected_transponders = transponders.select_transponders(NORAD_ID, transponder_selectors, choose_transponder)
+        downlink_start, uplink_start, inverting = transponders.get_transponder_start_frequencies(selected_transponders[0])
+        for trsp in selected_transponders[1:]:
+            extra_transponders.append(radio_controller.Tracked_Transponder(*transponders.get_transponder_start_frequencies(trsp)))
 
     utc_now = datetime.datetime.now(datetime.timezone.utc)
     
@@ -86,19 +126,27 @@ def track(NORAD_ID: str,
         initial_azimuth = azimuth
         initial_elevation = round(elevation)
         earliest_rise_time = datetime.datetime.now(datetime.timezone.utc)
+    
+    # Calculate time of next pass and its end
+    stop = utc_now + datetime.timedelta(hours=12)
+    times, events = satellite.find_events(station_location, timescale.from_datetime(utc_now), timescale.from_datetime(stop))
+    events = list(events)
+    pass_end_time = None
+
+    if pass_already_started:
+        if 2 in events:
+            pass_end_time = times[events.index(2)].utc_datetime()
     else:
-        # Calculate time of next pass
-
-        stop = utc_now + datetime.timedelta(hours=12)
-        times, events = satellite.find_events(station_location, timescale.from_datetime(utc_now), timescale.from_datetime(stop))
-
         try:
-            earliest_rise_index = list(events).index(0)
+            earliest_rise_index = events.index(0)
             earliest_rise_time = times[earliest_rise_index]
         except ValueError:
             logging.log(logging.ERROR, "No pass of satellite found within the next 12 hours.")
             exit()
 
+        if 2 in events[earliest_rise_index:]:
+            pass_end_time = times[events.index(2, earliest_rise_index)].utc_datetime()
+
         # Calculate beginnning azimuth of pass
         pos = (satellite - station_location).at(earliest_rise_time)
         _, initial_azimuth, _ = pos.altaz()
@@ -108,27 +156,94 @@ def track(NORAD_ID: str,
         logging.log(logging.INFO, f"Found next pass at {earliest_rise_time.strftime('%H:%M:%S')} UTC with an initial azimuth of {round(initial_azimuth.degrees)}°") # type: ignore
     initial_azimuth = round(initial_azimuth.degrees) # type: ignore
 
-    # Initialize rotor
-    rotor = None
-    if rotor_config_name:
-        rotor = rotor_controller.Rotor_Controller(rotor_config_name, rotor_usb_overwrite, rotor_control_mode_overwrite)
-    
+    # Supervisor that restarts crashed rotctld/rigctld instances during the pass
+    supervisor = hamlib_daemon.Hamlib_Supervisor()
+
+    # Initialize rotors
+    rotors: List[rotor_controller.Rotor_Controller] = []
+    samples = []
+    if rotor_config_names:
+        if pass_end_time is not None:
+            samples = _sample_pass(satellite, station_location, timescale, earliest_rise_time, pass_end_time) # type: ignore
+        else:
+            logging.log(logging.WARN, "Couldn't find the end of the pass. Not planning rotor paths.")
+
+    for rotor_config_name in rotor_config_names:
+        init_start = time.monotonic()
+        rotor = rotor_controller.Rotor_Controller(rotor_config_name, rotor_usb_overwrite, rotor_control_mode_overwrite, supervisor)
+        logging.log(logging.DEBUG, f"Rotor controller '{rotor.name}' initialized in {(time.monotonic()-init_start)*1000:.0f}ms")
+        rotors.append(rotor)
+
+        # Plan rotor path for the whole pass
+        if samples:
+            plan = rotor.plan_pass(samples)
+            if plan:
+                logging.log(logging.INFO, f"Rotor '{rotor.name}' plan: "+plan.describe())
+                if rotor.control_type == 0:
+                    logging.log(logging.INFO, f"Make sure rotor '{rotor.name}' is set up for control mode {plan.control_type}.")
+                if plan.unwinds > 0:
+                    logging.log(logging.WARN, f"Rotor '{rotor.name}' will have to unwind during this pass.")
+
     # Initialize radio
     radio = None
     if radio_config_name:
-        radio = radio_controller.Radio_Controller(radio_config_name, downlink_start, uplink_start, rx_usb_overwrite, tx_usb_overwrite, trx_usb_overwrite, inverting, lock_up_down)
+        init_start = time.monotonic()
+        radio = radio_controller.Radio_Controller(radio_config_name, downlink_start, uplink_start, rx_usb_overwrite, tx_usb_overwrite, trx_usb_overwrite, inverting, lock_up_down, supervisor, extra_transponders)
+        logging.log(logging.DEBUG, f"Radio controller initialized in {(time.monotonic()-init_start)*1000:.0f}ms")
 
     try: # From this point on, catch KeyboardInterrupt or other excpetions and make sure rot/rigctld are terminated and the sockets are closed.
+        supervisor.start()
+
+        # Size radio deadlines to the update interval so a hanging radio doesn't stall the others. Rotor I/O runs in its own thread
+        if radio:
+            radio.set_io_deadline(TRACKING_UPDATE_INTERVAL * DEVICE_DEADLINE_FRACTION)
         logging.log(logging.INFO, "Ready to start")
         if radio:
             # Set rig frequency to uncorrected frequency to test rig communication
             radio.update(0)
         
-        # Spin rotor to pass starting angle
-        if rotor:
-            logging.log(logging.INFO, "Rotating to starting azimuth")
-            rotor.rotate_to_blocking(initial_azimuth, initial_elevation)
-            logging.log(logging.INFO, "Rotor is at start azimuth")
+        # Spin rotors to pass starting angle
+        intercept_points = {}
+        if rotors:
+            aos_timestamp = earliest_rise_time.timestamp() # type: ignore
+            seconds_until_aos = aos_timestamp - time.time()
+            prepositioning = []
+            for rotor in rotors:
+                # Estimate if the start position can be reached before AOS
+                rotor.update_current_position()
+                slew_time = rotor.estimate_slew_time(initial_azimuth, initial_elevation, aos_timestamp)
+                logging.log(logging.INFO, f"Estimated slew time of rotor '{rotor.name}' to start position: {round(slew_time)}s")
+
+                intercept_point = None
+                if slew_time + PREPOSITION_MARGIN <= seconds_until_aos:
+                    latest_start = earliest_rise_time - datetime.timedelta(seconds=slew_time + PREPOSITION_MARGIN) # type: ignore
+                    logging.log(logging.DEBUG, f"Pre-positioning of rotor '{rotor.name}' has to start by {latest_start.strftime('%H:%M:%S')} UTC")
+                elif pass_already_started:
+                    logging.log(logging.INFO, f"Pass is already running, rotor '{rotor.name}' needs ~{round(slew_time)}s to reach the satellite.")
+                    if intercept:
+                        intercept_point = rotor.find_intercept(samples, time.time())
+                elif slew_time > 0:
+                    logging.log(logging.WARN, f"Rotor '{rotor.name}' can't reach the start position before AOS (needs ~{round(slew_time)}s, AOS in {round(max(seconds_until_aos, 0))}s).")
+                    if intercept:
+                        intercept_point = rotor.find_intercept(samples, time.time())
+
+                if intercept_point:
+                    intercept_time = datetime.datetime.fromtimestamp(intercept_point[0], datetime.timezone.utc)
+                    logging.log(logging.INFO, f"Rotor '{rotor.name}' intercepting pass at {intercept_time.strftime('%H:%M:%S')} UTC (AZ {round(intercept_point[1])}° EL {round(intercept_point[2])}°)")
+                    rotor.update(round(intercept_point[1]), round(intercept_point[2]), intercept_point[0])
+                    intercept_points[rotor] = intercept_point
+                else:
+                    prepositioning.append(rotor)
+
+            # Rotate all rotors at the same time
+            if prepositioning:
+                logging.log(logging.INFO, "Rotating to starting azimuth")
+                _rotate_all_blocking(prepositioning, initial_azimuth, initial_elevation)
+                logging.log(logging.INFO, "Rotors are at start azimuth" if len(prepositioning) > 1 else "Rotor is at start azimuth")
+
+            for rotor in rotors:
+                rotor.reset_statistics()
+                rotor.start_worker()
         
         # Wait for pass to start if pass hasn't begun yet
         if not pass_already_started:
@@ -154,18 +269,31 @@ def track(NORAD_ID: str,
             pos = (satellite - station_location).at(timescale.from_datetime(utc_now))
             _, _, _, _, _, range_rate = pos.frame_latlon_and_rates(station_location)
             radio.update(float(range_rate.km_per_s)) # type: ignore
+            radio.reset_statistics()
 
         peak_elevation = 0
         is_descending = 0
 
+        # Rotors and the status are updated every TRACKING_UPDATE_INTERVAL. Radios are updated when they need it:
+        # when their quantized frequency is expected to change or a read-back is due, which can be more or less often
+        next_tick = 0
         while True:
+            now = time.monotonic()
+            is_tick = now >= next_tick
+            if is_tick:
+                next_tick = now + TRACKING_UPDATE_INTERVAL
+            radio_due = (radio is not None) and (now >= radio.next_update_time())
+
             utc_now = datetime.datetime.now(datetime.timezone.utc)
-            pos = (satellite - station_location).at(timescale.from_datetime(utc_now))
 
-            # Calculate current satellite position
-            elevation, azimuth, _ = pos.altaz() # type: ignore
-            azimuth: int = round(azimuth.degrees) # type: ignore
-            elevation: float = elevation.degrees # type: ignore
+            # Calculate the current satellite position, a second position to get the range rate trend from
+            # and the positions the rotors lead to (including their link latency) in one go
+            offsets = [0.0, RANGE_RATE_TREND_STEP] + [rotor.target_offset for rotor in rotors]
+            times = timescale.utc(utc_now.year, utc_now.month, utc_now.day, utc_now.hour, utc_now.minute, utc_now.second + utc_now.microsecond/1e6 + np.array(offsets))
+            pos = (satellite - station_location).at(times)
+            elevations, azimuths, _ = pos.altaz() # type: ignore
+            azimuth: int = round(azimuths.degrees[0]) # type: ignore
+            elevation: float = float(elevations.degrees[0]) # type: ignore
 
             # Update peak elevation and check if satellite elevation is descending
             if elevation > peak_elevation:
@@ -178,33 +306,54 @@ def track(NORAD_ID: str,
             if is_descending:
                 if elevation < 0:
                     logging.log(logging.INFO, "Pass completed!")
-                    if rotor and rotor.home_on_end:
+                    supervisor.log_statistics()
+                    if radio:
+                        radio.log_statistics()
+                    for rotor in rotors:
+                        rotor.stop_worker()
+                        rotor.log_statistics()
+                        rotor.clear_plan()
+                    homing = [rotor for rotor in rotors if rotor.home_on_end]
+                    if homing:
                         time.sleep(5) # Wait a bit to make sure the signal is really gone
                         logging.log(logging.INFO, "Homing rotor..")
-                        rotor.rotate_to_blocking(0, 0)
+                        _rotate_all_blocking(homing, 0, 0)
                         logging.log(logging.INFO, "Done")
                     break
 
-            # Handle rotor
+            # Handle radios
+            if radio_due:
+                # Calculate range rate and its trend, the radios extrapolate it to when their commands arrive
+                _, _, _, _, _, range_rate = pos.frame_latlon_and_rates(station_location)
+                range_rate_trend = (range_rate.km_per_s[1] - range_rate.km_per_s[0]) / RANGE_RATE_TREND_STEP # type: ignore
+
+                # Update frequencies
+                radio.update_lock() # type: ignore
+                radio.update(float(range_rate.km_per_s[0]), float(range_rate_trend), utc_now.timestamp()) # type: ignore
+
+            # Wait for the next radio update if this isn't a full tick
+            if not is_tick:
+                time.sleep(_seconds_until_wakeup(next_tick, radio))
+                continue
+
+            # Handle rotors. This only hands the positions to the rotors I/O workers, so they all move at the same time
             rotor_status_msg = ""
-            if rotor:
-                # Update rotor position
-                rotor.update(azimuth, round(elevation)) # type: ignore
+            for rotor_index, rotor in enumerate(rotors):
+                # Update rotor position (hold the intercept point until the satellite gets there)
+                target_timestamp = utc_now.timestamp() + offsets[2+rotor_index]
+                intercept_point = intercept_points.get(rotor)
+                if intercept_point and target_timestamp < intercept_point[0]:
+                    rotor.update(round(intercept_point[1]), round(intercept_point[2]), intercept_point[0])
+                else:
+                    rotor.update(round(azimuths.degrees[2+rotor_index]), round(elevations.degrees[2+rotor_index]), target_timestamp) # type: ignore
 
+            if rotors:
                 # Generate rotor status message
                 rotor_status_msg = f"AZ: {azimuth}°  EL: {round(elevation, 1)}°"
 
-            # Handle radios
+            # Prepare radio status message
             radio_status_msg = ""
             if radio:
-                # Calculate range rate
-                _, _, _, _, _, range_rate = pos.frame_latlon_and_rates(station_location)
-            
-                # Update frequencies
-                radio.update_lock()
-                radio.update(range_rate.km_per_s) # type: ignore
-
-                # Prepare status message
                 downlink_message = ""
                 uplink_message = ""
 
@@ -226,8 +375,8 @@ def track(NORAD_ID: str,
             # Log current status to console
             logging.log(logging.INFO, radio_status_msg+rotor_status_msg)
 
-            # Wait delay
-            time.sleep(TRACKING_UPDATE_INTERVAL)
+            # Wait until the next tick or radio update
+            time.sleep(_seconds_until_wakeup(next_tick, radio))
     except BaseException as e:
         if isinstance(e, KeyboardInterrupt):
             logging.log(logging.INFO, "Caught keyboard interrupt, shutting down subprocesses")
@@ -238,7 +387,8 @@ def track(NORAD_ID: str,
                 logging.log(logging.DEBUG, traceback.format_exc())
     finally:
         # Close sockets and rxxctlds
-        if rotor:
+        supervisor.stop()
+        for rotor in rotors:
             rotor.close()
 
         if radio:
@@ -1,80 +1,266 @@
-from src import paths, util
-from typing import Tuple
-import os, requests, logging, json
+from src import paths, util, tle
+from contextlib import closing
+from typing import Dict, Iterable, Iterator, List, Tuple
+import os, requests, logging, json, codecs, hashlib, itertools, sqlite3, shutil, time, fnmatch
 
 SATNOGS_TRANSITTERS_API_URL = "https://db.satnogs.org/api/transmitters/"
+TRANSPONDER_DOWNLOAD_TIMEOUT = 30 # Seconds to wait for the API to respond or send more data
+TRANSPONDER_DOWNLOAD_CHUNK_SIZE = 65536 # Bytes parsed at a time while downloading
+TRANSPONDER_WRITE_BATCH_SIZE = 500 # Transmitters written to the staging table at a time while downloading
 
 TRANSPONDER_TYPES = {"Transponder": "T", "Transceiver": "R", "Transmitter": "B"}
 
-def download_transponders():
+TRANSPONDER_STORE_COLUMNS = ["uuid", "norad_id", "position", "type", "mode", "description", "downlink_low", "downlink_high",
+                             "uplink_low", "uplink_high", "invert", "alive", "downlink_band", "uplink_band"]
+TRANSPONDER_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS satellites (
+    norad_id TEXT PRIMARY KEY,
+    hash TEXT NOT NULL -- Content hash of the satellites transmitters, to only rewrite changed satellites
+);
+CREATE TABLE IF NOT EXISTS transponders (
+    uuid TEXT PRIMARY KEY,
+    norad_id TEXT NOT NULL,
+    position INTEGER NOT NULL, -- Order of the transponder in the SatNOGS data of its satellite
+    type TEXT,
+    mode TEXT COLLATE NOCASE,
+    description TEXT,
+    downlink_low INTEGER,
+    downlink_high INTEGER,
+    uplink_low INTEGER,
+    uplink_high INTEGER,
+    invert INTEGER NOT NULL,
+    alive INTEGER NOT NULL,
+    downlink_band TEXT, -- Band letters, see util.FREQUENCY_BAND_LETTERS
+    uplink_band TEXT
+);
+CREATE INDEX IF NOT EXISTS transponders_norad_id ON transponders (norad_id, position);
+CREATE INDEX IF NOT EXISTS transponders_bands ON transponders (uplink_band, downlink_band);
+CREATE INDEX IF NOT EXISTS transponders_mode ON transponders (mode);
+CREATE INDEX IF NOT EXISTS transponders_type ON transponders (type);
+"""
+
+def _iter_json_array(chunks: Iterable[bytes]) -> Iterator[Dict]:
     """
-    Download the newest version of the transmitters.json file.
+    Parse a JSON array from a stream of byte chunks and yield its elements as soon as they are complete, so the whole payload never has to be held in memory.
+    Raises `json.JSONDecodeError` if the data isn't a valid JSON array.
     """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    finished = False
 
-    # Try to download data
-    try:
-        request = requests.get(SATNOGS_TRANSITTERS_API_URL, params={"format": "json"})
-    except Exception as e:
-        logging.log(logging.ERROR, "Failed to download transponder data.")
-        logging.log(logging.ERROR, e)
-        exit()
+    for chunk in itertools.chain(chunks, [None]):
+        end_of_data = chunk is None
+        buffer += text_decoder.decode(b"" if end_of_data else chunk, final=end_of_data)
+        index = 0
+        while True:
+            while index < len(buffer) and (buffer[index].isspace() or (started and buffer[index] == ",")):
+                index += 1
+            if index == len(buffer) or finished:
+                break
+            if not started:
+                if buffer[index] != "[":
+                    raise json.JSONDecodeError("Expected a JSON array", buffer, index)
+                started = True
+                index += 1
+                continue
+            if buffer[index] == "]":
+                finished = True
+                index += 1
+                continue
 
-    # Check status code
-    if request.status_code != 200:
-        logging.log(logging.ERROR, f"Failed to download transponder data. API returned status code {request.status_code}.")
-        exit()
+            try:
+                element, index = decoder.raw_decode(buffer, index)
+            except json.JSONDecodeError:
+                if end_of_data:
+                    raise
+                break # Element isn't complete yet, wait for more data
+            yield element
+        buffer = buffer[index:]
 
-    # Try to parse JSON data
-    try:
-        json_data = json.loads(request.text)
-    except json.JSONDecodeError:
-        logging.log(logging.ERROR, "Failed to download transponder data. API returned invalid JSON.")
+    if not finished:
+        raise json.JSONDecodeError("Unterminated JSON array", buffer, len(buffer))
+
+def _content_hash(transmitters: Dict) -> str:
+    """Hash the transmitters of a satellite independently of the order of their keys."""
+    return hashlib.sha256(json.dumps(transmitters, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _open_store(create: bool = False) -> sqlite3.Connection:
+    """
+    Open the transponder store. Unless create is set, exits if it doesn't exist yet (transponders were never downloaded).
+    The store uses write-ahead logging, so a running tracking session keeps reading consistent data while it's updated.
+    """
+    if (not create) and (not os.path.exists(paths.TRANSPONDER_DATABASE_PATH)):
+        logging.log(logging.ERROR, "No transponder data found. Download it using `satgs update transponders`.")
         exit()
-    
-    # Sort transponders to a per NORAD ID dict
-    transponders = {}
-    for trsp in json_data:
-        try: # If satellite already exists in formatted transponder list, just add the current transponder to the dict indexed by its uuid
-            transponders[trsp["norad_cat_id"]][trsp["uuid"]] = trsp
-        except KeyError: # If it doesn't exist yet, create the satellites entry and set it to a dict containing the current transponder indexed by it's uuid
-            transponders[trsp["norad_cat_id"]] = {trsp["uuid"]: trsp}
-
-    # Save to dict elements to files
-    for NORAD_ID, trsp in transponders.items():
-        with open(os.path.join(paths.TRANSPONDERS_DIRECTORY_PATH, str(NORAD_ID)+".json"), "w") as f:
-            json.dump(trsp, f)
+
+    connection = sqlite3.connect(paths.TRANSPONDER_DATABASE_PATH)
+    connection.row_factory = sqlite3.Row
+    if create:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(TRANSPONDER_STORE_SCHEMA)
+    return connection
+
+def _transponder_row(NORAD_ID: str, position: int, trsp: Dict) -> Tuple:
+    """Get the values of a transponders row in the store, in the order of TRANSPONDER_STORE_COLUMNS."""
+    downlink_band = util.get_frequency_band_letter(trsp["downlink_low"]) if trsp.get("downlink_low") else None
+    uplink_band = util.get_frequency_band_letter(trsp["uplink_low"]) if trsp.get("uplink_low") else None
+    return (trsp["uuid"], NORAD_ID, position, trsp.get("type"), trsp.get("mode"), trsp.get("description"),
+            trsp.get("downlink_low"), trsp.get("downlink_high"), trsp.get("uplink_low"), trsp.get("uplink_high"),
+            bool(trsp.get("invert")), bool(trsp.get("alive")), downlink_band, uplink_band)
+
+def download_transponders(known_only: bool = False):
+    """
+    Download the newest transmitter data from SatNOGS and update the transponder store.
+    The data is parsed while it's downloaded and written to a staging table in batches, so the transmitters are never all held in memory.
+    Only satellites whose transmitters changed are written to the store (detected by their content hash).
+    The update is a single transaction, so a running tracking session never reads half-updated data.
+    If known_only is set, satellites that aren't in the local TLE catalogue are skipped.
+    """
+
+    with closing(_open_store(create=True)) as connection, connection:
+        # Stream and parse data into a temporary staging table (kept on disk), in batches of TRANSPONDER_WRITE_BATCH_SIZE transmitters
+        connection.execute("PRAGMA temp_store = FILE")
+        connection.execute("CREATE TEMP TABLE incoming (norad_id TEXT NOT NULL, uuid TEXT UNIQUE ON CONFLICT REPLACE, data TEXT NOT NULL)")
+        try:
+            with requests.get(SATNOGS_TRANSITTERS_API_URL, params={"format": "json"}, stream=True, timeout=TRANSPONDER_DOWNLOAD_TIMEOUT) as request:
+                # Check status code
+                if request.status_code != 200:
+                    logging.log(logging.ERROR, f"Failed to download transponder data. API returned status code {request.status_code}.")
+                    exit()
+
+                items = _iter_json_array(request.iter_content(TRANSPONDER_DOWNLOAD_CHUNK_SIZE))
+                while batch := [(str(trsp["norad_cat_id"]), trsp["uuid"], json.dumps(trsp)) for trsp in itertools.islice(items, TRANSPONDER_WRITE_BATCH_SIZE)]:
+                    connection.executemany("INSERT INTO incoming (norad_id, uuid, data) VALUES (?, ?, ?)", batch)
+        except (json.JSONDecodeError, KeyError, TypeError):
+            logging.log(logging.ERROR, "Failed to download transponder data. API returned invalid JSON.")
+            exit()
+        except Exception as e:
+            logging.log(logging.ERROR, "Failed to download transponder data.")
+            logging.log(logging.ERROR, e)
+            exit()
+
+        # Replace the transponders of satellites whose data changed and remove satellites that aren't in the data anymore, in a single transaction
+        # so readers see either the old or the new data. Satellites are read back from the staging table one at a time
+        old_hashes = dict(connection.execute("SELECT norad_id, hash FROM satellites").fetchall())
+        known_IDs = tle.get_NORAD_IDs() if known_only else None
+
+        satellites = set()
+        skipped = 0
+        written = 0
+        staged = connection.execute("SELECT norad_id, uuid, data FROM incoming ORDER BY norad_id, rowid")
+        for NORAD_ID, rows in itertools.groupby(staged, key=lambda row: row[0]):
+            if (known_IDs is not None) and (NORAD_ID not in known_IDs):
+                skipped += 1
+                continue
+            satellites.add(NORAD_ID)
+            trsp = {UUID: json.loads(data) for _, UUID, data in rows}
+            content_hash = _content_hash(trsp)
+            if old_hashes.get(NORAD_ID) == content_hash:
+                continue
+            connection.execute("DELETE FROM transponders WHERE norad_id = ?", (NORAD_ID,))
+            connection.executemany(f"INSERT INTO transponders ({', '.join(TRANSPONDER_STORE_COLUMNS)}) VALUES ({', '.join('?'*len(TRANSPONDER_STORE_COLUMNS))})",
+                                   [_transponder_row(NORAD_ID, position, transmitter) for position, transmitter in enumerate(trsp.values())])
+            connection.execute("INSERT OR REPLACE INTO satellites (norad_id, hash) VALUES (?, ?)", (NORAD_ID, content_hash))
+            written += 1
+        if known_only:
+            logging.log(logging.INFO, f"Skipping {skipped} satellites that aren't in the local TLE catalogue")
+
+        removed = [NORAD_ID for NORAD_ID in old_hashes if NORAD_ID not in satellites]
+        for NORAD_ID in removed:
+            connection.execute("DELETE FROM transponders WHERE norad_id = ?", (NORAD_ID,))
+            connection.execute("DELETE FROM satellites WHERE norad_id = ?", (NORAD_ID,))
+        connection.execute("DROP TABLE incoming")
+
+    # Remove transponder files of older versions
+    if os.path.exists(paths.LEGACY_TRANSPONDERS_DIRECTORY_PATH):
+        shutil.rmtree(paths.LEGACY_TRANSPONDERS_DIRECTORY_PATH)
+
+    logging.log(logging.INFO, f"Transponders of {written} satellites updated, {len(satellites)-written} unchanged, {len(removed)} removed")
+
+def query_transponders(NORAD_ID: str | None = None, UUID: str | None = None, downlink_band: str | None = None, uplink_band: str | None = None,
+                       mode: str | None = None, trsp_type: str | None = None, alive: bool | None = None, linear: bool = False) -> List[Dict]:
+    """
+    Get all transponders from the transponder store that match every given filter, ordered by satellite and their order in the SatNOGS data.
+    Bands are letters of `util.FREQUENCY_BAND_LETTERS`, the mode is matched case insensitively and the type is a key of TRANSPONDER_TYPES.
+    Linear only matches transponders that relay a range of frequencies. Each transponder is a dict with the keys in TRANSPONDER_STORE_COLUMNS.
+    """
+    filters = [("norad_id = ?", NORAD_ID), ("uuid = ?", UUID), ("downlink_band = ?", downlink_band), ("uplink_band = ?", uplink_band),
+               ("mode = ?", mode), ("type = ?", trsp_type), ("alive = ?", alive)]
+    conditions = [condition for condition, value in filters if value is not None]
+    parameters = [value for _, value in filters if value is not None]
+    if linear:
+        conditions.append("type = 'Transponder' AND downlink_high IS NOT NULL")
+
+    query = "SELECT * FROM transponders"+(" WHERE "+" AND ".join(conditions) if conditions else "")+" ORDER BY CAST(norad_id AS INTEGER), position"
+    with closing(_open_store()) as connection:
+        return [dict(row) for row in connection.execute(query, parameters)]
+
+def search_transponders(NORAD_ID: str | None, downlink_band: str | None, uplink_band: str | None, mode: str | None, trsp_type: str | None, alive: bool | None, linear: bool):
+    """
+    Log all transponders matching the filters of `query_transponders`, with their satellites NORAD ID.
+    """
+    start_time = time.monotonic()
+    results = query_transponders(NORAD_ID, None, downlink_band, uplink_band, mode, trsp_type, alive, linear)
+    duration = time.monotonic() - start_time
+
+    longest_NORAD_ID = max([len(trsp["norad_id"]) for trsp in results], default=0)
+    longest_mode = max([len(trsp["mode"] or "") for trsp in results], default=0)
+    for trsp in results:
+        info = TRANSPONDER_TYPES.get(trsp["type"], " ") + (trsp["downlink_band"] or " ") + (trsp["uplink_band"] or " ")
+        logging.log(logging.INFO, f"{trsp['norad_id']:>{longest_NORAD_ID}} {info} {(trsp['mode'] or ''):<{longest_mode}}  /  {trsp['description']}")
+    logging.log(logging.INFO, f"Found {len(results)} transponders in {duration*1000:.1f}ms")
 
 def get_transponder_frequencies(NORAD_ID: str, transponder_UUID: str) -> Tuple[int, int | None, int, int | None, bool]:
     """
     Get the uplink and downlink frequencies of a transponder by the satellite NORAD ID and the transponder UUID.
-    This function returns a tuple with four elements.
+    This function returns a tuple with five elements.
     
     The firt element is the lower downlink frequency.
     The second element is the upper downlink frequency. If the downlink is not a range of frequencies, the first value should be used and this one will be None.
-    The third and fourth elements are the same but for the uplink.
+    The third and fourth elements are the same but for the uplink. The last element is wether the transponder is inverting.
     """
 
-    # Try to open file and parse json
-    try:
-        with open(os.path.join(paths.TRANSPONDERS_DIRECTORY_PATH, NORAD_ID+".json"), "r") as f:
-            trsp = json.load(f)[transponder_UUID]
-    except FileNotFoundError:
-        logging.log(logging.ERROR, f"Error while loading transponder file for NORAD ID {NORAD_ID}. File does not exist.")
-        exit()
-    except json.JSONDecodeError:
-        logging.log(logging.ERROR, f"Error while loading transponder file for NORAD ID {NORAD_ID}. File contains invalid JSON.")
+    results = query_transponders(NORAD_ID=NORAD_ID, UUID=transponder_UUID)
+    if not results:
+        logging.log(logging.ERROR, f"Transponder {transponder_UUID} of NORAD ID {NORAD_ID} not found. Try updating transponders using `satgs update transponders`.")
         exit()
 
-    return (trsp["downlink_low"], trsp["downlink_high"], trsp["uplink_low"], trsp["uplink_high"], trsp["invert"])
+    trsp = results[0]
+    return (trsp["downlink_low"], trsp["downlink_high"], trsp["uplink_low"], trsp["uplink_high"], bool(trsp["invert"]))
 
-def user_transponder_selection(NORAD_ID: str) -> str:
+def get_transponder_start_frequencies(trsp: Dict) -> Tuple[int | None, int | None, bool]:
     """
-    Prompt the user to select a transponder out of all transponder available on the satellite. Returns the selected transponders UUID.
+    Get the frequencies to start tracking a transponder on, from its row as returned by `query_transponders`.
+    Returns the downlink and uplink frequency (the middle of the transponder if it's a range, None if it doesn't exist) and if the transponder is inverting.
     """
+    downlink_lower, downlink_upper = trsp["downlink_low"], trsp["downlink_high"]
+    uplink_lower, uplink_upper = trsp["uplink_low"], trsp["uplink_high"]
+    inverting = bool(trsp["invert"])
+
+    # Set starting frequency to middle of upper and lower downlink frequency if an upper frequency is given
+    downlink_start = downlink_lower
+    if downlink_upper:
+        downlink_start = (downlink_lower + downlink_upper) // 2
+
+    # The same for uplink
+    uplink_start = uplink_lower
+    if uplink_upper:
+        uplink_start = (uplink_lower + uplink_upper) // 2
 
-    # Load transponder data for satellite
-    with open(os.path.join(paths.TRANSPONDERS_DIRECTORY_PATH, NORAD_ID+".json"), "r") as f:
-        transponders = json.load(f)
+    return (downlink_start, uplink_start, inverting)
+
+def user_transponder_selection(NORAD_ID: str, transponder_rows: List[Dict]) -> List[str]:
+    """
+    Prompt the user to select one or more of the satellites transponders (as returned by `query_transponders`). Returns the selected transponders UUIDs in the order they were entered.
+    Several transponders are entered separated by commas, for example "2,1".
+    """
+
+    transponders = {trsp["uuid"]: trsp for trsp in transponder_rows}
+    if not transponders:
+        logging.log(logging.ERROR, f"No transponders found for NORAD ID {NORAD_ID}.")
+        exit()
 
     # Find longest option for spacing (description doesn't matter as it's at the end)
     longest_num = len(str(len(transponders)+1))
@@ -118,12 +304,77 @@ def user_transponder_selection(NORAD_ID: str) -> str:
         logging.log(logging.INFO ,"T: 3. frequency band letter will be 'H' if frequency if below VHF or 'O' if its above Ka band")
         logging.log(logging.INFO ,"M: Mode")
         logging.log(logging.INFO ,"D: Description")
+        logging.log(logging.INFO ,"Select several transponders separated by commas (like '2,1') to track them at the same time.")
+        logging.log(logging.INFO ,"Radios follow the first one unless their config selects another one with the 'transponder' key.")
         logging.log(logging.INFO ,"Press enter to return to selection")
         input()
-        return user_transponder_selection(NORAD_ID)
+        return user_transponder_selection(NORAD_ID, transponder_rows)
     else: # return selection
         try:
-            return list(transponders.items())[int(choice)-1][0]
+            return [list(transponders.items())[int(index)-1][0] for index in choice.split(",")]
         except Exception:
             logging.log(logging.ERROR, "Invalid choice!")
             exit()
+
+def _load_transponder_defaults() -> Dict[str, List[str]]:
+    try:
+        with open(paths.TRANSPONDER_DEFAULTS_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _remember_transponders(NORAD_ID: str, transponder_UUIDs: List[str]):
+    """Remember the selected transponders of a satellite, they're used by default the next time it's tracked."""
+    defaults = _load_transponder_defaults()
+    defaults[NORAD_ID] = transponder_UUIDs
+    with open(paths.TRANSPONDER_DEFAULTS_PATH, "w") as f:
+        json.dump(defaults, f, indent=4)
+
+def _resolve_transponder(NORAD_ID: str, transponders: List[Dict], selector: str) -> str:
+    """
+    Get the UUID of the transponder a selector refers to: a UUID, an index in the selection menu (starting at 1)
+    or a mode pattern (like "USB" or "FM*", case insensitive). A mode pattern picks the first matching transponder that is alive,
+    or the first matching one with a warning if none are. Exits if no transponder matches.
+    """
+    for trsp in transponders:
+        if trsp["uuid"] == selector:
+            return selector
+
+    if selector.isdigit():
+        if 1 <= int(selector) <= len(transponders):
+            return transponders[int(selector)-1]["uuid"]
+        logging.log(logging.ERROR, f"Transponder index {selector} is out of range, NORAD ID {NORAD_ID} has {len(transponders)} transponders.")
+        exit()
+
+    matches = [trsp for trsp in transponders if fnmatch.fnmatch((trsp["mode"] or "").lower(), selector.lower())]
+    if not matches:
+        logging.log(logging.ERROR, f"No transponder of NORAD ID {NORAD_ID} matches '{selector}'.")
+        exit()
+
+    alive_matches = [trsp for trsp in matches if trsp["alive"]]
+    if not alive_matches:
+        logging.log(logging.WARN, f"No transponder of NORAD ID {NORAD_ID} matching '{selector}' is alive, using '{matches[0]['description']}' anyway.")
+        return matches[0]["uuid"]
+    return alive_matches[0]["uuid"]
+
+def select_transponders(NORAD_ID: str, selectors: List[str] | None = None, choose: bool = False) -> List[Dict]:
+    """
+    Select the transponders to track on a satellite and return their rows (see `query_transponders`). They're selected by the given selectors
+    (see `_resolve_transponder`) if there are any, otherwise the transponders selected the last time the satellite was tracked are used.
+    If there are none or choose is set, the user is prompted. The selection is remembered for the next time.
+    """
+    transponders = query_transponders(NORAD_ID=NORAD_ID)
+    rows = {trsp["uuid"]: trsp for trsp in transponders}
+    if selectors:
+        transponder_UUIDs = [_resolve_transponder(NORAD_ID, transponders, selector) for selector in selectors]
+    else:
+        transponder_UUIDs = _load_transponder_defaults().get(NORAD_ID, [])
+        if (not choose) and transponder_UUIDs and set(transponder_UUIDs).issubset(rows):
+            logging.log(logging.INFO, f"Tracking the last selected transponder(s): {', '.join(rows[UUID]['description'] for UUID in transponder_UUIDs)}. Use --choose-transponder to select others.")
+            return [rows[UUID] for UUID in transponder_UUIDs]
+
+        logging.log(logging.INFO, "Please select which transponder(s) the radio(s) should track (or 'help' for help menu):")
+        transponder_UUIDs = user_transponder_selection(NORAD_ID, transponders)
+
+    _remember_transponders(NORAD_ID, transponder_UUIDs)
+    return [rows[UUID] for UUID in transponder_UUIDs]
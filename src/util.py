@@ -1,8 +1,7 @@
 from src import tle, paths
+from typing import Tuple
 import os, datetime, re, logging, shutil, socket
 
-last_port = 56000
-
 COSPAR_ID_REGEX = re.compile(r'^[0-9]{4}-[0-9]{3}[A-Z]{1,3}$')
 
 FREQUENCY_BAND_LETTERS = [
@@ -35,12 +34,6 @@ def decorated_input() -> str:
 
     return input(decorator_string)
 
-def _check_port_used(port: int) -> bool:
-    """A function to check if a port is in use"""
-
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(('localhost', port)) == 0
-    
 def get_frequency_band_letter(frequency: int) -> str:
     """A function to get a frequency band letter by the frequency in herz"""
     for lower, upper, letter in FREQUENCY_BAND_LETTERS:
@@ -50,27 +43,37 @@ def get_frequency_band_letter(frequency: int) -> str:
     
 def get_unused_port(purpose: str = "N/A") -> int:
     """
-    Get an unused port. Optionally provide the purpose for the port for logging.
+    Get an unused port assigned by the kernel. Optionally provide the purpose for the port for logging.
+    The port is free when this returns but isn't reserved, another process can take it before it's used. `hamlib_daemon.Hamlib_Daemon`
+    handles this by starting the daemon again on a new port if it fails to bind, and only treats it as ready once it answers a command.
     """
-    global last_port
-    
-    while True:
-        last_port += 1
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
 
-        if _check_port_used(last_port):
-            logging.log(logging.DEBUG, f"Port {last_port} is in use")
-        else:
-            logging.log(logging.DEBUG, f"Using port {last_port} for {purpose}")
-            return last_port
+    logging.log(logging.DEBUG, f"Using port {port} for {purpose}")
+    return port
+
+def parse_address(address: str) -> Tuple[str, int] | None:
+    """
+    Parse a "host:port" address (IPv6 hosts in square brackets). Returns a tuple of host and port, or None if the address is invalid.
+    """
+    host, _, port = address.rpartition(":")
+    host = host.strip("[]")
+    if (not host) or (not port.isdigit()) or (not 0 < int(port) < 65536):
+        return None
+    return (host, int(port))
 
-def satellite_norad_from_input(input: str) -> str:
+def satellite_norad_from_input(input: str, best_match: bool = False) -> str:
     """
     Get a satellite NORAD ID by either one of these input opions:
     1. Just the NORAD ID
-    2. The satellites name (input required if multiple matches)
+    2. The satellites name (input required if multiple matches, unless best_match is set)
     3. COSPAR ID
 
     Which of these was provided will be detected automatically.
+    If best_match is set and a name matches several satellites, one is picked without asking: an exact name match first,
+    then a name starting with the input, then the shortest name, then the lowest NORAD ID.
     """
 
     input = input.strip()
@@ -96,6 +99,14 @@ def satellite_norad_from_input(input: str) -> str:
         
         if len(search_hits) == 1:
             return search_hits[0][0]
+        elif best_match:
+            def match_rank(satellite: Tuple[str, str, str]) -> Tuple[bool, bool, int, int]:
+                name = satellite[2].lower().replace("-", " ").strip()
+                return (name != prepared_input, not name.startswith(prepared_input), len(name), int(satellite[0]))
+
+            best = min(search_hits, key=match_rank)
+            logging.log(logging.INFO, f"Found {len(search_hits)} satellites matching '{input}', picked {best[0]} \\ {best[2]}")
+            return best[0]
         else:
             logging.log(logging.INFO, f"Found multiple hits while searching for '{input}'. Select the index of the satellite you wish to pick.")
             for i, satellite in enumerate(search_hits):
@@ -0,0 +1,18 @@
+from src import emulators
+import os, threading
+
+import pytest
+
+@pytest.fixture
+def serve_emulator():
+    """Serve an emulated device on a pseudo-terminal in a background thread and return the path of the pty, which can be opened like a serial port."""
+    if os.name != "posix":
+        pytest.skip("Emulated devices require pseudo-terminals (POSIX only)")
+    pytest.importorskip("serial")
+
+    def serve(emulator) -> str:
+        master, path = emulators.open_pty()
+        threading.Thread(target=emulator.run, args=(master,), daemon=True).start()
+        return path
+
+    return serve
@@ -0,0 +1,92 @@
+from src import emulators, hamlib_client
+import socket, threading, time
+
+import pytest
+
+def _serve(response: bytes, chunk_size: int):
+    """Start a server that answers the first request with response, split into chunks of chunk_size bytes. Returns its port."""
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def handle():
+        connection, _ = server.accept()
+        with connection:
+            connection.recv(4096)
+            for i in range(0, len(response), chunk_size):
+                connection.sendall(response[i:i+chunk_size])
+                time.sleep(0.001)
+            connection.recv(4096) # Wait for the client to disconnect
+        server.close()
+
+    threading.Thread(target=handle, daemon=True).start()
+    return server.getsockname()[1]
+
+EXTENDED_RESPONSE = b"set_freq: 145800000\nRPRT 0\nget_freq:\nFrequency: 145800000\nRPRT 0\nget_split_vfo:\nRPRT -11\n"
+
+@pytest.mark.parametrize("chunk_size", [1, 7, len(EXTENDED_RESPONSE)])
+def test_extended_responses_are_framed_by_rprt(chunk_size):
+    client = hamlib_client.Hamlib_Client("127.0.0.1", _serve(EXTENDED_RESPONSE, chunk_size), timeout=5)
+    try:
+        set_frequency, get_frequency, get_split = client.pipeline(["F 145800000", "f", "s"])
+    finally:
+        client.close()
+
+    assert (set_frequency.values, set_frequency.code) == ([], 0)
+    assert (get_frequency.values, get_frequency.code) == (["145800000"], 0)
+    assert get_split.code == -11
+    with pytest.raises(hamlib_client.Hamlib_Error):
+        get_split.raise_for_code()
+
+@pytest.mark.parametrize("chunk_size", [1, 5])
+def test_plain_responses_are_framed_by_line_count(chunk_size):
+    client = hamlib_client.Hamlib_Client("127.0.0.1", _serve(b"RPRT 0\n145800000\n", chunk_size), timeout=5, extended=False)
+    try:
+        set_frequency, get_frequency = client.pipeline(["F 145800000", "f"])
+    finally:
+        client.close()
+
+    assert (set_frequency.values, set_frequency.code) == ([], 0)
+    assert get_frequency.values == ["145800000"]
+
+def test_incomplete_response_stays_in_buffer():
+    client = object.__new__(hamlib_client.Hamlib_Client)
+    client.extended = True
+    client.buffer = bytearray(b"get_freq:\nFrequency: 145800000\n")
+
+    assert client._parse_responses(["f"]) is None
+    client.buffer += b"RPRT 0\nget_freq:\n"
+    responses = client._parse_responses(["f"])
+    assert responses is not None and responses[0].values == ["145800000"]
+    assert client.buffer == bytearray(b"get_freq:\n")
+
+def test_dispatch_waits_for_the_slowest_device_only():
+    latencies = [0.1, 0.2, 0.3]
+    stand_ins = [emulators.Hamlib_Stand_In("rigctld", latency) for latency in latencies]
+    for stand_in in stand_ins:
+        stand_in.start()
+    clients = [hamlib_client.Hamlib_Client("localhost", stand_in.port, timeout=5) for stand_in in stand_ins]
+    try:
+        start_time = time.monotonic()
+        results = hamlib_client.dispatch([(client, ["F 145800000", "f"]) for client in clients])
+        duration = time.monotonic() - start_time
+    finally:
+        for client in clients:
+            client.close()
+
+    assert all(result[1].values == ["145800000"] for result in results) # type: ignore
+    assert max(latencies) <= duration < max(latencies) + 0.15 # Sequential exchanges would take the sum of the latencies
+
+def test_dispatch_returns_in_process_errors():
+    class Failing_Client():
+        def pipeline(self, commands):
+            raise RuntimeError("binding failed")
+
+    stand_in = emulators.Hamlib_Stand_In("rigctld")
+    stand_in.start()
+    client = hamlib_client.Hamlib_Client("localhost", stand_in.port, timeout=5)
+    try:
+        failed, result = hamlib_client.dispatch([(Failing_Client(), ["f"]), (client, ["f"])]) # type: ignore
+    finally:
+        client.close()
+
+    assert isinstance(failed, RuntimeError)
+    assert result[0].values == ["145000000"] # type: ignore
@@ -0,0 +1,66 @@
+from src import hamlib_daemon
+import os, socket, sys, threading, time
+
+import pytest
+
+# Runs a rigctld stand-in on the port appended by Hamlib_Daemon ("-t <port>")
+STAND_IN_ARGS = [sys.executable, "-c", "import sys; from src import emulators; emulators.Hamlib_Stand_In('rigctld', port=int(sys.argv[2])).run()"]
+
+@pytest.fixture(autouse=True)
+def importable_src(monkeypatch):
+    monkeypatch.setenv("PYTHONPATH", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def test_daemon_is_ready_once_it_answers():
+    daemon = hamlib_daemon.Hamlib_Daemon(STAND_IN_ARGS, "stand-in")
+    daemon.start()
+    try:
+        client = daemon.wait_until_ready()
+        assert client.command("F 145800000").ok
+        client.close()
+    finally:
+        daemon.terminate()
+
+def test_other_process_on_the_port_isnt_taken_for_the_daemon():
+    # Something else listens on the daemons port and never answers, while the daemon itself never starts listening
+    server = socket.create_server(("localhost", 0))
+    def accept():
+        while True:
+            connection, _ = server.accept()
+            threading.Thread(target=connection.recv, args=(4096,), daemon=True).start()
+    threading.Thread(target=accept, daemon=True).start()
+
+    daemon = hamlib_daemon.Hamlib_Daemon([sys.executable, "-c", "import time; time.sleep(30)"], "silent daemon", port=server.getsockname()[1])
+    daemon.start()
+    try:
+        with pytest.raises(hamlib_daemon.Daemon_Error):
+            daemon.wait_until_ready(timeout=1)
+    finally:
+        daemon.terminate()
+        server.close()
+
+def test_remove_isnt_blocked_by_a_restart(monkeypatch):
+    monkeypatch.setattr(hamlib_daemon, "SUPERVISOR_CHECK_INTERVAL", 0.05)
+    supervisor = hamlib_daemon.Hamlib_Supervisor()
+    daemon = hamlib_daemon.Hamlib_Daemon(STAND_IN_ARGS, "stand-in")
+    client = supervisor.launch([daemon])[0]
+    assert not isinstance(client, hamlib_daemon.Daemon_Error)
+    client.close()
+
+    restarting = threading.Event()
+    def slow_restart():
+        restarting.set()
+        time.sleep(2)
+        raise hamlib_daemon.Daemon_Error(daemon.name, "didn't come back")
+    monkeypatch.setattr(daemon, "restart", slow_restart)
+
+    supervisor.start()
+    try:
+        daemon.terminate()
+        assert restarting.wait(2)
+
+        start_time = time.monotonic()
+        supervisor.remove(daemon)
+        assert time.monotonic() - start_time < 0.5
+    finally:
+        supervisor.stop()
+        daemon.terminate()
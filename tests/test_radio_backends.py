@@ -0,0 +1,53 @@
+from src import emulators, hamlib_bindings, radio_backends
+
+import pytest
+
+def test_civ_frequency_encoding():
+    assert radio_backends.civ_encode_frequency(145800000) == bytes.fromhex("0000804501")
+    assert radio_backends.civ_encode_frequency(1296123450) == bytes.fromhex("5034129612")
+
+def test_yaesu_frequency_encoding():
+    assert radio_backends.yaesu_encode_frequency(145800000) == bytes.fromhex("14580000")
+    assert radio_backends.yaesu_encode_frequency(435123456) == bytes.fromhex("43512346") # Rounded to 10 Hz
+
+@pytest.mark.parametrize("frequency", [0, 7100000, 145800000, 435999990, 999999990])
+def test_frequency_round_trip(frequency):
+    assert radio_backends.civ_decode_frequency(radio_backends.civ_encode_frequency(frequency)) == frequency
+    assert radio_backends.yaesu_decode_frequency(radio_backends.yaesu_encode_frequency(frequency)) == round(frequency/10)*10
+
+def test_out_of_range_frequencies_are_refused():
+    assert radio_backends.civ_decode_frequency(radio_backends.civ_encode_frequency(9999999999)) == 9999999999
+    with pytest.raises(ValueError):
+        radio_backends.civ_encode_frequency(10**10)
+    with pytest.raises(ValueError):
+        radio_backends.yaesu_encode_frequency(1296123450)
+    with pytest.raises(ValueError):
+        radio_backends.yaesu_encode_frequency(-10)
+
+def test_civ_frame():
+    command = b"\x05" + radio_backends.civ_encode_frequency(145800000)
+    assert radio_backends.civ_frame(0xA2, 0xE0, command) == bytes.fromhex("FEFEA2E0050000804501FD")
+
+@pytest.mark.parametrize("protocol, vfos", [("civ", [None, "TX"]), ("yaesu", [None]), ("ft847", ["Main", "SatRX", "SatTX"])])
+def test_cat_client_against_emulator(serve_emulator, protocol, vfos):
+    rig = emulators.Rig_Emulator(protocol)
+    client = radio_backends.create_cat_client(protocol, serve_emulator(rig), 0, protocol)
+    try:
+        for index, vfo in enumerate(vfos):
+            set_command, get_command = ("I", "i") if vfo == "TX" else (f"F {vfo}" if vfo else "F", f"f {vfo}" if vfo else "f")
+            frequency = 145900000 + index*1000
+            set_response, get_response = client.pipeline([f"{set_command} {frequency}", get_command])
+            assert set_response.ok and get_response.ok
+            assert get_response.values == [str(frequency)]
+
+        assert client.command("F 1296000000").code == (0 if protocol == "civ" else radio_backends.HAMLIB_ERROR_REJECTED)
+        assert client.command("_").values == [protocol]
+    finally:
+        client.close()
+
+def test_cat_client_rejects_split_without_support(serve_emulator):
+    client = radio_backends.create_cat_client("yaesu", serve_emulator(emulators.Rig_Emulator("yaesu")), 0, "yaesu")
+    try:
+        assert client.command("S 1 VFOB").code == hamlib_bindings.HAMLIB_ERROR_NOT_AVAILABLE
+    finally:
+        client.close()
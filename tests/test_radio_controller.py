@@ -0,0 +1,61 @@
+from src import emulators, paths, radio_controller
+import json, logging, time
+
+import pytest
+
+@pytest.fixture
+def stand_in():
+    stand_in = emulators.Hamlib_Stand_In("rigctld")
+    stand_in.start()
+    return stand_in
+
+def _sdr_controller(monkeypatch, tmp_path, port: int, **config) -> radio_controller.Radio_Controller:
+    """Create a radio controller with a single SDR on a rigctl server at the given port."""
+    monkeypatch.setattr(paths, "RADIO_CONFIG_DIRECTORY_PATH", str(tmp_path))
+    with open(tmp_path / "test.json", "w") as f:
+        json.dump({"sdr": {"rigctl_port": port, **config}}, f)
+    return radio_controller.Radio_Controller("test", 435000000, None, None, None, None)
+
+def test_radio_read_on_every_update_is_still_set(monkeypatch, tmp_path, stand_in):
+    radio = _sdr_controller(monkeypatch, tmp_path, stand_in.port, readback_interval=0)
+    try:
+        radio.update(0)
+        for i in range(20):
+            radio.update_lock()
+            radio.update(i * 0.1)
+    finally:
+        radio.close()
+
+    channel = radio.channels[0]
+    assert stand_in.frequency == channel.quantize(radio.targets[channel])
+    assert stand_in.frequency < 435000000
+    assert radio.reads_sent == 20
+
+def test_rejected_set_is_retried_with_backoff(monkeypatch, tmp_path, stand_in, caplog):
+    sets = []
+    reply = stand_in._reply
+    def reject_sets(line: str) -> str:
+        if line.startswith("F"):
+            sets.append(line)
+            return "RPRT -9\n"
+        return reply(line)
+    monkeypatch.setattr(stand_in, "_reply", reject_sets)
+
+    radio = _sdr_controller(monkeypatch, tmp_path, stand_in.port)
+    try:
+        with caplog.at_level(logging.WARN):
+            radio.update(0)
+            assert radio.next_update_time() >= radio.last_update + radio_controller.RETRY_MIN_DELAY
+
+            for _ in range(5): # Within the retry delay, nothing is sent
+                radio.update(0)
+            assert len(sets) == 1
+
+            time.sleep(radio_controller.RETRY_MIN_DELAY)
+            radio.update(0)
+            assert len(sets) == 2
+            assert radio.next_update_time() >= radio.last_update + 2*radio_controller.RETRY_MIN_DELAY
+    finally:
+        radio.close()
+
+    assert len([record for record in caplog.records if "rejected" in record.message]) == 1
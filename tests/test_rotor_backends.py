@@ -0,0 +1,27 @@
+from src import emulators, rotor_backends
+import time
+
+import pytest
+
+@pytest.mark.parametrize("protocol", rotor_backends.NATIVE_BACKENDS)
+def test_native_backend_against_emulator(serve_emulator, protocol):
+    rotor = emulators.Simulated_Rotor(az_speed=200, el_speed=200)
+    backend = rotor_backends.create_native_backend(protocol, serve_emulator(emulators.Rotor_Emulator(protocol, rotor)), 0)
+    try:
+        assert backend.exchange(None, True) == pytest.approx((0, 0), abs=0.1)
+        assert backend.exchange((123, 45), False) is None
+
+        deadline = time.monotonic() + 5
+        position = backend.exchange(None, True)
+        while position != pytest.approx((123, 45), abs=0.5) and time.monotonic() < deadline:
+            time.sleep(0.05)
+            position = backend.exchange(None, True)
+    finally:
+        backend.close()
+
+    assert position == pytest.approx((123, 45), abs=0.5)
+    assert (rotor.target_azimuth, rotor.target_elevation) == (123, 45)
+
+def test_serial_rotor_backend_is_abstract():
+    with pytest.raises(TypeError):
+        rotor_backends.Serial_Rotor_Backend("/dev/null", 9600) # type: ignore
@@ -0,0 +1,24 @@
+from src import emulators, paths, rotor_controller
+import json
+
+import pytest
+
+def test_failed_command_is_not_counted_as_sent(monkeypatch, tmp_path, serve_emulator):
+    port = serve_emulator(emulators.Rotor_Emulator("gs232b", emulators.Simulated_Rotor()))
+    monkeypatch.setattr(paths, "ROTOR_CONFIG_DIRECTORY_PATH", str(tmp_path))
+    with open(tmp_path / "test.json", "w") as f:
+        json.dump({"usb_port": port, "rotctl_ID": 603, "min_az": 0, "max_az": 450, "min_el": 0, "max_el": 180, "control_type": 1, "home_on_end": False, "backend": "gs232b"}, f)
+    rotor = rotor_controller.Rotor_Controller("test")
+    try:
+        rotor._exchange((10, 20), False)
+
+        def fail(position, poll):
+            raise OSError("rotor unplugged")
+        monkeypatch.setattr(rotor.backend, "exchange", fail)
+        with pytest.raises(OSError):
+            rotor._exchange((30, 40), False)
+    finally:
+        rotor.close()
+
+    assert (rotor.commands_sent, rotor.commands_failed) == (1, 1)
+    assert (rotor.last_sent_az, rotor.last_sent_el) == (10, 20) # The failed command is sent again on the next update
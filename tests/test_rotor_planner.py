@@ -0,0 +1,30 @@
+from src import rotor_planner
+
+# A pass crossing north from west to east, at 1 second intervals
+NORTH_CROSSING = [(float(i), (330 + 5*i) % 360, 10 + i) for i in range(13)]
+
+def _plan(offset: int, max_az: int):
+    return rotor_planner._plan_option(NORTH_CROSSING, offset, False, 0, max_az, 0, 90, None, 3.0, 2.0)
+
+def test_plan_option_unwinds_at_the_azimuth_stop():
+    unwinds, _, azimuths, _ = _plan(0, 360)
+    assert unwinds == 1
+    assert azimuths[0] == 330 and azimuths[-1] == 30
+
+def test_plan_option_avoids_the_stop_with_a_shifted_frame():
+    unwinds, _, azimuths, _ = _plan(rotor_planner.frame_offset(2, 360), 360)
+    assert unwinds == 0
+    assert azimuths == [(azimuth + 180) % 360 for _, azimuth, _ in NORTH_CROSSING]
+
+def test_plan_option_uses_the_overlap_range():
+    unwinds, _, azimuths, _ = _plan(0, 450)
+    assert unwinds == 0
+    assert azimuths[0] == 330 and azimuths[-1] == 390
+
+def test_plan_pass_picks_the_control_type_without_unwinds():
+    plan = rotor_planner.plan_pass(NORTH_CROSSING, [1, 2], 0, 360, 0, 90)
+    assert plan is not None and plan.control_type == 2 and plan.unwinds == 0
+
+def test_frame_azimuth_wraps_at_360():
+    assert rotor_planner.frame_azimuth(270, rotor_planner.frame_offset(2, 450)) == 135
+    assert rotor_planner.frame_azimuth(90, rotor_planner.frame_offset(1, 450)) == 90
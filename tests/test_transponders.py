@@ -0,0 +1,63 @@
+from src import paths, transponders
+import json, logging
+
+import pytest
+
+ELEMENTS = [{"uuid": "a", "description": "Mode U/V → linear"}, {"uuid": "b", "alive": True, "nested": [1, {"x": "]"}]}]
+
+def _chunks(data: bytes, size: int):
+    return [data[i:i+size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_iter_json_array_across_chunk_boundaries(chunk_size):
+    data = json.dumps(ELEMENTS, ensure_ascii=False, indent=2).encode("utf-8")
+    assert list(transponders._iter_json_array(_chunks(data, chunk_size))) == ELEMENTS
+
+def test_iter_json_array_empty():
+    assert list(transponders._iter_json_array([b" [ ", b"]\n"])) == []
+
+@pytest.mark.parametrize("data", [b'{"uuid": "a"}', b'[{"uuid": "a"}, {"uuid"', b'[{"uuid": "a"}'])
+def test_iter_json_array_invalid(data):
+    with pytest.raises(json.JSONDecodeError):
+        list(transponders._iter_json_array(_chunks(data, 4)))
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size: int):
+        return _chunks(self.data, chunk_size)
+
+def _transmitters(count: int, satellites: int):
+    return [{"uuid": f"u{i}", "norad_cat_id": i % satellites, "type": "Transmitter", "mode": "FM", "description": f"Beacon {i}",
+             "downlink_low": 145000000+i, "alive": True} for i in range(count)]
+
+def test_download_transponders_in_batches(monkeypatch, tmp_path, caplog):
+    monkeypatch.setattr(paths, "TRANSPONDER_DATABASE_PATH", str(tmp_path / "transponders.sqlite"))
+    monkeypatch.setattr(paths, "LEGACY_TRANSPONDERS_DIRECTORY_PATH", str(tmp_path / "legacy"))
+    monkeypatch.setattr(transponders, "TRANSPONDER_WRITE_BATCH_SIZE", 7)
+    monkeypatch.setattr(transponders, "TRANSPONDER_DOWNLOAD_CHUNK_SIZE", 100)
+    data = _transmitters(100, 10)
+    monkeypatch.setattr(transponders.requests, "get", lambda *args, **kwargs: _Response(json.dumps(data).encode("utf-8")))
+    caplog.set_level(logging.INFO)
+
+    transponders.download_transponders()
+    rows = transponders.query_transponders(NORAD_ID="3")
+    assert [row["uuid"] for row in rows] == [f"u{i}" for i in range(3, 100, 10)]
+    assert [row["position"] for row in rows] == list(range(10))
+    assert "Transponders of 10 satellites updated, 0 unchanged, 0 removed" in caplog.text
+
+    data[3]["downlink_low"] = 435000000
+    data = [trsp for trsp in data if trsp["norad_cat_id"] != 7]
+    transponders.download_transponders()
+    assert transponders.query_transponders(UUID="u3")[0]["downlink_band"] == "U"
+    assert transponders.query_transponders(NORAD_ID="7") == []
+    assert "Transponders of 1 satellites updated, 8 unchanged, 1 removed" in caplog.text